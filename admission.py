@@ -0,0 +1,59 @@
+import time
+from collections import Counter
+
+
+class AdmissionController:
+    """Picks the quality tier new requests are processed at, from how long recent requests waited.
+
+    Waits (for a processing slot and in the batch queue) are smoothed into an
+    exponentially weighted moving average, which also halves every
+    ``half_life`` seconds without new observations so that an idle server
+    recovers. Every one of ``thresholds`` (seconds, ascending) that the
+    average has reached steps new requests down one tier of ``tiers``,
+    ordered from the most expensive; past the last tier they stay there.
+    Cheaper requests drain the queue, the average falls and the tiers step
+    back up. Only touched from the event loop thread.
+    """
+
+    def __init__(self, thresholds=(), tiers=('full',), smoothing=0.2, half_life=10.):
+        if list(thresholds) != sorted(thresholds):
+            raise ValueError(f'Wrong wait thresholds {thresholds}, they must be ascending.')
+        if not 0 < smoothing <= 1:
+            raise ValueError(f'Wrong smoothing {smoothing}.')
+        if half_life is not None and half_life <= 0:
+            raise ValueError(f'Wrong half-life {half_life}.')
+        self.thresholds = tuple(thresholds)
+        self.tiers = tuple(tiers)
+        self.smoothing = smoothing
+        self.half_life = half_life
+        self.wait = 0.
+        self._updated = time.monotonic()
+        self._admitted = Counter()
+
+    def observe(self, seconds):
+        """Account for a request that waited ``seconds`` before it was processed, rejected or abandoned."""
+        self._decay()
+        self.wait += self.smoothing * (seconds - self.wait)
+
+    def tier(self):
+        """The tier to process a new request at."""
+        self._decay()
+        level = sum(self.wait >= threshold for threshold in self.thresholds)
+        tier = self.tiers[min(level, len(self.tiers) - 1)]
+        self._admitted[tier] += 1
+        return tier
+
+    def stats(self):
+        self._decay()
+        return {
+            "wait": self.wait,
+            "thresholds": list(self.thresholds),
+            "tiers": list(self.tiers),
+            "admitted": dict(self._admitted),
+        }
+
+    def _decay(self):
+        now = time.monotonic()
+        if self.half_life is not None:
+            self.wait *= 0.5 ** ((now - self._updated) / self.half_life)
+        self._updated = now
@@ -1,13 +1,18 @@
 from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 import fastapi as _fapi
 import schemas as _schemas
 import services as _services
+import asyncio
+import contextlib
 import traceback
+from typing import Optional
+from PIL import UnidentifiedImageError
 
 
 app = FastAPI()
 
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to AI Photo Enhancer API"}
@@ -19,18 +24,154 @@ async def root():
     return {"message": "Welcome to the AI Photo Enhancer with FastAPI"}
 
 
+@app.get("/api/stats")
+def read_stats():
+    return _services.stats()
+
+
+# Prometheus scrape endpoint for the per-stage latency histograms
+@app.get("/metrics")
+def read_metrics(request: _fapi.Request):
+    body, content_type = _services.render_metrics(request.headers.get("accept", ""))
+    return Response(content=body, media_type=content_type)
+
+
+# Readiness probe: 200 once the weights are loaded and a warm-up inference has run, 503 before
+@app.get("/api/ready")
+def read_ready():
+    status = _services.readiness()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
 @app.post("/api/enhance/")
-async def enhance_image(enhanceBase: _schemas._EnhanceBase = _fapi.Depends()):
+async def enhance_image(request: _fapi.Request, enhanceBase: _schemas._EnhanceBase = _fapi.Depends()):
     
     try:
-        encoded_img = await _services.enhance(enhanceBase=enhanceBase)
+        output_format = _services.output_format(
+            format=enhanceBase.format, quality=enhanceBase.quality, compression=enhanceBase.compression
+        )
+    except ValueError as e:
+        raise _fapi.HTTPException(status_code=400, detail=str(e))
+
+    token = _request_token(request)
+    try:
+        async with _cancel_on_disconnect(request, token):
+            results = await _services.enhance(
+                enhanceBase=enhanceBase, trace_id=_trace_id(request), output_format=output_format, token=token
+            )
+    except (_services.PoolOverloaded, _services.ModelNotReady) as e:
+        return JSONResponse(
+            status_code=503,
+            content={"message": str(e)},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except _services.Cancelled as e:
+        return JSONResponse(status_code=_cancelled_status(e), content={"message": str(e)})
     except Exception as e:
         print(traceback.format_exc())
         return {"message": f"{e.args}"}
     
+    # "image" and "tier" keep the first result for clients that only ever sent one image
     payload = {
-        "mime" : "image/jpg",
-        "image": encoded_img
+        "mime" : output_format[0],
+        "image": results[0].image if results else None,
+        "tier": results[0].tier if results else None,
+        "results": results
         }
     
     return payload
+
+
+@app.post("/api/v2/enhance")
+async def enhance_image_v2(request: _fapi.Request, format: Optional[str] = None, quality: Optional[int] = None,
+                           compression: Optional[int] = None):
+    """Accepts the image as multipart/form-data (first file field) or as a raw request body.
+
+    The output format is the ``format`` parameter (jpeg, webp or png), else the
+    preferred one of the Accept header, else JPEG. A PNG is encoded while it is
+    streamed. The X-Quality-Tier header tells the quality tier it was enhanced at.
+    """
+    try:
+        output_format = _services.output_format(
+            request.headers.get("accept", ""), format=format, quality=quality, compression=compression
+        )
+    except ValueError as e:
+        raise _fapi.HTTPException(status_code=400, detail=str(e))
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        uploads = [value for value in form.values() if hasattr(value, "read")]
+        if not uploads:
+            raise _fapi.HTTPException(status_code=400, detail="No file in multipart body.")
+        data = await uploads[0].read()
+    else:
+        data = await request.body()
+    if not data:
+        raise _fapi.HTTPException(status_code=400, detail="Empty request body.")
+
+    token = _request_token(request)
+    try:
+        async with _cancel_on_disconnect(request, token):
+            chunks, tier = await _services.enhance_stream(
+                data, trace_id=_trace_id(request), output_format=output_format, token=token
+            )
+    except (_services.PoolOverloaded, _services.ModelNotReady) as e:
+        raise _fapi.HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except _services.Cancelled as e:
+        raise _fapi.HTTPException(status_code=_cancelled_status(e), detail=str(e))
+    except UnidentifiedImageError:
+        raise _fapi.HTTPException(status_code=400, detail="Cannot identify image file.")
+    except Exception as e:
+        print(traceback.format_exc())
+        raise _fapi.HTTPException(status_code=500, detail=f"{e.args}")
+
+    return StreamingResponse(
+        chunks, media_type=output_format[0], headers={"Vary": "Accept", "X-Quality-Tier": tier}
+    )
+
+
+def _request_token(request: _fapi.Request):
+    """Cancellation token of the request, due after REQUEST_TIMEOUT or the X-Request-Timeout header (seconds)."""
+    try:
+        return _services.request_token(request.headers.get("x-request-timeout"))
+    except ValueError as e:
+        raise _fapi.HTTPException(status_code=400, detail=str(e))
+
+
+@contextlib.asynccontextmanager
+async def _cancel_on_disconnect(request: _fapi.Request, token):
+    """Cancel ``token`` if the client disconnects while in the block.
+
+    Enter it only after the body was read: watching for the disconnect
+    consumes the messages of the request.
+    """
+    async def watch():
+        while not token.cancelled:
+            if await request.is_disconnected():
+                token.cancel("disconnect")
+                return
+            await asyncio.sleep(_services.DISCONNECT_POLL_SECONDS)
+
+    watcher = asyncio.create_task(watch())
+    try:
+        yield token
+    finally:
+        watcher.cancel()
+
+
+def _cancelled_status(cancelled):
+    # 499 (client closed request) is never seen by the client that went away, but shows in access logs
+    return 504 if cancelled.reason == "deadline" else 499
+
+
+def _trace_id(request: _fapi.Request):
+    """Trace id of the request from X-Trace-Id, or from a W3C traceparent header."""
+    trace_id = request.headers.get("x-trace-id")
+    if trace_id is None and "traceparent" in request.headers:
+        parts = request.headers["traceparent"].split("-")
+        trace_id = parts[1] if len(parts) == 4 else None
+    return trace_id
@@ -7,6 +7,7 @@ from copy import deepcopy
 from functools import partial
 from os import path as osp
 
+from basicsr.data.data_util import pad_collate
 from basicsr.data.prefetch_dataloader import PrefetchDataLoader
 from basicsr.utils import get_root_logger, scandir
 from basicsr.utils.dist_util import get_dist_info
@@ -45,7 +46,9 @@ def build_dataloader(dataset, dataset_opt, num_gpu=1, dist=False, sampler=None,
         dataset_opt (dict): Dataset options. It contains the following keys:
             phase (str): 'train' or 'val'.
             num_worker_per_gpu (int): Number of workers for each GPU.
-            batch_size_per_gpu (int): Training batch size for each GPU.
+            batch_size_per_gpu (int): Training batch size for each GPU. In the
+                val phase, the validation batch size (default 1); validation
+                with batches needs ``val.batch_metrics``.
         num_gpu (int): Number of GPUs. Used only in the train phase.
             Default: 1.
         dist (bool): Whether in distributed training. Used only in the train
@@ -75,7 +78,11 @@ def build_dataloader(dataset, dataset_opt, num_gpu=1, dist=False, sampler=None,
         dataloader_args['worker_init_fn'] = partial(
             worker_init_fn, num_workers=num_workers, rank=rank, seed=seed) if seed is not None else None
     elif phase in ['val', 'test']:  # validation
-        dataloader_args = dict(dataset=dataset, batch_size=1, shuffle=False, num_workers=0)
+        # images of different sizes are padded to a batch, see pad_collate
+        batch_size = dataset_opt.get('batch_size_per_gpu', 1)
+        dataloader_args = dict(dataset=dataset, batch_size=batch_size, shuffle=False, num_workers=0)
+        if batch_size > 1:
+            dataloader_args['collate_fn'] = pad_collate
     else:
         raise ValueError(f"Wrong dataset phase: {phase}. Supported ones are 'train', 'val' and 'test'.")
 
@@ -3,6 +3,7 @@ import numpy as np
 import torch
 from os import path as osp
 from torch.nn import functional as F
+from torch.utils.data import default_collate
 
 from basicsr.data.transforms import mod_crop
 from basicsr.utils import img2tensor, scandir
@@ -264,6 +265,34 @@ def paths_from_lmdb(folder):
     return paths
 
 
+def pad_collate(batch):
+    """Collate images of different sizes into a batch, padding them to the largest one.
+
+    ``lq`` and ``gt`` are padded at the bottom and right by repeating the
+    border pixels, and their sizes before padding are added as ``lq_size`` and
+    ``gt_size`` (LongTensor of shape (n, 2), (h, w) per image). Everything
+    else is collated as usual.
+
+    Args:
+        batch (list[dict]): Samples of a dataset.
+
+    Returns:
+        dict: The batch.
+    """
+    padded = {}
+    for key in ('lq', 'gt'):
+        if key not in batch[0]:
+            continue
+        imgs = [sample[key] for sample in batch]
+        h, w = max(img.shape[-2] for img in imgs), max(img.shape[-1] for img in imgs)
+        padded[key] = torch.stack([
+            F.pad(img[None], (0, w - img.shape[-1], 0, h - img.shape[-2]), mode='replicate')[0] for img in imgs
+        ])
+        padded[f'{key}_size'] = torch.tensor([img.shape[-2:] for img in imgs], dtype=torch.long)
+    rest = default_collate([{k: v for k, v in sample.items() if k not in padded} for sample in batch])
+    return {**rest, **padded}
+
+
 def generate_gaussian_kernel(kernel_size=13, sigma=1.6):
     """Generate Gaussian kernel used in `duf_downsample`.
 
@@ -1,10 +1,11 @@
 from copy import deepcopy
 
 from basicsr.utils.registry import METRIC_REGISTRY
+from .metric_engine import MetricEngine
 from .niqe import calculate_niqe
 from .psnr_ssim import calculate_psnr, calculate_ssim
 
-__all__ = ['calculate_psnr', 'calculate_ssim', 'calculate_niqe']
+__all__ = ['calculate_psnr', 'calculate_ssim', 'calculate_niqe', 'MetricEngine']
 
 
 def calculate_metric(data, opt):
@@ -0,0 +1,111 @@
+import torch
+
+from basicsr.utils import tensor2img
+from basicsr.utils.registry import METRIC_REGISTRY
+from .psnr_ssim import calculate_psnr_pt, calculate_ssim_pt
+
+# metrics with a PyTorch version, which takes batches of tensors
+_PT_METRICS = {
+    'calculate_psnr': calculate_psnr_pt,
+    'calculate_psnr_pt': calculate_psnr_pt,
+    'calculate_ssim': calculate_ssim_pt,
+    'calculate_ssim_pt': calculate_ssim_pt,
+}
+
+
+class MetricEngine:
+    """Accumulate metrics over batches of images on their device.
+
+    PSNR and SSIM are calculated on whole batches with their PyTorch versions
+    (``calculate_psnr_pt`` and ``calculate_ssim_pt``), after the images are
+    quantized to 8 bits as ``tensor2img`` does, so the results match those of
+    the NumPy versions on the saved images (up to the 1e-8 that the PyTorch
+    PSNR adds to the MSE, a few 1e-5 dB). Per metric, the sum and the sum of
+    squares of the results are kept on the device; the host only waits for
+    them in ``results``. Other metrics (e.g. NIQE) are
+    calculated on the CPU image by image, as before.
+
+    Args:
+        metrics_opt (dict): Metric name -> options with the metric ``type``,
+            as in the ``metrics`` of the validation options.
+    """
+
+    def __init__(self, metrics_opt):
+        self.metrics_opt = metrics_opt
+        self.reset()
+
+    def reset(self):
+        self._sums = {}
+        self._count = 0
+
+    @torch.no_grad()
+    def update(self, img, img2=None, sizes=None):
+        """Add the results of a batch.
+
+        Args:
+            img (Tensor): Images with range [0, 1], shape (n, 3/1, h, w), RGB.
+            img2 (Tensor): Reference images of the same shape, or None for
+                metrics without reference.
+            sizes (list[tuple[int]] | None): (h, w) of every image, for a
+                batch padded to a common size; only the top left (h, w) of
+                an image counts. None if nothing was padded.
+        """
+        for group, group2 in _unpad(img, img2, sizes):
+            quantized, quantized2 = _quantize(group), _quantize(group2)
+            for name, opt in self.metrics_opt.items():
+                opt = dict(opt)
+                metric_type = opt.pop('type')
+                if metric_type in _PT_METRICS:
+                    values = _PT_METRICS[metric_type](quantized, quantized2, **opt)
+                else:
+                    values = []
+                    for i in range(len(group)):
+                        data = {'img': tensor2img(group[i])}
+                        if group2 is not None:
+                            data['img2'] = tensor2img(group2[i])
+                        values.append(METRIC_REGISTRY.get(metric_type)(**data, **opt))
+                    values = torch.tensor(values, dtype=torch.float64, device=img.device)
+                values = values.to(torch.float64)
+                sums = torch.stack([values.sum(), (values**2).sum()])
+                self._sums[name] = sums if name not in self._sums else self._sums[name] + sums
+            self._count += len(group)
+
+    def results(self):
+        """Mean and standard deviation of every metric over the images added.
+
+        Returns:
+            dict: Metric name -> dict with ``mean``, ``std`` (population) and
+                ``count``.
+        """
+        names = list(self._sums)
+        if not names:
+            return {}
+        # the only transfer to the host
+        sums = torch.stack([self._sums[name] for name in names]).cpu().tolist()
+        results = {}
+        for name, (total, total_sq) in zip(names, sums):
+            mean = total / self._count
+            results[name] = {'mean': mean, 'std': max(total_sq / self._count - mean**2, 0.)**0.5, 'count': self._count}
+        return results
+
+
+def _quantize(img):
+    """Round to the 8-bit values of ``tensor2img``, back in [0, 1]."""
+    if img is None:
+        return None
+    return (img.float().clamp(0, 1) * 255.).round().to(torch.float64) / 255.
+
+
+def _unpad(img, img2, sizes):
+    """Groups of (img, img2) of the same size, cropped to it."""
+    if sizes is None:
+        return [(img, img2)]
+    groups = {}
+    for i, (h, w) in enumerate(sizes):
+        groups.setdefault((int(h), int(w)), []).append(i)
+    cropped = []
+    for (h, w), indices in groups.items():
+        index = torch.tensor(indices, device=img.device)
+        cropped.append((img.index_select(0, index)[..., :h, :w],
+                        None if img2 is None else img2.index_select(0, index)[..., :h, :w]))
+    return cropped
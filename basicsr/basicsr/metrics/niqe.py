@@ -1,4 +1,5 @@
 import cv2
+import functools
 import math
 import numpy as np
 import os
@@ -10,27 +11,149 @@ from basicsr.utils.matlab_functions import imresize
 from basicsr.utils.registry import METRIC_REGISTRY
 
 
-def estimate_aggd_param(block):
-    """Estimate AGGD (Asymmetric Generalized Gaussian Distribution) parameters.
+@functools.lru_cache(maxsize=None)
+def _aggd_table():
+    """Shape parameters of the AGGD and the ratio r(gam) of each, built once.
 
-    Args:
-        block (ndarray): 2D Image block.
-
-    Returns:
-        tuple: alpha (float), beta_l (float) and beta_r (float) for the AGGD
-            distribution (Estimating the parames in Equation 7 in the paper).
+    r(gam) increases strictly, so the shape that fits a ratio is found by
+    binary search.
     """
-    block = block.flatten()
     gam = np.arange(0.2, 10.001, 0.001)  # len = 9801
     gam_reciprocal = np.reciprocal(gam)
     r_gam = np.square(gamma(gam_reciprocal * 2)) / (gamma(gam_reciprocal) * gamma(gam_reciprocal * 3))
+    return gam, r_gam
+
+
+@functools.lru_cache(maxsize=None)
+def _pris_params():
+    """Official params estimated from the pristine dataset, loaded once."""
+    niqe_pris_params = np.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'niqe_pris_params.npz'))
+    return niqe_pris_params['mu_pris_param'], niqe_pris_params['cov_pris_param'], niqe_pris_params['gaussian_window']
+
+
+def _masked_mean(values, mask):
+    """Mean of ``values`` where ``mask`` is set, per row, summed like ``np.mean(row[mask_row])``."""
+    counts = mask.sum(axis=1)
+    sums = _reduce_sums(values[mask], counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums / counts).astype(values.dtype)
+
 
-    left_std = np.sqrt(np.mean(block[block < 0]**2))
-    right_std = np.sqrt(np.mean(block[block > 0]**2))
+# np.add.reduce sums a contiguous array in buffers of this many elements
+_REDUCE_BUFFER = 8192
+# numpy's pairwise summation adds up to this many elements in eight interleaved partial sums
+_PAIRWISE_BLOCK = 128
+
+
+def _reduce_sums(values, counts):
+    """``np.add.reduce`` of consecutive rows of ``counts`` elements of ``values``, rounded the same way.
+
+    np.add.reduce (and so np.mean) does not sum sequentially but pairwise,
+    buffer by buffer; the same additions are done here on all rows together.
+    Rows longer than two buffers are rare and summed one by one.
+    """
+    starts = np.cumsum(counts) - counts
+    values = np.concatenate([values, np.zeros(8, dtype=values.dtype)])
+    sums = _pairwise_sums(values, starts, np.minimum(counts, _REDUCE_BUFFER))
+    rest = counts - _REDUCE_BUFFER
+    second = (rest > 0) & (rest <= _REDUCE_BUFFER)
+    sums[second] += _pairwise_sums(values, starts[second] + _REDUCE_BUFFER, rest[second])
+    for row in np.flatnonzero(rest > _REDUCE_BUFFER):
+        sums[row] = np.add.reduce(values[starts[row]:starts[row] + counts[row]])
+    return sums
+
+
+def _pairwise_sums(values, starts, counts):
+    """numpy's pairwise summation of ``values[start:start + count]`` for every row.
+
+    Longer rows are split in two halves, the first a multiple of 8, until
+    they fit a block. All blocks are summed at once, then their sums are
+    added back up in the order of the splits.
+    """
+    leaves = []
+
+    def split(starts, counts):
+        longer = counts > _PAIRWISE_BLOCK
+        leaves.append((starts[~longer], counts[~longer]))
+        if longer.any():
+            starts, counts = starts[longer], counts[longer]
+            half = counts // 2 - counts // 2 % 8
+            split(starts, half)
+            split(starts + half, counts - half)
+
+    split(starts, counts)
+    leaf_sums = iter(np.split(_block_sums(values, *map(np.concatenate, zip(*leaves))),
+                              np.cumsum([len(leaf_counts) for _, leaf_counts in leaves])[:-1]))
+
+    def combine(starts, counts):
+        longer = counts > _PAIRWISE_BLOCK
+        sums = np.empty(len(counts), dtype=values.dtype)
+        sums[~longer] = next(leaf_sums)
+        if longer.any():
+            starts, counts = starts[longer], counts[longer]
+            half = counts // 2 - counts // 2 % 8
+            left = combine(starts, half)
+            sums[longer] = left + combine(starts + half, counts - half)
+        return sums
+
+    return combine(starts, counts)
+
+
+def _block_sums(values, starts, counts):
+    """numpy's sum of ``values[start:start + count]`` for rows of at most ``_PAIRWISE_BLOCK`` elements."""
+    sums = np.zeros(len(counts), dtype=values.dtype)
+    # fewer than 8: one after the other
+    short = counts < 8
+    for i in range(7):
+        sums[short] += np.where(i < counts[short], values[np.minimum(starts[short] + i, len(values) - 1)], 0)
+
+    # eight interleaved partial sums, combined pairwise, then the remainder one after the other
+    rows = np.flatnonzero(~short)
+    if len(rows):
+        start, count = starts[rows], counts[rows]
+        blocked = count - count % 8
+        partial = np.empty((len(rows), 8), dtype=values.dtype)
+        # blocks of the same length at once; reducing along a leading axis adds one row of 8 after the other
+        for length in np.unique(blocked):
+            same = np.flatnonzero(blocked == length)
+            eights = values[start[same, None] + np.arange(length)].reshape(len(same), -1, 8)
+            partial[same] = np.add.reduce(eights, axis=1)
+        result = (((partial[:, 0] + partial[:, 1]) + (partial[:, 2] + partial[:, 3])) +
+                  ((partial[:, 4] + partial[:, 5]) + (partial[:, 6] + partial[:, 7])))
+        for i in range(7):
+            result += np.where(i < count - blocked, values[start + blocked + i], 0)
+        sums[rows] = result
+    return sums
+
+
+def estimate_aggd_params(blocks):
+    """Estimate AGGD parameters of many blocks at once.
+
+    Args:
+        blocks (ndarray): Blocks with shape (n, h, w) (or (n, h * w)).
+
+    Returns:
+        tuple: alpha, beta_l and beta_r (ndarrays with shape (n,)), the same
+            values as ``estimate_aggd_param`` gives for each block.
+    """
+    gam, r_gam = _aggd_table()
+    blocks = np.ascontiguousarray(blocks.reshape(len(blocks), -1))
+    squares = blocks**2
+
+    left_std = np.sqrt(_masked_mean(squares, blocks < 0))
+    right_std = np.sqrt(_masked_mean(squares, blocks > 0))
     gammahat = left_std / right_std
-    rhat = (np.mean(np.abs(block)))**2 / np.mean(block**2)
+    rhat = np.mean(np.abs(blocks), axis=1)**2 / np.mean(squares, axis=1)
     rhatnorm = (rhat * (gammahat**3 + 1) * (gammahat + 1)) / ((gammahat**2 + 1)**2)
-    array_position = np.argmin((r_gam - rhatnorm)**2)
+
+    # the closest ratio is next to where rhatnorm would be inserted; of the candidates the
+    # first one with the smallest squared difference wins, as with argmin over the table
+    position = np.searchsorted(r_gam, rhatnorm)
+    candidates = np.clip(position[:, None] + np.arange(-2, 2), 0, len(r_gam) - 1)
+    array_position = candidates[np.arange(len(candidates)), np.argmin((r_gam[candidates] - rhatnorm[:, None])**2,
+                                                                      axis=1)]
+    # argmin over a table of NaN differences gives the first entry
+    array_position[np.isnan(rhatnorm)] = 0
 
     alpha = gam[array_position]
     beta_l = left_std * np.sqrt(gamma(1 / alpha) / gamma(3 / alpha))
@@ -38,17 +161,30 @@ def estimate_aggd_param(block):
     return (alpha, beta_l, beta_r)
 
 
-def compute_feature(block):
-    """Compute features.
+def estimate_aggd_param(block):
+    """Estimate AGGD (Asymmetric Generalized Gaussian Distribution) parameters.
 
     Args:
         block (ndarray): 2D Image block.
 
     Returns:
-        list: Features with length of 18.
+        tuple: alpha (float), beta_l (float) and beta_r (float) for the AGGD
+            distribution (Estimating the parames in Equation 7 in the paper).
+    """
+    return tuple(param[0] for param in estimate_aggd_params(block[None]))
+
+
+def compute_features(blocks):
+    """Compute the features of many blocks at once.
+
+    Args:
+        blocks (ndarray): Blocks with shape (n, h, w).
+
+    Returns:
+        ndarray: Features with shape (n, 18).
     """
     feat = []
-    alpha, beta_l, beta_r = estimate_aggd_param(block)
+    alpha, beta_l, beta_r = estimate_aggd_params(blocks)
     feat.extend([alpha, (beta_l + beta_r) / 2])
 
     # distortions disturb the fairly regular structure of natural images.
@@ -57,12 +193,24 @@ def compute_feature(block):
     # horizontal, vertical and diagonal orientations.
     shifts = [[0, 1], [1, 0], [1, 1], [1, -1]]
     for i in range(len(shifts)):
-        shifted_block = np.roll(block, shifts[i], axis=(0, 1))
-        alpha, beta_l, beta_r = estimate_aggd_param(block * shifted_block)
+        shifted_blocks = np.roll(blocks, shifts[i], axis=(1, 2))
+        alpha, beta_l, beta_r = estimate_aggd_params(blocks * shifted_blocks)
         # Eq. 8
         mean = (beta_r - beta_l) * (gamma(2 / alpha) / gamma(1 / alpha))
         feat.extend([alpha, mean, beta_l, beta_r])
-    return feat
+    return np.stack(feat, axis=1)
+
+
+def compute_feature(block):
+    """Compute features.
+
+    Args:
+        block (ndarray): 2D Image block.
+
+    Returns:
+        list: Features with length of 18.
+    """
+    return list(compute_features(block[None])[0])
 
 
 def niqe(img, mu_pris_param, cov_pris_param, gaussian_window, block_size_h=96, block_size_w=96):
@@ -109,18 +257,25 @@ def niqe(img, mu_pris_param, cov_pris_param, gaussian_window, block_size_h=96, b
         # normalize, as in Eq. 1 in the paper
         img_nomalized = (img - mu) / (sigma + 1)
 
-        feat = []
-        for idx_w in range(num_block_w):
-            for idx_h in range(num_block_h):
-                # process ecah block
-                block = img_nomalized[idx_h * block_size_h // scale:(idx_h + 1) * block_size_h // scale,
-                                      idx_w * block_size_w // scale:(idx_w + 1) * block_size_w // scale]
-                feat.append(compute_feature(block))
-
-        distparam.append(np.array(feat))
+        if block_size_h % scale or block_size_w % scale:
+            # blocks of uneven sizes
+            feat = []
+            for idx_w in range(num_block_w):
+                for idx_h in range(num_block_h):
+                    # process ecah block
+                    block = img_nomalized[idx_h * block_size_h // scale:(idx_h + 1) * block_size_h // scale,
+                                          idx_w * block_size_w // scale:(idx_w + 1) * block_size_w // scale]
+                    feat.append(compute_feature(block))
+            distparam.append(np.array(feat))
+        else:
+            # all blocks at once, column by column, as (num_blocks, bh, bw)
+            bh, bw = block_size_h // scale, block_size_w // scale
+            blocks = img_nomalized[:num_block_h * bh, :num_block_w * bw].reshape(num_block_h, bh, num_block_w, bw)
+            distparam.append(compute_features(blocks.transpose(2, 0, 1, 3).reshape(-1, bh, bw)))
 
         if scale == 1:
-            img = imresize(img / 255., scale=0.5, antialiasing=True)
+            # line by line, the vectorised imresize rounds differently and the scores would change
+            img = imresize(img / 255., scale=0.5, antialiasing=True, exact=True)
             img = img * 255.
 
     distparam = np.concatenate(distparam, axis=1)
@@ -172,12 +327,8 @@ def calculate_niqe(img, crop_border, input_order='HWC', convert_to='y', **kwargs
     Returns:
         float: NIQE result.
     """
-    ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
     # we use the official params estimated from the pristine dataset.
-    niqe_pris_params = np.load(os.path.join(ROOT_DIR, 'niqe_pris_params.npz'))
-    mu_pris_param = niqe_pris_params['mu_pris_param']
-    cov_pris_param = niqe_pris_params['cov_pris_param']
-    gaussian_window = niqe_pris_params['gaussian_window']
+    mu_pris_param, cov_pris_param, gaussian_window = _pris_params()
 
     img = img.astype(np.float32)
     if input_order != 'HW':
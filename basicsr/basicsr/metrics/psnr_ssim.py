@@ -1,4 +1,5 @@
 import cv2
+import functools
 import numpy as np
 import torch
 import torch.nn.functional as F
@@ -167,6 +168,24 @@ def calculate_ssim_pt(img, img2, crop_border, test_y_channel=False, **kwargs):
     return ssim
 
 
+@functools.lru_cache(maxsize=None)
+def _gaussian_kernel():
+    """The 1-D Gaussian kernel of SSIM (size 11, sigma 1.5), shape (11, 1).
+
+    The 11x11 window is its outer product, so filtering with the kernel
+    along the rows and then along the columns is filtering with the window.
+    """
+    kernel = cv2.getGaussianKernel(11, 1.5)
+    kernel.flags.writeable = False
+    return kernel
+
+
+@functools.lru_cache(maxsize=None)
+def _gaussian_kernel_pt(dtype, device):
+    """``_gaussian_kernel`` as a tensor of shape (1, 1, 11, 1), per dtype and device."""
+    return torch.from_numpy(_gaussian_kernel().copy()).view(1, 1, 11, 1).to(device=device, dtype=dtype)
+
+
 def _ssim(img, img2):
     """Calculate SSIM (structural similarity) for one channel images.
 
@@ -182,17 +201,20 @@ def _ssim(img, img2):
 
     c1 = (0.01 * 255)**2
     c2 = (0.03 * 255)**2
-    kernel = cv2.getGaussianKernel(11, 1.5)
-    window = np.outer(kernel, kernel.transpose())
+    kernel = _gaussian_kernel()
 
-    mu1 = cv2.filter2D(img, -1, window)[5:-5, 5:-5]  # valid mode for window size 11
-    mu2 = cv2.filter2D(img2, -1, window)[5:-5, 5:-5]
+    def filter_valid(x):
+        # the separable 11x11 Gaussian window, valid mode
+        return cv2.sepFilter2D(x, -1, kernel, kernel)[5:-5, 5:-5]
+
+    mu1 = filter_valid(img)
+    mu2 = filter_valid(img2)
     mu1_sq = mu1**2
     mu2_sq = mu2**2
     mu1_mu2 = mu1 * mu2
-    sigma1_sq = cv2.filter2D(img**2, -1, window)[5:-5, 5:-5] - mu1_sq
-    sigma2_sq = cv2.filter2D(img2**2, -1, window)[5:-5, 5:-5] - mu2_sq
-    sigma12 = cv2.filter2D(img * img2, -1, window)[5:-5, 5:-5] - mu1_mu2
+    sigma1_sq = filter_valid(img**2) - mu1_sq
+    sigma2_sq = filter_valid(img2**2) - mu2_sq
+    sigma12 = filter_valid(img * img2) - mu1_mu2
 
     ssim_map = ((2 * mu1_mu2 + c1) * (2 * sigma12 + c2)) / ((mu1_sq + mu2_sq + c1) * (sigma1_sq + sigma2_sq + c2))
     return ssim_map.mean()
@@ -213,18 +235,19 @@ def _ssim_pth(img, img2):
     c1 = (0.01 * 255)**2
     c2 = (0.03 * 255)**2
 
-    kernel = cv2.getGaussianKernel(11, 1.5)
-    window = np.outer(kernel, kernel.transpose())
-    window = torch.from_numpy(window).view(1, 1, 11, 11).expand(img.size(1), 1, 11, 11).to(img.dtype).to(img.device)
+    # the five maps to filter, filtered together with two 1-D passes of the separable window
+    maps = torch.cat([img, img2, img * img, img2 * img2, img * img2], dim=1)
+    kernel = _gaussian_kernel_pt(img.dtype, img.device).expand(maps.size(1), 1, 11, 1)
+    maps = F.conv2d(maps, kernel, stride=1, padding=0, groups=maps.size(1))  # valid mode
+    maps = F.conv2d(maps, kernel.transpose(2, 3), stride=1, padding=0, groups=maps.size(1))
+    mu1, mu2, img_sq, img2_sq, img_img2 = maps.chunk(5, dim=1)
 
-    mu1 = F.conv2d(img, window, stride=1, padding=0, groups=img.shape[1])  # valid mode
-    mu2 = F.conv2d(img2, window, stride=1, padding=0, groups=img2.shape[1])  # valid mode
     mu1_sq = mu1.pow(2)
     mu2_sq = mu2.pow(2)
     mu1_mu2 = mu1 * mu2
-    sigma1_sq = F.conv2d(img * img, window, stride=1, padding=0, groups=img.shape[1]) - mu1_sq
-    sigma2_sq = F.conv2d(img2 * img2, window, stride=1, padding=0, groups=img.shape[1]) - mu2_sq
-    sigma12 = F.conv2d(img * img2, window, stride=1, padding=0, groups=img.shape[1]) - mu1_mu2
+    sigma1_sq = img_sq - mu1_sq
+    sigma2_sq = img2_sq - mu2_sq
+    sigma12 = img_img2 - mu1_mu2
 
     cs_map = (2 * sigma12 + c2) / (sigma1_sq + sigma2_sq + c2)
     ssim_map = ((2 * mu1_mu2 + c1) / (mu1_sq + mu2_sq + c1)) * cs_map
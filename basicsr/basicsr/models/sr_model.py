@@ -5,7 +5,7 @@ from tqdm import tqdm
 
 from basicsr.archs import build_network
 from basicsr.losses import build_loss
-from basicsr.metrics import calculate_metric
+from basicsr.metrics import MetricEngine, calculate_metric
 from basicsr.utils import get_root_logger, imwrite, tensor2img
 from basicsr.utils.registry import MODEL_REGISTRY
 from .base_model import BaseModel
@@ -195,6 +195,14 @@ class SRModel(BaseModel):
         if with_metrics:
             self.metric_results = {metric: 0 for metric in self.metric_results}
 
+        if self.opt['val'].get('batch_metrics', False):
+            self._batch_validation(dataloader, dataset_name, current_iter, tb_logger, save_img)
+            return
+        if dataloader.batch_size != 1:
+            # the loop below only looks at the first image of every batch
+            raise ValueError(f'Validation dataset {dataset_name} has batch_size_per_gpu {dataloader.batch_size}; '
+                             'validation in batches needs val.batch_metrics.')
+
         metric_data = dict()
         if use_pbar:
             pbar = tqdm(total=len(dataloader), unit='image')
@@ -218,17 +226,7 @@ class SRModel(BaseModel):
             torch.cuda.empty_cache()
 
             if save_img:
-                if self.opt['is_train']:
-                    save_img_path = osp.join(self.opt['path']['visualization'], img_name,
-                                             f'{img_name}_{current_iter}.png')
-                else:
-                    if self.opt['val']['suffix']:
-                        save_img_path = osp.join(self.opt['path']['visualization'], dataset_name,
-                                                 f'{img_name}_{self.opt["val"]["suffix"]}.png')
-                    else:
-                        save_img_path = osp.join(self.opt['path']['visualization'], dataset_name,
-                                                 f'{img_name}_{self.opt["name"]}.png')
-                imwrite(sr_img, save_img_path)
+                self._save_validation_image(sr_img, img_name, dataset_name, current_iter)
 
             if with_metrics:
                 # calculate metrics
@@ -248,6 +246,77 @@ class SRModel(BaseModel):
 
             self._log_validation_metric_values(current_iter, dataset_name, tb_logger)
 
+    def _batch_validation(self, dataloader, dataset_name, current_iter, tb_logger, save_img):
+        """Validation with ``val.batch_metrics``: the metrics of whole batches are calculated on the device.
+
+        The dataloader may batch images of different sizes with ``pad_collate``;
+        the metrics then only see the part of every output that is not padding.
+        See ``MetricEngine``.
+        """
+        with_metrics = self.opt['val'].get('metrics') is not None
+        use_pbar = self.opt['val'].get('pbar', False)
+        engine = MetricEngine(self.opt['val']['metrics']) if with_metrics else None
+        scale = self.opt.get('scale', 1)
+
+        if use_pbar:
+            pbar = tqdm(total=len(dataloader.dataset), unit='image')
+
+        for val_data in dataloader:
+            self.feed_data(val_data)
+            self.test()
+
+            output = self.output.detach()
+            gt = self.gt.detach() if hasattr(self, 'gt') else None
+            if 'gt_size' in val_data:
+                sizes = val_data['gt_size'].tolist()
+            elif 'lq_size' in val_data:
+                sizes = (val_data['lq_size'] * scale).tolist()
+            else:
+                sizes = None
+            if engine is not None:
+                engine.update(output, gt, sizes)
+
+            img_names = [osp.splitext(osp.basename(path))[0] for path in val_data['lq_path']]
+            if save_img:
+                for i, img_name in enumerate(img_names):
+                    h, w = sizes[i] if sizes is not None else output.shape[-2:]
+                    self._save_validation_image(tensor2img(output[i, :, :h, :w]), img_name, dataset_name,
+                                                current_iter)
+
+            # tentative for out of GPU memory
+            del self.lq
+            del self.output
+            if hasattr(self, 'gt'):
+                del self.gt
+            torch.cuda.empty_cache()
+
+            if use_pbar:
+                pbar.update(len(img_names))
+                pbar.set_description(f'Test {img_names[-1]}')
+        if use_pbar:
+            pbar.close()
+
+        if with_metrics:
+            results = engine.results()
+            for metric in self.metric_results.keys():
+                self.metric_results[metric] = results[metric]['mean']
+                # update the best metric result
+                self._update_best_metric_result(dataset_name, metric, self.metric_results[metric], current_iter)
+
+            self._log_validation_metric_values(current_iter, dataset_name, tb_logger)
+
+    def _save_validation_image(self, img, img_name, dataset_name, current_iter):
+        if self.opt['is_train']:
+            save_img_path = osp.join(self.opt['path']['visualization'], img_name, f'{img_name}_{current_iter}.png')
+        else:
+            if self.opt['val']['suffix']:
+                save_img_path = osp.join(self.opt['path']['visualization'], dataset_name,
+                                         f'{img_name}_{self.opt["val"]["suffix"]}.png')
+            else:
+                save_img_path = osp.join(self.opt['path']['visualization'], dataset_name,
+                                         f'{img_name}_{self.opt["name"]}.png')
+        imwrite(img, save_img_path)
+
     def _log_validation_metric_values(self, current_iter, dataset_name, tb_logger):
         log_str = f'Validation {dataset_name}\n'
         for metric, value in self.metric_results.items():
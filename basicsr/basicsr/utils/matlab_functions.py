@@ -1,3 +1,4 @@
+import functools
 import math
 import numpy as np
 import torch
@@ -82,24 +83,89 @@ def calculate_weights_indices(in_length, out_length, scale, kernel, kernel_width
     return weights, indices, int(sym_len_s), int(sym_len_e)
 
 
+@functools.lru_cache(maxsize=128)
+def _resize_matrix(in_length, out_length, scale, antialiasing):
+    """Resize along one dimension as a sparse (out_length, in_length) matrix, cached.
+
+    Row k holds the weights of the input pixels of the k-th output pixel. The
+    symmetric padding of ``calculate_weights_indices`` is folded into the
+    matrix by mirroring the indices at both ends, as often as needed for
+    inputs shorter than the padding, so the input does not need to be padded.
+    """
+    weights, indices, sym_len_s, _ = calculate_weights_indices(in_length, out_length, scale, 'cubic', 4, antialiasing)
+    indices = (indices.long() - sym_len_s) % (2 * in_length)
+    indices = torch.where(indices >= in_length, 2 * in_length - 1 - indices, indices)
+    rows = torch.arange(out_length).view(-1, 1).expand_as(indices)
+    # mirrored taps may hit the same input pixel twice, their weights add up
+    matrix = torch.zeros(out_length, in_length).index_put_((rows, indices), weights, accumulate=True)
+    return matrix.to_sparse()
+
+
+def _resize_dim(img, dim, out_length, scale, antialiasing):
+    """Resize ``img`` along ``dim`` with one sparse matrix product over all the other dimensions."""
+    matrix = _resize_matrix(img.size(dim), out_length, scale, antialiasing).to(img.device)
+    img = img.movedim(dim, 0)
+    out = torch.sparse.mm(matrix, img.reshape(img.size(0), -1))
+    return out.view(out_length, *img.shape[1:]).movedim(0, dim)
+
+
+def _resize_dim_lines(img, dim, out_length, scale, antialiasing):
+    """Resize a (c, h, w) ``img`` along ``dim`` (1 or 2) one output line and channel at a time.
+
+    The products are the ones ``imresize`` computed before it was vectorised,
+    so the results are the same to the last bit.
+    """
+    in_length = img.size(dim)
+    weights, indices, sym_len_s, sym_len_e = calculate_weights_indices(in_length, out_length, scale, 'cubic', 4,
+                                                                       antialiasing)
+    # symmetric copying, repeated for inputs shorter than the padding
+    padding = np.pad(np.arange(in_length), (sym_len_s, max(sym_len_e, 0)), mode='symmetric')
+    img_aug = img.index_select(dim, torch.from_numpy(padding))
+
+    shape = list(img.shape)
+    shape[dim] = out_length
+    out = torch.empty(shape, dtype=img.dtype)
+    kernel_width = weights.size(1)
+    for i in range(out_length):
+        idx = int(indices[i][0])
+        for j in range(img.size(0)):
+            if dim == 1:
+                out[j, i, :] = img_aug[j, idx:idx + kernel_width, :].transpose(0, 1).mv(weights[i])
+            else:
+                out[j, :, i] = img_aug[j, :, idx:idx + kernel_width].mv(weights[i])
+    return out
+
+
 @torch.no_grad()
-def imresize(img, scale, antialiasing=True):
+def imresize(img, scale, antialiasing=True, exact=False):
     """imresize function same as MATLAB.
 
     It now only supports bicubic.
     The same scale applies for both height and width.
 
+    Every output row (then column) is a weighted sum of a few input rows
+    (columns). The weights are cached as a sparse matrix per input length,
+    output length and scale, and applied to all rows, channels and images in
+    one matrix product. The matrix product sums in another order than the
+    former line-by-line loop, so float results can differ from it in the last
+    ulp; ``exact`` keeps the loop, for callers such as NIQE whose results must
+    not change at all.
+
     Args:
         img (Tensor | Numpy array):
-            Tensor: Input image with shape (c, h, w), [0, 1] range.
+            Tensor: Input image with shape (c, h, w) or a batch with shape
+                (b, c, h, w), [0, 1] range.
             Numpy: Input image with shape (h, w, c), [0, 1] range.
         scale (float): Scale factor. The same scale applies for both height
             and width.
         antialisaing (bool): Whether to apply anti-aliasing when downsampling.
             Default: True.
+        exact (bool): Resize one line at a time as before, bit for bit.
+            Much slower on many channels or images. Default: False.
 
     Returns:
-        Tensor: Output image with shape (c, h, w), [0, 1] range, w/o round.
+        Tensor: Output image with shape (c, h, w) or (b, c, h, w), [0, 1]
+            range, w/o round.
     """
     squeeze_flag = False
     if type(img).__module__ == np.__name__:  # numpy type
@@ -113,60 +179,17 @@ def imresize(img, scale, antialiasing=True):
         if img.ndim == 2:
             img = img.unsqueeze(0)
             squeeze_flag = True
+        img = img.float()
 
-    in_c, in_h, in_w = img.size()
+    in_h, in_w = img.shape[-2:]
     out_h, out_w = math.ceil(in_h * scale), math.ceil(in_w * scale)
-    kernel_width = 4
-    kernel = 'cubic'
-
-    # get weights and indices
-    weights_h, indices_h, sym_len_hs, sym_len_he = calculate_weights_indices(in_h, out_h, scale, kernel, kernel_width,
-                                                                             antialiasing)
-    weights_w, indices_w, sym_len_ws, sym_len_we = calculate_weights_indices(in_w, out_w, scale, kernel, kernel_width,
-                                                                             antialiasing)
-    # process H dimension
-    # symmetric copying
-    img_aug = torch.FloatTensor(in_c, in_h + sym_len_hs + sym_len_he, in_w)
-    img_aug.narrow(1, sym_len_hs, in_h).copy_(img)
-
-    sym_patch = img[:, :sym_len_hs, :]
-    inv_idx = torch.arange(sym_patch.size(1) - 1, -1, -1).long()
-    sym_patch_inv = sym_patch.index_select(1, inv_idx)
-    img_aug.narrow(1, 0, sym_len_hs).copy_(sym_patch_inv)
-
-    sym_patch = img[:, -sym_len_he:, :]
-    inv_idx = torch.arange(sym_patch.size(1) - 1, -1, -1).long()
-    sym_patch_inv = sym_patch.index_select(1, inv_idx)
-    img_aug.narrow(1, sym_len_hs + in_h, sym_len_he).copy_(sym_patch_inv)
-
-    out_1 = torch.FloatTensor(in_c, out_h, in_w)
-    kernel_width = weights_h.size(1)
-    for i in range(out_h):
-        idx = int(indices_h[i][0])
-        for j in range(in_c):
-            out_1[j, i, :] = img_aug[j, idx:idx + kernel_width, :].transpose(0, 1).mv(weights_h[i])
-
-    # process W dimension
-    # symmetric copying
-    out_1_aug = torch.FloatTensor(in_c, out_h, in_w + sym_len_ws + sym_len_we)
-    out_1_aug.narrow(2, sym_len_ws, in_w).copy_(out_1)
-
-    sym_patch = out_1[:, :, :sym_len_ws]
-    inv_idx = torch.arange(sym_patch.size(2) - 1, -1, -1).long()
-    sym_patch_inv = sym_patch.index_select(2, inv_idx)
-    out_1_aug.narrow(2, 0, sym_len_ws).copy_(sym_patch_inv)
-
-    sym_patch = out_1[:, :, -sym_len_we:]
-    inv_idx = torch.arange(sym_patch.size(2) - 1, -1, -1).long()
-    sym_patch_inv = sym_patch.index_select(2, inv_idx)
-    out_1_aug.narrow(2, sym_len_ws + in_w, sym_len_we).copy_(sym_patch_inv)
-
-    out_2 = torch.FloatTensor(in_c, out_h, out_w)
-    kernel_width = weights_w.size(1)
-    for i in range(out_w):
-        idx = int(indices_w[i][0])
-        for j in range(in_c):
-            out_2[j, :, i] = out_1_aug[j, :, idx:idx + kernel_width].mv(weights_w[i])
+    if exact:
+        out_2 = torch.stack([
+            _resize_dim_lines(_resize_dim_lines(one, 1, out_h, scale, antialiasing), 2, out_w, scale, antialiasing)
+            for one in img.reshape(-1, *img.shape[-3:])
+        ]).view(*img.shape[:-2], out_h, out_w)
+    else:
+        out_2 = _resize_dim(_resize_dim(img, -2, out_h, scale, antialiasing), -1, out_w, scale, antialiasing)
 
     if squeeze_flag:
         out_2 = out_2.squeeze(0)
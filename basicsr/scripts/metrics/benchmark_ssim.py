@@ -0,0 +1,108 @@
+import argparse
+import cv2
+import numpy as np
+import time
+import torch
+import torch.nn.functional as F
+
+from basicsr.metrics.psnr_ssim import _ssim, _ssim_pth
+
+
+def ssim_2d(img, img2):
+    """``_ssim`` as it was: the 11x11 window built on every call, five 2-D filters."""
+    c1 = (0.01 * 255)**2
+    c2 = (0.03 * 255)**2
+    kernel = cv2.getGaussianKernel(11, 1.5)
+    window = np.outer(kernel, kernel.transpose())
+
+    mu1 = cv2.filter2D(img, -1, window)[5:-5, 5:-5]
+    mu2 = cv2.filter2D(img2, -1, window)[5:-5, 5:-5]
+    mu1_sq = mu1**2
+    mu2_sq = mu2**2
+    mu1_mu2 = mu1 * mu2
+    sigma1_sq = cv2.filter2D(img**2, -1, window)[5:-5, 5:-5] - mu1_sq
+    sigma2_sq = cv2.filter2D(img2**2, -1, window)[5:-5, 5:-5] - mu2_sq
+    sigma12 = cv2.filter2D(img * img2, -1, window)[5:-5, 5:-5] - mu1_mu2
+
+    ssim_map = ((2 * mu1_mu2 + c1) * (2 * sigma12 + c2)) / ((mu1_sq + mu2_sq + c1) * (sigma1_sq + sigma2_sq + c2))
+    return ssim_map.mean()
+
+
+def ssim_2d_pth(img, img2):
+    """``_ssim_pth`` as it was: the 11x11 window built on every call, five 2-D convolutions."""
+    c1 = (0.01 * 255)**2
+    c2 = (0.03 * 255)**2
+    kernel = cv2.getGaussianKernel(11, 1.5)
+    window = np.outer(kernel, kernel.transpose())
+    window = torch.from_numpy(window).view(1, 1, 11, 11).expand(img.size(1), 1, 11, 11).to(img.dtype).to(img.device)
+
+    mu1 = F.conv2d(img, window, stride=1, padding=0, groups=img.shape[1])
+    mu2 = F.conv2d(img2, window, stride=1, padding=0, groups=img2.shape[1])
+    mu1_sq = mu1.pow(2)
+    mu2_sq = mu2.pow(2)
+    mu1_mu2 = mu1 * mu2
+    sigma1_sq = F.conv2d(img * img, window, stride=1, padding=0, groups=img.shape[1]) - mu1_sq
+    sigma2_sq = F.conv2d(img2 * img2, window, stride=1, padding=0, groups=img.shape[1]) - mu2_sq
+    sigma12 = F.conv2d(img * img2, window, stride=1, padding=0, groups=img.shape[1]) - mu1_mu2
+
+    cs_map = (2 * sigma12 + c2) / (sigma1_sq + sigma2_sq + c2)
+    ssim_map = ((2 * mu1_mu2 + c1) / (mu1_sq + mu2_sq + c1)) * cs_map
+    return ssim_map.mean([1, 2, 3])
+
+
+def best_of(repeat, fn, *args):
+    """Best time of ``repeat`` runs and the result, or (None, error) if it runs out of memory."""
+    cuda = torch.is_tensor(args[0]) and args[0].is_cuda
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except RuntimeError as error:
+            return None, str(error).splitlines()[0]
+        if cuda:
+            torch.cuda.synchronize()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def report(name, old, new):
+    (old_seconds, old_result), (new_seconds, new_result) = old, new
+    if old_seconds is None:
+        print(f'{name}: {new_seconds * 1000:.0f} ms, before: failed ({old_result})')
+        return
+    diff = float((torch.as_tensor(old_result).cpu() - torch.as_tensor(new_result).cpu()).abs().max())
+    print(f'{name}: {new_seconds * 1000:.0f} ms, before: {old_seconds * 1000:.0f} ms '
+          f'({old_seconds / new_seconds:.1f}x), max difference {diff:.2e}')
+
+
+def main(args):
+    """Time ``_ssim`` and ``_ssim_pth`` against the 2-D windows they used before, on 4K images by default."""
+    rng = np.random.default_rng(0)
+    h, w = args.size
+    img = cv2.GaussianBlur(rng.uniform(0, 255, (h, w)), (0, 0), 2)
+    img2 = np.clip(img + rng.normal(0, 8, img.shape), 0, 255)
+    print(f'{w}x{h}, {args.channels} channel(s)')
+
+    old = best_of(args.repeat, lambda a, b: np.mean([ssim_2d(a, b) for _ in range(args.channels)]), img, img2)
+    new = best_of(args.repeat, lambda a, b: np.mean([_ssim(a, b) for _ in range(args.channels)]), img, img2)
+    report('calculate_ssim (numpy)', old, new)
+
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for device in devices:
+        for dtype in (torch.float64, torch.float32):
+            tensor = torch.from_numpy(img).to(device, dtype).expand(1, args.channels, h, w).contiguous()
+            tensor2 = torch.from_numpy(img2).to(device, dtype).expand(1, args.channels, h, w).contiguous()
+            new = best_of(args.repeat, _ssim_pth, tensor, tensor2)
+            old = best_of(args.repeat, ssim_2d_pth, tensor, tensor2)
+            report(f'calculate_ssim_pt ({device}, {dtype})', old, new)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, nargs=2, default=[2160, 3840], help='Image height and width')
+    parser.add_argument('--channels', type=int, default=3, help='Channels of the images')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per implementation, the best one is reported')
+    args = parser.parse_args()
+    main(args)
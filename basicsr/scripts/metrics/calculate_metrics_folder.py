@@ -0,0 +1,171 @@
+import argparse
+import csv
+import cv2
+import math
+import numpy as np
+import os
+import torch
+import warnings
+from multiprocessing import Pool
+from os import path as osp
+
+from basicsr.metrics import calculate_niqe, calculate_psnr, calculate_ssim
+from basicsr.utils import bgr2ycbcr, scandir
+
+METRICS = ('psnr', 'ssim', 'niqe')
+
+
+def score(task):
+    """Score one image in a worker process.
+
+    Args:
+        task (tuple): (name, restored image path, gt image path or None, options).
+
+    Returns:
+        dict: A row of the results: name, one column per metric and error.
+    """
+    name, restored_path, gt_path, opt = task
+    row = {'name': name, 'error': ''}
+    try:
+        img = cv2.imread(restored_path, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise IOError(f'Cannot read {restored_path}.')
+        if 'niqe' in opt['metrics']:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                row['niqe'] = calculate_niqe(img, opt['crop_border'], input_order='HWC', convert_to='y')
+        if 'psnr' in opt['metrics'] or 'ssim' in opt['metrics']:
+            img_gt = cv2.imread(gt_path, cv2.IMREAD_UNCHANGED)
+            if img_gt is None:
+                raise IOError(f'Cannot read {gt_path}.')
+            img_gt = img_gt.astype(np.float32) / 255.
+            img = img.astype(np.float32) / 255.
+            if opt['test_y_channel'] and img_gt.ndim == 3 and img_gt.shape[2] == 3:
+                img_gt = bgr2ycbcr(img_gt, y_only=True)
+                img = bgr2ycbcr(img, y_only=True)
+            if 'psnr' in opt['metrics']:
+                row['psnr'] = calculate_psnr(img_gt * 255, img * 255, crop_border=opt['crop_border'], input_order='HWC')
+            if 'ssim' in opt['metrics']:
+                row['ssim'] = calculate_ssim(img_gt * 255, img * 255, crop_border=opt['crop_border'], input_order='HWC')
+    except Exception as error:
+        row['error'] = f'{type(error).__name__}: {error}'
+    return row
+
+
+def init_worker():
+    # one thread per process, the processes already use all cores
+    cv2.setNumThreads(1)
+    torch.set_num_threads(1)
+
+
+def read_results(path, fields):
+    """Scored rows of a results file written before.
+
+    A last row cut off by an interruption and the rows with an error are left
+    out, so that their images are scored again.
+    """
+    if not osp.isfile(path):
+        return []
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames != fields:
+            raise ValueError(f'{path} has the columns {reader.fieldnames}, expected {fields}.')
+        return [row for row in reader if None not in row.values() and None not in row and not row['error']]
+
+
+def write_results(path, fields, rows):
+    """Write ``rows`` to a temporary file renamed to ``path``, so an interruption never loses the rows before."""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
+
+
+def list_tasks(args, metrics):
+    """(name, restored path, gt path) of every image, paired like calculate_psnr_ssim.py does."""
+    with_gt = 'psnr' in metrics or 'ssim' in metrics
+    img_list_restored = sorted(scandir(args.restored, recursive=True, full_path=True))
+    if not with_gt:
+        return [(osp.relpath(path, args.restored), path, None) for path in img_list_restored]
+
+    tasks = []
+    img_list_gt = sorted(scandir(args.gt, recursive=True, full_path=True))
+    for i, gt_path in enumerate(img_list_gt):
+        basename, ext = osp.splitext(osp.basename(gt_path))
+        if args.suffix == '':
+            restored_path = img_list_restored[i]
+        else:
+            restored_path = osp.join(args.restored, basename + args.suffix + ext)
+        tasks.append((osp.relpath(gt_path, args.gt), restored_path, gt_path))
+    return tasks
+
+
+def main(args):
+    """Score the images of a folder with a pool of processes, writing the results as they come.
+
+    Every image is read and scored in a worker process, so reading and
+    scoring are spread over all cores and the reads of some workers overlap
+    the computations of the others. Each result is appended to the CSV file
+    at once; started again with the same file, the images already scored in
+    it are skipped and the ones that failed are scored again.
+    """
+    metrics = [metric.strip() for metric in args.metrics.split(',')]
+    for metric in metrics:
+        if metric not in METRICS:
+            raise ValueError(f'Unknown metric {metric}, use some of {", ".join(METRICS)}.')
+    if ('psnr' in metrics or 'ssim' in metrics) and args.gt is None:
+        raise ValueError('PSNR and SSIM need --gt.')
+
+    fields = ['name'] + metrics + ['error']
+    done = read_results(args.output, fields)
+    scored = {row['name'] for row in done}
+    tasks = [task for task in list_tasks(args, metrics) if task[0] not in scored]
+    print(f'{len(scored)} images scored before, {len(tasks)} to go.')
+
+    opt = {'metrics': metrics, 'crop_border': args.crop_border, 'test_y_channel': args.test_y_channel}
+    workers = args.workers or os.cpu_count()
+    chunksize = args.chunksize or max(1, min(64, math.ceil(len(tasks) / (workers * 4))))
+
+    os.makedirs(osp.dirname(osp.abspath(args.output)), exist_ok=True)
+    # rewritten with the scored rows only, then appended to
+    write_results(args.output, fields, done)
+    with open(args.output, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        with Pool(workers, initializer=init_worker) as pool:
+            for i, row in enumerate(pool.imap_unordered(score, [task + (opt, ) for task in tasks], chunksize)):
+                writer.writerow(row)
+                f.flush()
+                done.append(row)
+                if row['error']:
+                    print(f'{i + 1:6d}: {row["name"]:25}. \t{row["error"]}')
+                elif args.verbose:
+                    values = ', '.join(f'{metric.upper()}: {float(row[metric]):.6f}' for metric in metrics)
+                    print(f'{i + 1:6d}: {row["name"]:25}. \t{values}')
+
+    ok = [row for row in done if not row['error']]
+    print(f'{len(ok)} images scored, {len(done) - len(ok)} failed.')
+    if ok:
+        averages = ', '.join(f'{metric.upper()}: {np.mean([float(row[metric]) for row in ok]):.6f}'
+                             for metric in metrics)
+        print(f'Average: {averages}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--restored', type=str, default='results/Set14', help='Path to restored images')
+    parser.add_argument('--gt', type=str, default=None, help='Path to gt (Ground-Truth), for PSNR and SSIM')
+    parser.add_argument('--metrics', type=str, default='psnr,ssim', help='Comma-separated: psnr, ssim, niqe')
+    parser.add_argument('--output', type=str, default='results/metrics.csv', help='CSV file of the results')
+    parser.add_argument('--crop_border', type=int, default=0, help='Crop border for each side')
+    parser.add_argument('--suffix', type=str, default='', help='Suffix for restored images')
+    parser.add_argument(
+        '--test_y_channel',
+        action='store_true',
+        help='If True, test Y channel (In MatLab YCbCr format). If False, test RGB channels.')
+    parser.add_argument('--workers', type=int, default=None, help='Processes. Default: number of CPUs')
+    parser.add_argument('--chunksize', type=int, default=None, help='Images handed to a worker at once')
+    parser.add_argument('--verbose', action='store_true', help='Print the results of every image')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import torch
+
+from basicsr.data.data_util import pad_collate
+from basicsr.metrics import MetricEngine, calculate_psnr, calculate_ssim
+from basicsr.utils import tensor2img
+
+METRICS = {
+    'psnr': dict(type='calculate_psnr', crop_border=2, test_y_channel=False),
+    'ssim': dict(type='calculate_ssim', crop_border=2, test_y_channel=True),
+}
+
+
+def _per_image(img, img2):
+    psnr, ssim = [], []
+    for i in range(len(img)):
+        sr, gt = tensor2img(img[i]), tensor2img(img2[i])
+        psnr.append(calculate_psnr(sr, gt, crop_border=2, test_y_channel=False))
+        ssim.append(calculate_ssim(sr, gt, crop_border=2, test_y_channel=True))
+    return {'psnr': psnr, 'ssim': ssim}
+
+
+def test_metric_engine():
+    """Test MetricEngine: the same results as the NumPy metrics image by image"""
+    gt = torch.rand(5, 3, 32, 40)
+    sr = (gt + torch.randn_like(gt) * 0.05).clamp(0, 1)
+
+    engine = MetricEngine(METRICS)
+    engine.update(sr[:3], gt[:3])
+    engine.update(sr[3:], gt[3:])
+    results = engine.results()
+
+    expected = _per_image(sr, gt)
+    for name in METRICS:
+        assert results[name]['count'] == 5
+        # calculate_psnr_pt adds 1e-8 to the MSE
+        assert results[name]['mean'] == pytest.approx(np.mean(expected[name]), abs=1e-4)
+        assert results[name]['std'] == pytest.approx(np.std(expected[name]), abs=1e-4)
+
+
+def test_metric_engine_padded():
+    """Test MetricEngine on a padded batch: padding is not part of the results"""
+    samples = [{'gt': torch.rand(3, h, w), 'gt_path': f'{i}.png'} for i, (h, w) in enumerate([(32, 40), (24, 40),
+                                                                                              (32, 28)])]
+    batch = pad_collate(samples)
+    assert batch['gt'].shape == (3, 3, 32, 40)
+    assert batch['gt_size'].tolist() == [[32, 40], [24, 40], [32, 28]]
+    assert batch['gt_path'] == ['0.png', '1.png', '2.png']
+    sr = (batch['gt'] + torch.randn_like(batch['gt']) * 0.05).clamp(0, 1)
+
+    padded = MetricEngine(METRICS)
+    padded.update(sr, batch['gt'], batch['gt_size'].tolist())
+    one_by_one = MetricEngine(METRICS)
+    for i, (h, w) in enumerate(batch['gt_size'].tolist()):
+        one_by_one.update(sr[i:i + 1, :, :h, :w], batch['gt'][i:i + 1, :, :h, :w])
+    for name in METRICS:
+        assert padded.results()[name]['mean'] == pytest.approx(one_by_one.results()[name]['mean'], abs=1e-10)
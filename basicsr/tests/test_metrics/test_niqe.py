@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+import os.path as osp
+import pytest
+from scipy.special import gamma
+
+from basicsr.metrics.niqe import _masked_mean, calculate_niqe, compute_feature, compute_features, estimate_aggd_params
+
+SAMPLES = osp.join(osp.dirname(__file__), '../../../samples')
+
+
+def _estimate_aggd_param(block):
+    """Reference: one block at a time, with argmin over the whole table."""
+    block = block.flatten()
+    gam = np.arange(0.2, 10.001, 0.001)
+    gam_reciprocal = np.reciprocal(gam)
+    r_gam = np.square(gamma(gam_reciprocal * 2)) / (gamma(gam_reciprocal) * gamma(gam_reciprocal * 3))
+
+    left_std = np.sqrt(np.mean(block[block < 0]**2))
+    right_std = np.sqrt(np.mean(block[block > 0]**2))
+    gammahat = left_std / right_std
+    rhat = (np.mean(np.abs(block)))**2 / np.mean(block**2)
+    rhatnorm = (rhat * (gammahat**3 + 1) * (gammahat + 1)) / ((gammahat**2 + 1)**2)
+    alpha = gam[np.argmin((r_gam - rhatnorm)**2)]
+    beta_l = left_std * np.sqrt(gamma(1 / alpha) / gamma(3 / alpha))
+    beta_r = right_std * np.sqrt(gamma(1 / alpha) / gamma(3 / alpha))
+    return (alpha, beta_l, beta_r)
+
+
+def test_estimate_aggd_params():
+    """Test estimate_aggd_params: the same values as block by block"""
+    rng = np.random.default_rng(0)
+    blocks = rng.standard_normal((6, 48, 48)).astype(np.float32) * rng.uniform(0.1, 3, (6, 1, 1)).astype(np.float32)
+    blocks[1] = np.abs(blocks[1])  # no negative values
+    blocks[2] *= rng.random((48, 48)) > 0.8
+    blocks[3] = rng.laplace(size=(48, 48))
+
+    with np.errstate(invalid='ignore'):
+        params = estimate_aggd_params(blocks)
+        for i, block in enumerate(blocks):
+            expected = _estimate_aggd_param(block)
+            np.testing.assert_array_equal([param[i] for param in params], expected)
+
+
+def test_compute_features():
+    """Test compute_features: the same values as compute_feature"""
+    blocks = np.random.default_rng(1).standard_normal((4, 48, 48)).astype(np.float32)
+    features = compute_features(blocks)
+    assert features.shape == (4, 18)
+    for block, feature in zip(blocks, features):
+        np.testing.assert_array_equal(compute_feature(block), feature)
+
+
+def test_calculate_niqe():
+    """Test calculate_niqe"""
+    img = np.random.default_rng(2).integers(0, 256, (200, 300, 3)).astype(np.uint8)
+    out = calculate_niqe(img, crop_border=0)
+    assert isinstance(out, float)
+    assert out == calculate_niqe(img, crop_border=0)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_masked_mean(dtype):
+    """Test _masked_mean: the same values as np.mean row by row, rows of every length up to three buffers"""
+    rng = np.random.default_rng(3)
+    counts = np.concatenate([np.arange(300), rng.integers(300, 20000, 40), [8192, 8193, 16384, 16385, 20000]])
+    values = rng.standard_normal((len(counts), 20000)).astype(dtype)
+    mask = np.zeros(values.shape, dtype=bool)
+    for row, count in enumerate(counts):
+        mask[row, rng.permutation(20000)[:count]] = True
+
+    with np.errstate(invalid='ignore'):
+        expected = np.array([np.mean(row[row_mask]) for row, row_mask in zip(values, mask)], dtype=dtype)
+        out = _masked_mean(values, mask)
+    assert out.dtype == dtype
+    np.testing.assert_array_equal(out, expected)
+
+
+@pytest.mark.parametrize('name, score', [('obama.jpg', 6.801180426445624), ('family.jpg', 4.929084386193558)])
+def test_calculate_niqe_baseline(name, score):
+    """Test calculate_niqe: the scores of the shipped samples have not changed"""
+    img = cv2.imread(osp.join(SAMPLES, name))
+    assert calculate_niqe(img, crop_border=0) == pytest.approx(score, rel=0, abs=1e-10)
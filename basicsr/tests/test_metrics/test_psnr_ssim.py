@@ -1,7 +1,10 @@
+import cv2
 import numpy as np
 import pytest
+import torch
+import torch.nn.functional as F
 
-from basicsr.metrics.psnr_ssim import calculate_psnr, calculate_ssim
+from basicsr.metrics.psnr_ssim import calculate_psnr, calculate_ssim, calculate_ssim_pt
 
 
 def test_calculate_psnr():
@@ -36,3 +39,36 @@ def test_calculate_ssim():
 
     out = calculate_ssim(np.ones((10, 10, 3)), np.ones((10, 10, 3)) * 2, crop_border=1, test_y_channel=True)
     assert isinstance(out, float)
+
+
+def _ssim_2d(img, img2):
+    """SSIM of one channel with the 2-D 11x11 window, as calculated before it was separated."""
+    c1 = (0.01 * 255)**2
+    c2 = (0.03 * 255)**2
+    kernel = cv2.getGaussianKernel(11, 1.5)
+    window = torch.from_numpy(np.outer(kernel, kernel.transpose())).view(1, 1, 11, 11)
+    img, img2 = torch.from_numpy(img)[None, None], torch.from_numpy(img2)[None, None]
+    mu1, mu2 = F.conv2d(img, window), F.conv2d(img2, window)
+    sigma1_sq = F.conv2d(img * img, window) - mu1**2
+    sigma2_sq = F.conv2d(img2 * img2, window) - mu2**2
+    sigma12 = F.conv2d(img * img2, window) - mu1 * mu2
+    ssim_map = ((2 * mu1 * mu2 + c1) * (2 * sigma12 + c2)) / ((mu1**2 + mu2**2 + c1) * (sigma1_sq + sigma2_sq + c2))
+    return ssim_map.mean().item()
+
+
+def test_calculate_ssim_separable():
+    """Test metric: calculate_ssim and calculate_ssim_pt match the 2-D window"""
+
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (2, 3, 40, 52)).astype(np.float64)
+    img2 = np.clip(img + rng.normal(0, 20, img.shape), 0, 255).round()
+    expected = [np.mean([_ssim_2d(img[i, c, 2:-2, 2:-2], img2[i, c, 2:-2, 2:-2]) for c in range(3)]) for i in range(2)]
+
+    for i in range(2):
+        out = calculate_ssim(img[i], img2[i], crop_border=2, input_order='CHW')
+        assert out == pytest.approx(expected[i], abs=1e-6)
+
+    for dtype in [torch.float64, torch.float32]:
+        tensor, tensor2 = torch.from_numpy(img / 255.).to(dtype), torch.from_numpy(img2 / 255.).to(dtype)
+        out = calculate_ssim_pt(tensor, tensor2, crop_border=2)
+        assert out.tolist() == pytest.approx(expected, abs=1e-6)
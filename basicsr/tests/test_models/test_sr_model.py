@@ -1,8 +1,13 @@
+import cv2
+import os
+import pytest
 import tempfile
 import torch
+import torch.nn.functional as F
 import yaml
 
 from basicsr.archs.srresnet_arch import MSRResNet
+from basicsr.data.data_util import pad_collate
 from basicsr.data.paired_image_dataset import PairedImageDataset
 from basicsr.losses.basic_loss import L1Loss, PerceptualLoss
 from basicsr.models.sr_model import SRModel
@@ -163,3 +168,96 @@ val:
         # check metric_results
         assert 'psnr' in model.metric_results
         assert isinstance(model.metric_results['psnr'], float)
+
+    # batches need val.batch_metrics
+    dataloader = torch.utils.data.DataLoader(dataset=dataset, batch_size=2, shuffle=False, num_workers=0)
+    with pytest.raises(ValueError, match='batch_metrics'):
+        model.nondist_validation(dataloader, 1, None, save_img=False)
+
+
+class _ValDataset(torch.utils.data.Dataset):
+    """Pairs of different sizes, the gt close to a nearest-neighbour x4 upsampling of the lq."""
+
+    def __init__(self, with_gt=True):
+        self.opt = dict(name='Val')
+        self.with_gt = with_gt
+        generator = torch.Generator().manual_seed(0)
+        self.lqs = [torch.rand(3, h, w, generator=generator) for h, w in [(8, 10), (6, 10), (8, 7)]]
+        self.gts = []
+        for lq in self.lqs:
+            gt = F.interpolate(lq[None], scale_factor=4)[0]
+            self.gts.append((gt + torch.randn(gt.shape, generator=generator) * 0.05).clamp(0, 1))
+
+    def __len__(self):
+        return len(self.lqs)
+
+    def __getitem__(self, index):
+        sample = {'lq': self.lqs[index], 'lq_path': f'img{index}.png'}
+        if self.with_gt:
+            sample.update(gt=self.gts[index], gt_path=f'img{index}.png')
+        return sample
+
+
+def test_srmodel_batch_validation():
+    """Test SRModel validation with val.batch_metrics on CPU: the same as image by image"""
+    opt = yaml.safe_load(r"""
+scale: 4
+num_gpu: 0
+is_train: False
+dist: False
+name: demo
+network_g:
+  type: MSRResNet
+  num_in_ch: 3
+  num_out_ch: 3
+  num_feat: 4
+  num_block: 1
+  upscale: 4
+path:
+  pretrain_network_g: ~
+val:
+  suffix: ~
+  metrics:
+    psnr:
+      type: calculate_psnr
+      crop_border: 4
+      test_y_channel: false
+    ssim:
+      type: calculate_ssim
+      crop_border: 4
+      test_y_channel: true
+""")
+    model = SRModel(opt)
+    # acts on every pixel alone, so the padding of a batch does not leak into the images
+    model.net_g = torch.nn.Upsample(scale_factor=4, mode='nearest')
+
+    def validate(dataset, batch_size, tmpdir):
+        model.opt['path']['visualization'] = tmpdir
+        model.opt['val']['batch_metrics'] = batch_size > 1
+        dataloader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, collate_fn=pad_collate)
+        model.nondist_validation(dataloader, 1, None, save_img=True)
+        folder = os.path.join(tmpdir, 'Val')
+        return {name: cv2.imread(os.path.join(folder, name), cv2.IMREAD_UNCHANGED) for name in os.listdir(folder)}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        expected_imgs = validate(_ValDataset(), 1, os.path.join(tmpdir, 'one_by_one'))
+        expected_metrics = dict(model.metric_results)
+
+        # images cropped by gt_size
+        del model.best_metric_results
+        imgs = validate(_ValDataset(), 3, os.path.join(tmpdir, 'batch'))
+        # images cropped by lq_size * scale, nothing to calculate the metrics against
+        model.opt['val']['metrics'] = None
+        imgs_without_gt = validate(_ValDataset(with_gt=False), 2, os.path.join(tmpdir, 'batch_without_gt'))
+
+    assert sorted(expected_imgs) == ['img0_demo.png', 'img1_demo.png', 'img2_demo.png']
+    for name, expected in expected_imgs.items():
+        assert expected.shape[:2] in [(32, 40), (24, 40), (32, 28)]
+        assert (imgs[name] == expected).all()
+        assert (imgs_without_gt[name] == expected).all()
+
+    for metric in ('psnr', 'ssim'):
+        # from the metric engine, calculate_psnr_pt adds 1e-8 to the MSE
+        assert model.metric_results[metric] == pytest.approx(expected_metrics[metric], abs=1e-4)
+        assert model.best_metric_results['Val'][metric]['val'] == model.metric_results[metric]
+        assert model.best_metric_results['Val'][metric]['iter'] == 1
@@ -0,0 +1,149 @@
+import argparse
+import csv
+import cv2
+import importlib.util
+import numpy as np
+import os
+import os.path as osp
+import pytest
+import subprocess
+import sys
+
+SCRIPT = osp.join(osp.dirname(__file__), '../../scripts/metrics/calculate_metrics_folder.py')
+NAMES = [f'{i:03d}.png' for i in range(6)]
+FIELDS = ['name', 'psnr', 'error']
+
+
+@pytest.fixture
+def script():
+    spec = importlib.util.spec_from_file_location('calculate_metrics_folder', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def folders(tmp_path):
+    """6 gt images and their restored versions, the last one unreadable."""
+    rng = np.random.default_rng(0)
+    for name in NAMES:
+        gt = rng.integers(0, 256, (24, 32, 3), dtype=np.uint8)
+        restored = np.clip(gt + rng.integers(-8, 9, gt.shape), 0, 255).astype(np.uint8)
+        (tmp_path / 'gt').mkdir(exist_ok=True)
+        (tmp_path / 'restored').mkdir(exist_ok=True)
+        cv2.imwrite(str(tmp_path / 'gt' / name), gt)
+        cv2.imwrite(str(tmp_path / 'restored' / name), restored)
+    (tmp_path / 'restored' / NAMES[-1]).write_bytes(b'not an image')
+    return tmp_path
+
+
+def _args(folders):
+    return argparse.Namespace(
+        restored=str(folders / 'restored'), gt=str(folders / 'gt'), metrics='psnr', output=str(folders / 'out.csv'),
+        crop_border=0, suffix='', test_y_channel=False, workers=1, chunksize=1, verbose=False)
+
+
+def _rows(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+class _Interrupted(Exception):
+    pass
+
+
+class _Pool:
+    """multiprocessing.Pool in this process; interrupted after ``stop_after`` results, as by Ctrl+C."""
+
+    def __init__(self, stop_after=None):
+        self.stop_after = stop_after
+        self.tasks = []
+
+    def __call__(self, workers, initializer=None):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def imap_unordered(self, fn, tasks, chunksize=1):
+        for i, task in enumerate(tasks):
+            if i == self.stop_after:
+                raise _Interrupted()
+            self.tasks.append(task[0])
+            yield fn(task)
+
+
+def test_scores_with_processes(script, folders):
+    """Run as a script, with a pool of processes"""
+    root = osp.abspath(osp.join(osp.dirname(__file__), '../..'))
+    command = [
+        sys.executable, SCRIPT, '--restored', str(folders / 'restored'), '--gt', str(folders / 'gt'), '--metrics',
+        'psnr', '--output', str(folders / 'out.csv'), '--workers', '2'
+    ]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    subprocess.run(command, check=True, env=env, capture_output=True)
+
+    rows = {row['name']: row for row in _rows(folders / 'out.csv')}
+    assert sorted(rows) == NAMES
+    expected = script.score((NAMES[0], str(folders / 'restored' / NAMES[0]), str(folders / 'gt' / NAMES[0]),
+                             {'metrics': ['psnr'], 'crop_border': 0, 'test_y_channel': False}))
+    assert float(rows[NAMES[0]]['psnr']) == pytest.approx(expected['psnr'])
+    assert all(not rows[name]['error'] for name in NAMES[:-1])
+    assert rows[NAMES[-1]]['error'].startswith('OSError')
+
+
+def test_interrupted_then_resumed(script, folders, monkeypatch):
+    output = folders / 'out.csv'
+    first = _Pool(stop_after=3)
+    monkeypatch.setattr(script, 'Pool', first)
+    with pytest.raises(_Interrupted):
+        script.main(_args(folders))
+    # every result is on disk as soon as it came in
+    assert [row['name'] for row in _rows(output)] == first.tasks == NAMES[:3]
+
+    second = _Pool()
+    monkeypatch.setattr(script, 'Pool', second)
+    script.main(_args(folders))
+    # only the images not scored before
+    assert second.tasks == NAMES[3:]
+    assert [row['name'] for row in _rows(output)] == NAMES
+
+
+def test_resume_skips_scored_and_retries_failed(script, folders, monkeypatch):
+    output = folders / 'out.csv'
+    with open(output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        # scored before (the value shows it is kept, not computed again), failed before, cut off
+        writer.writerow({'name': NAMES[0], 'psnr': '99.0', 'error': ''})
+        writer.writerow({'name': NAMES[1], 'psnr': '', 'error': 'OSError: Cannot read it.'})
+        writer.writerow({'name': NAMES[2], 'psnr': '98.0', 'error': ''})
+        f.write(f'{NAMES[3]},31.')
+
+    pool = _Pool(stop_after=0)
+    monkeypatch.setattr(script, 'Pool', pool)
+    with pytest.raises(_Interrupted):
+        script.main(_args(folders))
+    # rewritten with the scored rows only before anything is appended
+    assert _rows(output) == [
+        {'name': NAMES[0], 'psnr': '99.0', 'error': ''}, {'name': NAMES[2], 'psnr': '98.0', 'error': ''}
+    ]
+
+    pool = _Pool()
+    monkeypatch.setattr(script, 'Pool', pool)
+    script.main(_args(folders))
+    assert pool.tasks == [NAMES[1], NAMES[3], NAMES[4], NAMES[5]]
+    rows = _rows(output)
+    assert [row['name'] for row in rows] == [NAMES[0], NAMES[2], NAMES[1], NAMES[3], NAMES[4], NAMES[5]]
+    assert rows[0]['psnr'] == '99.0' and rows[1]['psnr'] == '98.0'
+    assert not rows[2]['error'] and float(rows[2]['psnr']) > 20
+    assert rows[-1]['error']
+
+
+def test_other_columns_rejected(script, folders):
+    (folders / 'out.csv').write_text('name,niqe,error\n')
+    with pytest.raises(ValueError):
+        script.main(_args(folders))
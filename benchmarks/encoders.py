@@ -0,0 +1,73 @@
+"""Compare OpenCV's encoders, which the service uses, with PIL's for every output format.
+
+Both start from the BGR output of the models, so PIL also pays for the
+conversion to RGB. Run from the repository root with
+
+    python benchmarks/encoders.py [--image samples/family.jpg] [--megapixels 12]
+"""
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+import cv2
+from PIL import Image, features
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import encoding  # noqa: E402
+from benchmarks.io_path import make_image  # noqa: E402
+
+# (mime type, level) pairs to compare; PIL's PNG compress_level and WebP quality mean the same as OpenCV's
+CASES = [
+    ('image/jpeg', 75), ('image/jpeg', 90), ('image/webp', 80), ('image/webp', 95), ('image/png', 1), ('image/png', 6),
+]
+_PIL_FORMATS = {'image/jpeg': 'JPEG', 'image/webp': 'WEBP', 'image/png': 'PNG'}
+
+
+def encode_pil(image, mime, level):
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    buffered = BytesIO()
+    option = {'compress_level': level} if mime == 'image/png' else {'quality': level}
+    Image.fromarray(rgb).save(buffered, format=_PIL_FORMATS[mime], **option)
+    return buffered.getvalue()
+
+
+def encode_png_stream(image, mime, level):
+    return b''.join(encoding.iter_png(image, level=level))
+
+
+def best_of(repeat, fn, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = fn(*args)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--image', type=str, help='Image to benchmark with.')
+    parser.add_argument('--megapixels', type=float, default=12, help='Size the image is resized to.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per encoder, the best one is reported.')
+    args = parser.parse_args()
+
+    image = make_image(args.image, args.megapixels)
+    print(f'{image.shape[1]}x{image.shape[0]} ({image.size / 3e6:.1f} MP), '
+          f'PIL with libjpeg-turbo: {features.check_feature("libjpeg_turbo")}')
+    for mime, level in CASES:
+        encoders = [('cv2', encoding.encode), ('PIL', encode_pil)]
+        if mime == 'image/png':
+            encoders.append(('streamed', encode_png_stream))
+        results = []
+        for name, encoder in encoders:
+            seconds, output = best_of(args.repeat, encoder, image, mime, level)
+            results.append(f'{name} {seconds * 1000:.0f} ms / {len(output) / 1e6:.2f} MB')
+        print(f'{mime} {level}: ' + ', '.join(results))
+
+
+if __name__ == '__main__':
+    main()
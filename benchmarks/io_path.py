@@ -0,0 +1,103 @@
+"""Compare the old PIL/RGB request I/O path with the BGR path for a large image.
+
+Only the work around the models is timed: decoding, the colour conversions
+the Enhancer did on the way in and out, and encoding. Run with
+
+    python benchmarks/io_path.py [--image samples/family.jpg] [--megapixels 12]
+
+Without ``--image`` a synthetic photo-like image is used; an image is
+resized to the requested size either way.
+"""
+import argparse
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def old_path(data):
+    """PIL decode → RGB → BGR (Enhancer) → models → BGR → RGB (Enhancer) → PIL encode.
+
+    Allocates five full-frame buffers, counted in the comments below.
+    """
+    timings = {}
+    start = time.perf_counter()
+    image = np.array(Image.open(BytesIO(data)))  # PIL's decoded buffer + copy into numpy
+    timings['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)  # copy
+    timings['convert in'] = time.perf_counter() - start
+
+    output = bgr  # the models run here
+
+    start = time.perf_counter()
+    rgb = cv2.cvtColor(output, cv2.COLOR_BGR2RGB)  # copy
+    timings['convert out'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    buffered = BytesIO()
+    Image.fromarray(rgb).save(buffered, format='JPEG')  # copy into PIL's 4-byte pixels + encode
+    encoded = buffered.getvalue()
+    timings['encode'] = time.perf_counter() - start
+    return timings, encoded
+
+
+def new_path(data):
+    """cv2 decode straight to BGR → models → cv2 encode from the BGR buffer.
+
+    Allocates a single full-frame buffer.
+    """
+    timings = {}
+    start = time.perf_counter()
+    # the only full-frame buffer, the models read it and the encoder reads their output
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    timings['decode'] = time.perf_counter() - start
+
+    timings['convert in'] = 0.
+    output = image  # the models run here
+    timings['convert out'] = 0.
+
+    start = time.perf_counter()
+    encoded = cv2.imencode('.jpg', output, [cv2.IMWRITE_JPEG_QUALITY, 75])[1].tobytes()
+    timings['encode'] = time.perf_counter() - start
+    return timings, encoded
+
+
+def make_image(path, megapixels):
+    if path is not None:
+        image = cv2.imread(path)
+    else:
+        # smooth gradients plus noise, compresses like a photo
+        rng = np.random.default_rng(0)
+        image = cv2.resize(rng.integers(0, 256, (30, 40, 3), dtype=np.uint8), (400, 300),
+                           interpolation=cv2.INTER_CUBIC)
+        image = cv2.add(image, rng.integers(0, 16, image.shape, dtype=np.uint8))
+    h, w = image.shape[:2]
+    scale = (megapixels * 1e6 / (h * w)) ** 0.5
+    return cv2.resize(image, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_CUBIC)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--image', type=str, help='Image to benchmark with.')
+    parser.add_argument('--megapixels', type=float, default=12, help='Size the image is resized to.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per path, the best one is reported.')
+    args = parser.parse_args()
+
+    image = make_image(args.image, args.megapixels)
+    data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+    print(f'{image.shape[1]}x{image.shape[0]} ({image.size / 3e6:.1f} MP), {len(data) / 1e6:.1f} MB JPEG input')
+
+    for name, path in (('PIL + RGB', old_path), ('cv2 + BGR', new_path)):
+        runs = [path(data) for _ in range(args.repeat)]
+        timings = {stage: min(run[0][stage] for run in runs) for stage in runs[0][0]}
+        stages = ', '.join(f'{stage} {seconds * 1000:.0f} ms' for stage, seconds in timings.items())
+        print(f'{name}: {stages}, total {sum(timings.values()) * 1000:.0f} ms, '
+              f'output {len(runs[0][1]) / 1e6:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ResultCache:
+    """Content-addressed cache for encoded enhancement results.
+
+    Results are keyed by a hash of the decoded pixels plus the parameters that
+    influence the output (see ``key``). An in-memory LRU tier is bounded by
+    ``max_bytes``; an optional on-disk tier under ``disk_dir`` is bounded by
+    ``disk_max_bytes`` (oldest files are evicted first) and entries expire
+    after ``ttl`` seconds. Separately, the hash of the *encoded* input is
+    aliased to the pixel key, so an identical upload is answered without
+    decoding it at all.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2, disk_dir=None, disk_max_bytes=2 * 1024 ** 3, ttl=24 * 3600,
+                 max_aliases=65536):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl = ttl
+        self.max_aliases = max_aliases
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._aliases = OrderedDict()
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0}
+
+        self._disk_bytes = 0
+        if self.disk_dir is not None:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            for entry in os.scandir(self.disk_dir):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    self._disk_bytes += entry.stat().st_size
+
+    @staticmethod
+    def key(content, *params):
+        """Hash raw bytes or a decoded image together with the output-affecting parameters."""
+        digest = hashlib.blake2b(digest_size=20)
+        if isinstance(content, np.ndarray):
+            digest.update(f'{content.shape}{content.dtype}'.encode())
+            content = memoryview(np.ascontiguousarray(content)).cast('B')
+        digest.update(content)
+        digest.update(repr(params).encode())
+        return digest.hexdigest()
+
+    def alias(self, raw_key, key):
+        """Remember that the encoded input ``raw_key`` decodes to the pixels of ``key``."""
+        with self._lock:
+            self._aliases[raw_key] = key
+            self._aliases.move_to_end(raw_key)
+            while len(self._aliases) > self.max_aliases:
+                self._aliases.popitem(last=False)
+
+    def resolve(self, raw_key):
+        with self._lock:
+            key = self._aliases.get(raw_key)
+            if key is not None:
+                self._aliases.move_to_end(raw_key)
+            return key
+
+    def lookup(self, raw_key):
+        """The result for the encoded input ``raw_key``, through its alias.
+
+        A miss is not counted: the caller decodes the input and looks it up
+        by its pixels next, which counts it.
+        """
+        return self.get(self.resolve(raw_key), count_miss=False)
+
+    def get(self, key, count_miss=True):
+        if key is None:
+            return None
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._counters["hits"] += 1
+                return value
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                if count_miss:
+                    self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._put_memory(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._put_memory(key, value)
+        self._write_disk(key, value)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                "items": len(self._memory),
+                "bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _put_memory(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._counters["evictions"] += 1
+
+    def _read_disk(self, key):
+        if self.disk_dir is None:
+            return None
+        path = os.path.join(self.disk_dir, key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                self._remove(path)
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key, value):
+        if self.disk_dir is None or len(value) > self.disk_max_bytes:
+            return
+        path = os.path.join(self.disk_dir, key)
+        if os.path.exists(path):
+            return
+        # write to a temp file first so a reader never sees a partial entry, then link it into place:
+        # unlike a rename this fails if another thread or worker created the entry meanwhile, so
+        # only one writer counts its size
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.disk_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return
+        finally:
+            os.remove(tmp_path)
+        with self._lock:
+            self._disk_bytes += len(value)
+            over_budget = self._disk_bytes > self.disk_max_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if total <= self.disk_max_bytes and now - mtime <= self.ttl:
+                break
+            if self._remove(path):
+                total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self._disk_bytes -= size
+            self._counters["disk_evictions"] += 1
+        return True
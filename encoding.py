@@ -0,0 +1,125 @@
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+# format name → mime type of the outputs clients can ask for
+FORMATS = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'png': 'image/png'}
+# per mime type: OpenCV extension, imencode flag of the level, default level and its range
+# (quality for JPEG and WebP, zlib compression for PNG); JPEG keeps PIL's default, which the service used to encode with
+_ENCODERS = {
+    'image/jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY, 75, range(1, 101)),
+    'image/webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY, 80, range(1, 101)),
+    'image/png': ('.png', cv2.IMWRITE_PNG_COMPRESSION, 1, range(0, 10)),
+}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# rows of the image filtered and compressed at a time
+PNG_BAND_ROWS = 64
+
+
+def negotiate(accept='', format=None, quality=None, compression=None, default='image/jpeg'):
+    """The (mime type, level) to encode an output with.
+
+    An explicit ``format`` ('jpeg', 'webp' or 'png') wins over the ``accept``
+    header, whose most preferred supported type is used; ``default`` when it
+    names none. ``quality`` (1-100) applies to JPEG and WebP, ``compression``
+    (0-9) to PNG; the other one is ignored. Raises ``ValueError`` on an
+    unknown format or a level out of range.
+    """
+    if format is not None:
+        if format.lower() not in FORMATS:
+            raise ValueError(f'Unsupported format {format!r}, use one of {", ".join(FORMATS)}.')
+        mime = FORMATS[format.lower()]
+    else:
+        mime = _preferred(accept) or default
+
+    level = compression if mime == 'image/png' else quality
+    _, _, default_level, levels = _ENCODERS[mime]
+    if level is None:
+        level = default_level
+    elif level not in levels:
+        name = 'compression' if mime == 'image/png' else 'quality'
+        raise ValueError(f'The {name} of {mime} must be between {levels[0]} and {levels[-1]}.')
+    return mime, level
+
+
+def encode(image, mime='image/jpeg', level=None, progressive=False):
+    """Encode a BGR uint8 image with OpenCV (libjpeg-turbo, libwebp, libpng), the fastest codecs at hand."""
+    extension, flag, default_level, _ = _ENCODERS[mime]
+    params = [flag, default_level if level is None else level]
+    if mime == 'image/jpeg':
+        params += [cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive)]
+    ok, buffer = cv2.imencode(extension, image, params)
+    if not ok:
+        raise ValueError('Failed to encode the image.')
+    return buffer.tobytes()
+
+
+def iter_png(image, rows=PNG_BAND_ROWS, level=1, channel_order='bgr'):
+    """Encode a uint8 colour image as PNG, yielding the file piece by piece.
+
+    The header goes out before any pixel is compressed; then every band of
+    ``rows`` rows is Paeth-filtered and deflated on its own, so only one band
+    is held besides the image and the first bytes can be sent long before the
+    last row is encoded. ``level`` is the zlib level (1, OpenCV's default, is
+    fast and close to the best size on photos).
+    """
+    height, width = image.shape[:2]
+    yield PNG_SIGNATURE + _chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    compressor = zlib.compressobj(level)
+    previous = np.zeros((1, width, 3), dtype=np.uint8)
+    for top in range(0, height, rows):
+        band = image[top:top + rows]
+        if channel_order == 'bgr':
+            band = band[..., ::-1]
+        data = compressor.compress(_paeth(band, previous))
+        previous = band[-1:]
+        if data:
+            yield _chunk(b'IDAT', data)
+    yield _chunk(b'IDAT', compressor.flush()) + _chunk(b'IEND', b'')
+
+
+def _paeth(band, previous):
+    """PNG scanlines of ``band`` with filter type 4 (Paeth); ``previous`` is the row above the band."""
+    up = np.concatenate([previous, band[:-1]]).astype(np.int16)
+    band = band.astype(np.int16)
+    left = np.zeros_like(band)
+    left[:, 1:] = band[:, :-1]
+    up_left = np.zeros_like(band)
+    up_left[:, 1:] = up[:, :-1]
+
+    estimate = left + up - up_left
+    to_left = np.abs(estimate - left)
+    to_up = np.abs(estimate - up)
+    to_up_left = np.abs(estimate - up_left)
+    predictor = np.where((to_left <= to_up) & (to_left <= to_up_left), left,
+                         np.where(to_up <= to_up_left, up, up_left))
+
+    lines = np.empty((band.shape[0], band.shape[1] * 3 + 1), dtype=np.uint8)
+    lines[:, 0] = 4
+    lines[:, 1:] = (band - predictor).astype(np.uint8).reshape(band.shape[0], -1)
+    return lines.tobytes()
+
+
+def _chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def _preferred(accept):
+    """The supported mime type ``accept`` prefers most, or None; wildcards leave the choice to the caller."""
+    best, best_q = None, 0.
+    for item in accept.split(','):
+        mime, *params = [part.strip() for part in item.split(';')]
+        q = 1.
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.
+        if mime.lower() in _ENCODERS and q > best_q:
+            best, best_q = mime.lower(), q
+    return best
@@ -0,0 +1,50 @@
+import threading
+import time
+
+
+class Cancelled(Exception):
+    """Raised in place of a result when the work for an image was abandoned.
+
+    ``reason`` is what cancelled it (e.g. 'disconnect' or 'deadline'),
+    ``stage`` the stage it stopped before.
+    """
+
+    def __init__(self, reason, stage):
+        super().__init__(f'Abandoned before {stage}: {reason}.')
+        self.reason = reason
+        self.stage = stage
+
+
+class CancelToken:
+    """Cancellation flag and deadline of a request, set from one thread and checked from others.
+
+    The deadline is a ``time.monotonic()`` value; once it has passed the token
+    counts as cancelled with reason 'deadline'. The enhancer calls ``check``
+    between stages, faces and tiles, so abandoned work stops at the next
+    checkpoint instead of running to completion.
+    """
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self.reason = None
+        self._event = threading.Event()
+
+    @classmethod
+    def with_timeout(cls, seconds=None):
+        return cls(time.monotonic() + seconds if seconds is not None else None)
+
+    def cancel(self, reason='cancelled'):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel('deadline')
+        return self._event.is_set()
+
+    def check(self, stage):
+        """Raise ``Cancelled`` if the token was cancelled before ``stage``."""
+        if self.cancelled:
+            raise Cancelled(self.reason, stage)
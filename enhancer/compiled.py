@@ -0,0 +1,92 @@
+import hashlib
+import os
+
+import torch
+
+from enhancer.shared_weights import digest_tensor
+
+
+class TracedGenerator(torch.nn.Module):
+    """Stands in for the GFPGAN generator with graphs traced for a few batch sizes.
+
+    The generator's modulated convolutions bake the batch size into the
+    graph, so a batch is run through the largest traced sizes that fit
+    (size 1 is always traced). Called like the generator; returns
+    (image, None) as the intermediate RGB outputs are not traced.
+    """
+
+    def __init__(self, graphs, weight):
+        super().__init__()
+        self.sizes = sorted(graphs, reverse=True)
+        self.graphs = torch.nn.ModuleDict({str(size): graph for size, graph in graphs.items()})
+        self.weight = weight
+
+    def forward(self, x, return_rgb=False, weight=0.5, **kwargs):
+        if return_rgb or weight != self.weight:
+            raise ValueError(f'Traced for return_rgb=False and weight={self.weight}.')
+        outputs = []
+        start = 0
+        while start < len(x):
+            size = next(size for size in self.sizes if size <= len(x) - start)
+            outputs.append(self.graphs[str(size)](x[start:start + size]))
+            start += size
+        return torch.cat(outputs), None
+
+
+class _GeneratorOutput(torch.nn.Module):
+    def __init__(self, generator, weight):
+        super().__init__()
+        self.generator = generator
+        self.weight = weight
+
+    def forward(self, x):
+        return self.generator(x, return_rgb=False, weight=self.weight)[0]
+
+
+def compile_module(module, example, cache_dir, name):
+    """Trace and freeze ``module`` on the ``example`` input, caching the result in ``cache_dir``.
+
+    The cached graph is keyed by the module's weights (their values, dtypes
+    and layout), the example's shape, dtype and device, and the torch
+    version, so a start with other weights, precision or torch reuses nothing
+    stale. Freezing inlines the weights as constants and folds the operations
+    on them. Returns the frozen ``ScriptModule``.
+    """
+    path = os.path.join(cache_dir, f'{name}-{_cache_key(module, example)}.pt')
+    if os.path.isfile(path):
+        try:
+            return torch.jit.load(path, map_location=example.device)
+        except RuntimeError as error:
+            print(f'Cannot load {path} ({error}), compiling again.')
+
+    print(f'Compiling {name} for {tuple(example.shape)}...')
+    module.eval()
+    with torch.no_grad():
+        # the generator draws fresh noise on every call, which the trace check would trip over
+        traced = torch.jit.trace(module, example, check_trace=False)
+        frozen = torch.jit.freeze(traced)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    torch.jit.save(frozen, tmp_path)
+    os.replace(tmp_path, path)
+    return frozen
+
+
+def compile_generator(generator, cache_dir, name, batch_sizes=(1,), weight=0.5, device=None, dtype=torch.float32):
+    """``compile_module`` for the GFPGAN generator as called by ``Enhancer.restore_faces``, per batch size."""
+    wrapper = _GeneratorOutput(generator, weight)
+    graphs = {}
+    for size in sorted(set(batch_sizes) | {1}):
+        example = torch.zeros(size, 3, 512, 512, device=device, dtype=dtype)
+        graphs[size] = compile_module(wrapper, example, cache_dir, f'{name}-b{size}')
+    return TracedGenerator(graphs, weight)
+
+
+def _cache_key(module, example):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{torch.__version__}/{tuple(example.shape)}/{example.dtype}/{example.device.type}'.encode())
+    for key, tensor in module.state_dict().items():
+        digest.update(f'{key}/{tuple(tensor.shape)}/{tensor.dtype}/{tensor.stride()}'.encode())
+        digest_tensor(digest, tensor)
+    return digest.hexdigest()
@@ -0,0 +1,136 @@
+import os
+import math
+import numpy as np
+import torch
+import torch.nn.functional as F
+from basicsr.archs.srvgg_arch import SRVGGNetCompact
+from enhancer.tiling import resize_into
+from enhancer.weights import fetch_weights
+
+
+class CPUUpsampler:
+    """Background upsampler for hosts without CUDA.
+
+    Uses the compact ``SRVGGNetCompact`` (realesr-general-x4v3) instead of
+    RRDBNet. The image is cut into equally sized tiles which are run through
+    the model ``tile_batch`` at a time, so every forward pass is large enough
+    to keep all of torch's intra-op threads busy. Each tile is resized to
+    ``outscale`` on its own and written straight into the uint8 output, so
+    peak memory stays close to the size of the result.
+
+    With ``quantize`` the model is converted to int8. PyTorch's dynamic
+    quantization only covers linear and recurrent layers, so this network is
+    quantized statically instead: the tiles of the first image are run in
+    float32 to calibrate the activation ranges, later images use the int8
+    model. Mirrors ``RealESRGANer.enhance`` so it can be handed to GFPGANer.
+
+    Without ``model_path`` the weights are fetched with ``fetch_weights``,
+    verified against ``sha256`` and copied from ``mirror_dir`` when given.
+    """
+
+    model_url = 'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-x4v3.pth'
+    # enhance() accepts a skip predicate and a check callback, see upsample_tiled
+    supports_skip = True
+    supports_check = True
+
+    def __init__(self, model_path=None, tile=192, tile_pad=10, tile_batch=8, quantize=False, sha256=None,
+                 mirror_dir=None):
+        self.scale = 4
+        self.tile = tile
+        self.tile_pad = tile_pad
+        self.tile_batch = tile_batch
+        self.quantize = quantize
+        self.name = f'SRVGGNetCompact_x{self.scale}' + ('_int8' if quantize else '')
+
+        if model_path is None:
+            model_path = fetch_weights(
+                self.model_url, os.path.join('libs', 'realesrgan', 'weights', os.path.basename(self.model_url)),
+                sha256=sha256, mirror_dir=mirror_dir
+            )
+        self.model = SRVGGNetCompact(
+            num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=self.scale, act_type='prelu'
+        )
+        loadnet = torch.load(model_path, map_location='cpu')
+        keyname = 'params_ema' if 'params_ema' in loadnet else 'params'
+        self.model.load_state_dict(loadnet[keyname], strict=True)
+        self.model.eval()
+
+        # int8 model once calibrated, the observed float model while calibrating
+        self._quantized = None
+        self._calibrating = None
+
+    @torch.no_grad()
+    def enhance(self, img, outscale=None, skip=None, check=None):
+        """Upsample a BGR image (uint8 or float in [0, 255]) by ``outscale``. Returns (BGR uint8, 'RGB').
+
+        Tiles for which ``skip(y0, x0, y1, x1)`` is true are not run through
+        the model but only resized, for regions that will be painted over.
+        ``check`` is called before every batch of tiles and may raise to
+        abandon the image.
+        """
+        outscale = self.scale if outscale is None else outscale
+        h, w = img.shape[:2]
+        th, tw = min(self.tile, h), min(self.tile, w)
+        pad = self.tile_pad
+
+        # BGR → RGB, [0, 1], NCHW; pad so that every tile (with its context) has the same size
+        x = torch.from_numpy(np.ascontiguousarray(img[:, :, 2::-1])).permute(2, 0, 1).unsqueeze(0).float() / 255.
+        rows, cols = math.ceil(h / th), math.ceil(w / tw)
+        x = F.pad(x, (pad, pad + cols * tw - w, pad, pad + rows * th - h), mode='replicate')
+
+        out_h, out_w = round(h * outscale), round(w * outscale)
+        output = np.empty((rows * round(th * outscale), cols * round(tw * outscale), 3), dtype=np.uint8)
+        out_th, out_tw, out_pad = round(th * outscale), round(tw * outscale), round(pad * outscale)
+
+        model = self._model()
+        coords = [(r * th, c * tw) for r in range(rows) for c in range(cols)]
+        if skip is not None:
+            skipped = {(y, x0) for y, x0 in coords if skip(y, x0, min(y + th, h), min(x0 + tw, w))}
+            for y, x0 in skipped:
+                oy, ox = round(y * outscale), round(x0 * outscale)
+                resize_into(output[oy:min(oy + out_th, out_h), ox:min(ox + out_tw, out_w)], img[y:y + th, x0:x0 + tw])
+            coords = [coord for coord in coords if coord not in skipped]
+        for i in range(0, len(coords), self.tile_batch):
+            if check is not None:
+                check()
+            chunk = coords[i:i + self.tile_batch]
+            batch = torch.cat([x[:, :, y:y + th + 2 * pad, x0:x0 + tw + 2 * pad] for y, x0 in chunk])
+            result = model(batch)
+            if outscale != self.scale:
+                size = (round((th + 2 * pad) * outscale), round((tw + 2 * pad) * outscale))
+                mode = 'area' if outscale < self.scale else 'bicubic'
+                result = F.interpolate(result, size=size, mode=mode)
+            result = result[:, :, out_pad:out_pad + out_th, out_pad:out_pad + out_tw]
+            # RGB → BGR, uint8, NHWC
+            result = (result.clamp_(0, 1) * 255.).round_().byte().flip(1).permute(0, 2, 3, 1).numpy()
+            for (y, x0), tile in zip(chunk, result):
+                oy, ox = round(y * outscale), round(x0 * outscale)
+                output[oy:oy + out_th, ox:ox + out_tw] = tile
+
+        if self._calibrating is not None:
+            self._finish_calibration()
+        return output[:out_h, :out_w], 'RGB'
+
+    def _model(self):
+        if not self.quantize:
+            return self.model
+        if self._quantized is not None:
+            return self._quantized
+        if self._calibrating is None:
+            from torch.ao.quantization import default_qconfig, get_default_qconfig
+            from torch.ao.quantization.quantize_fx import prepare_fx
+
+            # per-channel weights for the convolutions; the 1-D PReLU weights need per-tensor observers
+            qconfig = {'': get_default_qconfig('fbgemm'), 'object_type': [(torch.nn.PReLU, default_qconfig)]}
+            example = torch.zeros(1, 3, 64, 64)
+            try:
+                self._calibrating = prepare_fx(self.model, qconfig, example_inputs=(example,))
+            except TypeError:  # torch < 1.13 takes no example inputs
+                self._calibrating = prepare_fx(self.model, qconfig)
+        return self._calibrating
+
+    def _finish_calibration(self):
+        from torch.ao.quantization.quantize_fx import convert_fx
+
+        self._quantized = convert_fx(self._calibrating)
+        self._calibrating = None
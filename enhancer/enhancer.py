@@ -1,8 +1,15 @@
 import os
+import copy
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 import torch
 from tqdm import tqdm
 import cv2
-import requests
+import numpy as np
 import sys
 
 # Add libraries to path
@@ -10,21 +17,39 @@ sys.path.insert(0, './libs/gfpgan')
 sys.path.insert(0, './libs/basicsr')
 
 from gfpgan import GFPGANer
+from enhancer.shared_weights import share_module, release_memory
+from enhancer.cpu_upsampler import CPUUpsampler
+from enhancer.tiling import covered_by_faces, face_layers, paste_faces, upsample_tiled
+from enhancer.weights import fetch_weights
+from enhancer.precision import DTYPES, CastModule, resolve_precision
+from enhancer.cancellation import Cancelled
+from enhancer.compiled import compile_generator, compile_module
+from basicsr.utils import img2tensor, tensor2img
+from torchvision.transforms.functional import normalize
+
+# Images with a longer side are detected on a downscaled proxy and their
+# background is upsampled tile by tile
+MAX_IMAGE_SIZE = 2048
+BG_TILE_SIZE = 1024
+# Quality tiers, most expensive first, see Enhancer.enhance_batch
+TIERS = ('full', 'light_background', 'no_background', 'faces_only')
 
 
 class Enhancer:
-    def __init__(self, method='gfpgan', background_enhancement=True, upscale=2):
+    def __init__(self, method='gfpgan', background_enhancement=True, upscale=2, shared_weights_dir=None,
+                 cpu_quantize=False, model_sha256=None, weights_mirror_dir=None, bg_model_sha256=None,
+                 detect_size=None, detection_cache_size=0, skip_covered_tiles=False, precision=None,
+                 channels_last=False, compile_dir=None, compile_batch_sizes=(1,), quality_tiers=False):
         # -----------------------------
         # 1. Background enhancement setup
         # -----------------------------
         if background_enhancement:
             if upscale == 2:
                 if not torch.cuda.is_available():
-                    import warnings
-                    warnings.warn(
-                        'CPU RealESRGAN is very slow. Skipping background upsampling.'
+                    # RRDBNet is very slow on CPU, use the compact model instead
+                    self.bg_upsampler = CPUUpsampler(
+                        quantize=cpu_quantize, sha256=bg_model_sha256, mirror_dir=weights_mirror_dir
                     )
-                    self.bg_upsampler = None
                 else:
                     from basicsr.archs.rrdbnet_arch import RRDBNet
                     from realesrgan import RealESRGANer
@@ -44,15 +69,15 @@ class Enhancer:
                         tile=400,
                         tile_pad=10,
                         pre_pad=0,
-                        half=True
+                        # historical default; an explicit precision is applied in step 5
+                        half=precision is None
                     )
             elif upscale == 4:
                 if not torch.cuda.is_available():
-                    import warnings
-                    warnings.warn(
-                        'CPU RealESRGAN is very slow. Skipping background upsampling.'
+                    # RRDBNet is very slow on CPU, use the compact model instead
+                    self.bg_upsampler = CPUUpsampler(
+                        quantize=cpu_quantize, sha256=bg_model_sha256, mirror_dir=weights_mirror_dir
                     )
-                    self.bg_upsampler = None
                 else:
                     from basicsr.archs.rrdbnet_arch import RRDBNet
                     from realesrgan import RealESRGANer
@@ -72,7 +97,8 @@ class Enhancer:
                         tile=400,
                         tile_pad=10,
                         pre_pad=0,
-                        half=True
+                        # historical default; an explicit precision is applied in step 5
+                        half=precision is None
                     )
             else:
                 raise ValueError(f'Wrong upscale constant {upscale}.')
@@ -106,20 +132,14 @@ class Enhancer:
         # ---------------------------------------------------
         # 3. Ensure the model is present locally
         # ---------------------------------------------------
+        # verified against model_sha256 when given, copied from weights_mirror_dir when present there
         weights_dir = os.path.join('libs', 'gfpgan', 'weights')
-        os.makedirs(weights_dir, exist_ok=True)
-
-        local_path = os.path.join(weights_dir, f"{self.model_name}.pth")
-
-        if not os.path.isfile(local_path):
-            print(f"Downloading {self.model_name} from GitHub...")
-            resp = requests.get(self.model_url, stream=True)
-            resp.raise_for_status()
-            with open(local_path, 'wb') as f:
-                for chunk in resp.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-        model_path = local_path
+        model_path = fetch_weights(
+            self.model_url,
+            os.path.join(weights_dir, f"{self.model_name}.pth"),
+            sha256=model_sha256,
+            mirror_dir=weights_mirror_dir
+        )
 
         # ---------------------------------------------------
         # 4. Create GFPGANer restorer
@@ -132,26 +152,527 @@ class Enhancer:
             bg_upsampler=self.bg_upsampler
         )
 
-    def check_image_dimensions(self, image):
-        h, w, _ = image.shape
-        if w > 2048 or h > 2048:
-            print("Image dimensions exceed 2048px; skipping face enhancement.")
-            return False
-        return True
-
-    def enhance(self, image):
-        # Convert RGB → BGR
-        bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-        if self.check_image_dimensions(bgr):
-            _, _, output = self.restorer.enhance(
-                bgr,
-                has_aligned=False,
-                only_center_face=False,
-                paste_back=True
+        # ---------------------------------------------------
+        # 5. Precision and memory layout
+        # ---------------------------------------------------
+        # named before the background model gets wrapped
+        self._bg_name = None
+        if self.bg_upsampler is not None:
+            self._bg_name = getattr(self.bg_upsampler, 'name', f'RealESRGAN_x{self.bg_upsampler.scale}plus')
+        # None keeps the historical mix: fp16 RealESRGAN on GPU, everything else fp32.
+        # channels_last only applies to the background model, the StyleGAN2 decoder of
+        # GFPGAN reshapes its activations with view() and needs them contiguous.
+        self.precision = None if precision is None else resolve_precision(precision, self.restorer.device)
+        self.face_dtype = torch.float32 if self.precision is None else DTYPES[self.precision]
+        self.restorer.gfpgan.to(self.face_dtype)
+        # the int8 CPU upsampler keeps its own precision
+        bg_castable = self.bg_upsampler is not None and not getattr(self.bg_upsampler, 'quantize', False)
+        if bg_castable and (self.precision is not None or channels_last):
+            bg_model = self.bg_upsampler.model
+            bg_dtype = next(bg_model.parameters()).dtype if self.precision is None else self.face_dtype
+            self.bg_upsampler.model = CastModule(bg_model, bg_dtype, channels_last)
+
+        # ---------------------------------------------------
+        # 6. Share CPU weights with the other worker processes
+        # ---------------------------------------------------
+        if shared_weights_dir is not None:
+            face_helper = self.restorer.face_helper
+            share_module(self.restorer.gfpgan, shared_weights_dir, self.model_name)
+            share_module(face_helper.face_det, shared_weights_dir, 'detection_Resnet50_Final')
+            share_module(face_helper.face_parse, shared_weights_dir, 'parsing_parsenet')
+            if self.bg_upsampler is not None:
+                share_module(self.bg_upsampler.model, shared_weights_dir, self._bg_name)
+            release_memory()
+
+        # ---------------------------------------------------
+        # 7. Ahead-of-time compilation
+        # ---------------------------------------------------
+        # The face restorer and the background model are traced and frozen once, cached in
+        # compile_dir. Frozen graphs hold their own copy of the weights, so this does not
+        # combine with sharing them; the int8 CPU upsampler stays as it is.
+        self._compiled_bytes = 0
+        if compile_dir is not None and shared_weights_dir is not None:
+            print('Compiled models cannot share their weights, not compiling.')
+        elif compile_dir is not None:
+            # one frozen graph per batch size, each with its own weights
+            batch_sizes = set(compile_batch_sizes) | {1}
+            self._compiled_bytes += _module_bytes(self.restorer.gfpgan) * len(batch_sizes)
+            self.restorer.gfpgan = compile_generator(
+                self.restorer.gfpgan, compile_dir, self.model_name, batch_sizes=batch_sizes,
+                device=self.restorer.device, dtype=self.face_dtype
             )
+            if bg_castable:
+                bg_model = self.bg_upsampler.model
+                # CastModule takes float32; otherwise the upsampler feeds the model's own dtype
+                dtype = torch.float32 if isinstance(bg_model, CastModule) else next(bg_model.parameters()).dtype
+                device = next(bg_model.parameters()).device
+                # the background models are fully convolutional, one graph serves every tile size
+                example = torch.zeros(1, 3, 64, 64, device=device, dtype=dtype)
+                self._compiled_bytes += _module_bytes(bg_model)
+                self.bg_upsampler.model = compile_module(bg_model, example, compile_dir, self._bg_name)
+
+        # ---------------------------------------------------
+        # 8. Face detection reuse
+        # ---------------------------------------------------
+        # faces are detected on a copy whose longer side is at most detect_size
+        self.detect_size = detect_size
+        # detections of the last detection_cache_size images, keyed by a hash of their pixels
+        self.detection_cache_size = detection_cache_size
+        self._detections = OrderedDict()
+        self._detections_lock = threading.Lock()
+        # background tiles hidden by the restored faces are resized instead of upsampled
+        self.skip_covered_tiles = skip_covered_tiles
+
+        # ---------------------------------------------------
+        # 9. Cheaper background upsampler for the 'light_background' tier
+        # ---------------------------------------------------
+        # On GPU the compact model stands in for RRDBNet; on CPU, where the compact model is
+        # the default already, its int8 version does. None when nothing cheaper is at hand.
+        self.light_upsampler = None
+        if quality_tiers and self.bg_upsampler is not None:
+            if torch.cuda.is_available():
+                self.light_upsampler = _compact_upsampler(half=self.precision in (None, 'fp16'))
+            elif not getattr(self.bg_upsampler, 'quantize', False):
+                self.light_upsampler = CPUUpsampler(
+                    quantize=True, sha256=bg_model_sha256, mirror_dir=weights_mirror_dir
+                )
+        # the tiers that differ from each other here, most expensive first
+        if self.bg_upsampler is None:
+            self.tiers = ('full', 'faces_only')
         else:
-            output = bgr
+            self.tiers = tuple(tier for tier in TIERS if tier != 'light_background' or self.light_upsampler is not None)
+
+    def modules(self):
+        """The torch modules making up this enhancer."""
+        face_helper = self.restorer.face_helper
+        modules = [self.restorer.gfpgan, face_helper.face_det, face_helper.face_parse]
+        if self.bg_upsampler is not None:
+            modules.append(self.bg_upsampler.model)
+        if self.light_upsampler is not None:
+            modules.append(self.light_upsampler.model)
+        return modules
+
+    def memory_footprint(self):
+        """Bytes held by the parameters and buffers of all models, and the weights inlined in compiled graphs."""
+        return sum(_module_bytes(module) for module in self.modules()) + self._compiled_bytes
+
+    @property
+    def version(self):
+        """Identifies the models and scale behind the output, e.g. for cache keys."""
+        version = f'{self.model_name}/{self._bg_name or "none"}/x{self.restorer.upscale}'
+        if self.precision is not None:
+            version += f'/{self.precision}'
+        if self._compiled_bytes:
+            version += '/compiled'
+        if self.detect_size is not None:
+            version += f'/det{self.detect_size}'
+        return version
+
+    def warm_up(self, image=None, channel_order='rgb'):
+        """Run the models once so the first request does not pay for lazy initialisation.
+
+        With an ``image`` the whole pipeline runs on it. Without one, every
+        model runs on blank input, except an int8 background upsampler that
+        still has to calibrate on a real image.
+        """
+        if image is not None:
+            self.enhance(image, channel_order=channel_order)
+            if self.light_upsampler is not None:
+                bgr = image if channel_order == 'bgr' else cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+                self.light_upsampler.enhance(bgr, outscale=self.restorer.upscale)
+            return
+        blank = np.zeros((64, 64, 3), dtype=np.uint8)
+        self.detect_faces([blank])
+        self.restore_faces([np.zeros((512, 512, 3), dtype=np.uint8)])
+        for upsampler in (self.bg_upsampler, self.light_upsampler):
+            if upsampler is not None and not getattr(upsampler, 'quantize', False):
+                upsampler.enhance(blank, outscale=self.restorer.upscale)
+
+    def check_image_dimensions(self, image):
+        """True if the image is small enough to be processed in one piece."""
+        h, w = image.shape[:2]
+        return w <= MAX_IMAGE_SIZE and h <= MAX_IMAGE_SIZE
+
+    def read_image(self, image, channel_order='rgb'):
+        """Wrap an image in ``channel_order`` ('rgb' or 'bgr') into a fresh face helper.
+
+        The helper holds the per-image state (input image, landmarks, affine
+        matrices, aligned crops) while the detection and parsing networks are
+        shared with ``self.restorer.face_helper``, so several images can be in
+        flight at the same time. A BGR image is used as is, without a copy.
+        """
+        if channel_order == 'rgb':
+            # Convert RGB → BGR
+            bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        elif channel_order == 'bgr':
+            bgr = image
+        else:
+            raise ValueError(f'Wrong channel order {channel_order}.')
+
+        helper = copy.copy(self.restorer.face_helper)
+        helper.clean_all()
+        helper.read_image(bgr)
+        return helper
+
+    @torch.no_grad()
+    def detect_faces(self, bgr_images, batch_size=4):
+        """Run the face detector on BGR images, up to ``batch_size`` images of the same size per forward pass.
+
+        Images are not padded to a common size: padding would change the
+        detections near the padded edges and multiply the memory of a batch
+        by the ratio of its largest image to the others. Images of a size no
+        other image has run on their own. Returns one (n, 15) array of
+        boxes, scores and landmarks per image, in the order given.
+        """
+        face_det = self.restorer.face_helper.face_det
+        same_size = {}
+        for i, img in enumerate(bgr_images):
+            same_size.setdefault(img.shape, []).append(i)
+
+        detections = [None] * len(bgr_images)
+        for indices in same_size.values():
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start:start + batch_size]
+                if len(chunk) == 1:
+                    detections[chunk[0]] = face_det.detect_faces(bgr_images[chunk[0]], 0.97)
+                    continue
+
+                frames = torch.from_numpy(np.stack([bgr_images[i] for i in chunk]).astype(np.float32))
+                bboxes, landmarks = face_det.batched_detect_faces(frames, conf_threshold=0.97)
+                for i, bbox, landmark in zip(chunk, bboxes, landmarks):
+                    if len(bbox) == 0:
+                        detections[i] = np.zeros((0, 15), dtype=np.float32)
+                    else:
+                        detections[i] = np.concatenate((bbox, landmark), axis=1)
+        return detections
+
+    def detect_batch(self, images, return_exceptions=False, channel_order='rgb', timings=None, tokens=None):
+        """Detect and align the faces of a list of images in ``channel_order``.
+
+        Images larger than ``detect_size`` (``MAX_IMAGE_SIZE`` by default) are
+        detected on a downscaled copy; the faces are still cropped from the
+        full-resolution image. Detections are reused for images seen before
+        when the detection cache is enabled.
+        Returns one face helper per image (see ``read_image``); with
+        ``return_exceptions`` an image that cannot be read gets its exception
+        in place of the helper instead of failing the whole batch. ``timings``
+        (one dict per image) receives the seconds spent per stage. Images whose
+        ``CancelToken`` (one per image, or None) is cancelled before or during
+        detection get ``Cancelled`` instead.
+        """
+        timings = timings or [None] * len(images)
+        tokens = tokens or [None] * len(images)
+        helpers = []
+        with _timed(timings, 'detect'):
+            for image, token in zip(images, tokens):
+                try:
+                    _check(token, 'detect')
+                    helpers.append(self.read_image(image, channel_order=channel_order))
+                except Exception as error:
+                    if not return_exceptions:
+                        raise
+                    helpers.append(error)
+
+            active = [(i, helper, timing) for i, (helper, timing) in enumerate(zip(helpers, timings))
+                      if _is_helper(helper)]
+            keys = [self._detection_key(helper.input_img) for _, helper, _ in active]
+            detections = [self._cached_detections(key) for key in keys]
+            missing = [i for i, bboxes in enumerate(detections) if bboxes is None]
+
+            max_size = self.detect_size or MAX_IMAGE_SIZE
+            proxies = [_detection_proxy(active[i][1].input_img, max_size) for i in missing]
+            for i, bboxes, (_, scale) in zip(missing, self.detect_faces([proxy for proxy, _ in proxies]), proxies):
+                bboxes = _from_proxy(bboxes, scale)
+                detections[i] = bboxes
+                self._cache_detections(keys[i], bboxes)
+
+        for (i, helper, timing), bboxes in zip(active, detections):
+            # images abandoned during detection stop here
+            if tokens[i] is not None and tokens[i].cancelled:
+                if not return_exceptions:
+                    tokens[i].check('align')
+                helpers[i] = Cancelled(tokens[i].reason, 'align')
+                continue
+            with _timed([timing], 'align'):
+                _add_landmarks(helper, bboxes, eye_dist_threshold=5)
+                helper.align_warp_face()
+        return helpers
+
+    @torch.no_grad()
+    def restore_faces(self, cropped_faces, weight=0.5, batch_size=16, skip=None):
+        """Run the face restorer on aligned BGR crops, ``batch_size`` crops per forward pass.
+
+        Crops whose index ``skip(i)`` is true when their batch comes up (e.g. of
+        abandoned images) are returned as they are instead of being restored.
+        """
+        restored_faces = list(cropped_faces)
+        for start in range(0, len(cropped_faces), batch_size):
+            end = min(start + batch_size, len(cropped_faces))
+            indices = [i for i in range(start, end) if skip is None or not skip(i)]
+            if not indices:
+                continue
+            chunk = [cropped_faces[i] for i in indices]
+            batch = torch.stack([img2tensor(face / 255., bgr2rgb=True, float32=True) for face in chunk])
+            normalize(batch, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
+            batch = batch.to(self.restorer.device, dtype=self.face_dtype)
+
+            try:
+                output = self.restorer.gfpgan(batch, return_rgb=False, weight=weight)[0]
+                for i, face in zip(indices, output):
+                    restored_faces[i] = tensor2img(face, rgb2bgr=True, min_max=(-1, 1)).astype('uint8')
+            except RuntimeError as error:
+                # the crops stay as they are
+                print(f'Failed inference for {self.model_name}: {error}.')
+        return restored_faces
+
+    def paste_back(self, helper, restored_faces, channel_order='rgb', timing=None, token=None, tier='full'):
+        """Upsample the background of ``helper`` and paste the restored faces onto it.
+
+        Returns the image in ``channel_order``. Large backgrounds are upsampled
+        in ``BG_TILE_SIZE`` tiles and faces are blended only within their own
+        region, so memory stays bounded by the output image plus one tile.
+        With ``skip_covered_tiles`` the faces are warped first, and background
+        tiles they hide completely are not run through the upsampler; an
+        upsampler that cannot skip tiles itself is then run tile by tile.
+        ``token`` is checked before the upsampler, between background tiles and
+        between faces; raises ``Cancelled`` once it is cancelled. ``tier`` is
+        one of ``TIERS``, see ``enhance_batch``.
+        """
+        _check(token, 'upsample')
+        for restored_face in restored_faces:
+            helper.add_restored_face(restored_face)
+
+        upscale = self.restorer.upscale
+        if tier == 'faces_only':
+            # the helper is this image's own copy
+            upscale = helper.upscale_factor = 1
+        bg_upsampler = self._tier_upsampler(tier)
+        layers, skip = None, None
+        with _timed([timing], 'paste'):
+            helper.get_inverse_affine(None)
+            if self.skip_covered_tiles and bg_upsampler is not None:
+                layers = list(face_layers(helper, compact=True))
+                skip = covered_by_faces(layers, upscale)
+
+        # upsample the background
+        check = _checker(token, 'upsample')
+        with _timed([timing], 'upsample'):
+            if bg_upsampler is None:
+                bg_img = None
+            elif skip is not None and not getattr(bg_upsampler, 'supports_skip', False):
+                # the upsampler cannot skip regions itself, so it gets the tiles one at a time
+                tile, tile_pad = _whole_tiles(bg_upsampler)
+                bg_img = upsample_tiled(
+                    bg_upsampler, helper.input_img, upscale, tile=tile, tile_pad=tile_pad, skip=skip, check=check
+                )
+            elif not self.check_image_dimensions(helper.input_img):
+                bg_img = upsample_tiled(
+                    bg_upsampler, helper.input_img, upscale, tile=BG_TILE_SIZE, skip=skip, check=check
+                )
+            else:
+                options = {}
+                if skip is not None and getattr(bg_upsampler, 'supports_skip', False):
+                    options['skip'] = skip
+                if check is not None and getattr(bg_upsampler, 'supports_check', False):
+                    options['check'] = check
+                bg_img = bg_upsampler.enhance(helper.input_img, outscale=upscale, **options)[0]
+
+        with _timed([timing], 'paste'):
+            output = paste_faces(helper, upsample_img=bg_img, layers=layers, check=_checker(token, 'paste'))
+
+            if channel_order == 'rgb':
+                # Convert BGR → RGB, in place: the output buffer is our own
+                output = cv2.cvtColor(output, cv2.COLOR_BGR2RGB, dst=output)
+        return output
+
+    def enhance_batch(self, images, return_exceptions=False, channel_order='rgb', timings=None, tokens=None,
+                      tiers=None):
+        """Enhance a list of images, restoring the faces of all of them in shared forward passes.
+
+        Images are given and returned in ``channel_order`` ('rgb' or 'bgr');
+        BGR skips the colour conversions around the models. With
+        ``return_exceptions`` a failing image gets its exception in the
+        returned list instead of failing the whole batch.
+
+        ``timings``, one dict per image, receives the seconds spent in each
+        stage (detect, align, restore, upsample, paste). Stages that run on
+        the whole batch are counted in full for every image taking part.
+
+        ``tokens``, one ``CancelToken`` (or None) per image, abandon the work
+        for an image at the next checkpoint once cancelled: after detection,
+        between batches of faces, between background tiles and between pasted
+        faces. The image then gets ``Cancelled`` (raised without
+        ``return_exceptions``).
+
+        ``tiers``, one of ``TIERS`` per image (default 'full'), trade quality
+        for time under load: 'light_background' upsamples the background with
+        the cheaper ``light_upsampler``, 'no_background' only resizes it, and
+        'faces_only' restores the faces on the image at its own size.
+        """
+        timings = timings or [None] * len(images)
+        tokens = tokens or [None] * len(images)
+        tiers = tiers or ['full'] * len(images)
+        helpers = self.detect_batch(
+            images, return_exceptions=return_exceptions, channel_order=channel_order, timings=timings, tokens=tokens
+        )
+
+        cropped_faces, owners = [], []
+        for helper, token in zip(helpers, tokens):
+            if _is_helper(helper):
+                cropped_faces.extend(helper.cropped_faces)
+                owners.extend([token] * len(helper.cropped_faces))
+        restoring = [timing for helper, timing in zip(helpers, timings) if _is_helper(helper) and helper.cropped_faces]
+        with _timed(restoring, 'restore'):
+            restored_faces = self.restore_faces(
+                cropped_faces, skip=lambda i: owners[i] is not None and owners[i].cancelled
+            )
+
+        outputs = []
+        start = 0
+        for helper, timing, token, tier in zip(helpers, timings, tokens, tiers):
+            if not _is_helper(helper):
+                # failed to read, or abandoned
+                outputs.append(helper)
+                continue
+            end = start + len(helper.cropped_faces)
+            try:
+                outputs.append(self.paste_back(
+                    helper, restored_faces[start:end], channel_order=channel_order, timing=timing, token=token,
+                    tier=tier
+                ))
+            except Exception as error:
+                if not return_exceptions:
+                    raise
+                outputs.append(error)
+            start = end
+        return outputs
+
+    def enhance(self, image, channel_order='rgb', timing=None, token=None):
+        return self.enhance_batch([image], channel_order=channel_order, timings=[timing], tokens=[token])[0]
+
+    def _tier_upsampler(self, tier):
+        if tier not in TIERS:
+            raise ValueError(f'Wrong quality tier {tier}.')
+        if tier == 'full' or (tier == 'light_background' and self.light_upsampler is None):
+            return self.bg_upsampler
+        if tier == 'light_background':
+            return self.light_upsampler
+        return None
+
+    def _detection_key(self, bgr):
+        if not self.detection_cache_size:
+            return None
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f'{bgr.shape}{bgr.dtype}'.encode())
+        digest.update(memoryview(np.ascontiguousarray(bgr)).cast('B'))
+        return digest.digest()
+
+    def _cached_detections(self, key):
+        if key is None:
+            return None
+        with self._detections_lock:
+            bboxes = self._detections.get(key)
+            if bboxes is not None:
+                self._detections.move_to_end(key)
+            return bboxes
+
+    def _cache_detections(self, key, bboxes):
+        if key is None:
+            return
+        with self._detections_lock:
+            self._detections[key] = bboxes
+            while len(self._detections) > self.detection_cache_size:
+                self._detections.popitem(last=False)
+
+
+# box and landmark columns of a detection holding x and y coordinates
+_X_COLUMNS = [0, 2, 5, 7, 9, 11, 13]
+_Y_COLUMNS = [1, 3, 6, 8, 10, 12, 14]
+
+
+@contextmanager
+def _timed(timings, stage):
+    """Add the seconds spent in the block to ``stage`` of every timing dict (None entries are skipped)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        for timing in timings:
+            if timing is not None:
+                timing[stage] = timing.get(stage, 0.) + elapsed
+
+
+def _compact_upsampler(half):
+    """The compact realesr-general-x4v3 model on GPU, wrapped like the RRDBNet upsampler."""
+    from basicsr.archs.srvgg_arch import SRVGGNetCompact
+    from realesrgan import RealESRGANer
+
+    model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu')
+    return RealESRGANer(
+        scale=4,
+        model_path=CPUUpsampler.model_url,
+        model=model,
+        tile=400,
+        tile_pad=10,
+        pre_pad=0,
+        half=half
+    )
+
+
+def _whole_tiles(upsampler):
+    """(tile, tile_pad) for ``upsample_tiled`` such that ``upsampler`` runs each padded tile in one piece."""
+    tile_size, tile_pad = getattr(upsampler, 'tile_size', 0), getattr(upsampler, 'tile_pad', 16)
+    if tile_size > 2 * tile_pad:
+        return tile_size - 2 * tile_pad, tile_pad
+    return BG_TILE_SIZE, tile_pad
+
+
+def _module_bytes(module):
+    return sum(tensor.numel() * tensor.element_size() for tensor in module.state_dict().values())
+
+
+def _check(token, stage):
+    if token is not None:
+        token.check(stage)
+
+
+def _checker(token, stage):
+    """``token.check`` for ``stage`` as a callback, None without a token."""
+    return None if token is None else functools.partial(token.check, stage)
+
+
+def _is_helper(helper):
+    return helper is not None and not isinstance(helper, Exception)
+
+
+def _detection_proxy(img, max_size):
+    """Downscale ``img`` to fit ``max_size``. Returns (proxy, (x scale, y scale)), scale None if unchanged."""
+    h, w = img.shape[:2]
+    if max(h, w) <= max_size:
+        return img, None
+    ratio = max_size / max(h, w)
+    size = (max(round(w * ratio), 1), max(round(h * ratio), 1))
+    proxy = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return proxy, (size[0] / w, size[1] / h)
+
+
+def _from_proxy(bboxes, scale):
+    """Map detections on a ``_detection_proxy`` (boxes, scores, landmarks) back to the full-resolution image."""
+    if scale is None:
+        return bboxes
+    bboxes = bboxes.copy()
+    bboxes[:, _X_COLUMNS] /= scale[0]
+    bboxes[:, _Y_COLUMNS] /= scale[1]
+    return bboxes
+
 
-        # Convert BGR → RGB
-        return cv2.cvtColor(output, cv2.COLOR_BGR2RGB)
+def _add_landmarks(helper, bboxes, eye_dist_threshold=None):
+    """Store detections on a face helper, as ``FaceRestoreHelper.get_face_landmarks_5`` does."""
+    for bbox in bboxes:
+        # remove faces with too small eye distance: side faces or too small faces
+        eye_dist = np.linalg.norm([bbox[6] - bbox[8], bbox[7] - bbox[9]])
+        if eye_dist_threshold is not None and eye_dist < eye_dist_threshold:
+            continue
+        helper.all_landmarks_5.append(np.array([[bbox[i], bbox[i + 1]] for i in range(5, 15, 2)]))
+        helper.det_faces.append(bbox[0:5])
@@ -0,0 +1,54 @@
+import torch
+
+DTYPES = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
+def resolve_precision(precision, device):
+    """The precision to run the models in on ``device``: ``precision``, or 'fp32' where it is not supported.
+
+    fp16 is only used on CUDA, CPUs have no fast half-precision kernels; bf16
+    needs a GPU or a CPU with native bfloat16 support (AVX512-BF16 / AMX).
+    """
+    if precision not in DTYPES:
+        raise ValueError(f'Wrong precision {precision}.')
+    if device.type == 'cuda':
+        supported = precision != 'bf16' or torch.cuda.is_bf16_supported()
+    else:
+        supported = precision == 'fp32' or (precision == 'bf16' and _cpu_supports_bf16())
+    if not supported:
+        print(f'{precision} is not supported on this {device.type.upper()}, using fp32.')
+        return 'fp32'
+    return precision
+
+
+def to_channels_last(module):
+    """Store the 4-D weights of ``module`` channels-last; ``Module.to`` refuses modules with other ranks."""
+    for param in module.parameters():
+        if param.dim() == 4:
+            param.data = param.data.contiguous(memory_format=torch.channels_last)
+    return module
+
+
+class CastModule(torch.nn.Module):
+    """Runs ``module`` in ``dtype`` and, optionally, channels-last, while callers keep passing and getting float32."""
+
+    def __init__(self, module, dtype, channels_last=False):
+        super().__init__()
+        self.module = module.to(dtype)
+        if channels_last:
+            to_channels_last(self.module)
+        self.dtype = dtype
+        self.channels_last = channels_last
+
+    def forward(self, x):
+        x = x.to(self.dtype)
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return self.module(x).float()
+
+
+def _cpu_supports_bf16():
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
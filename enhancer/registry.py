@@ -0,0 +1,89 @@
+import contextlib
+import threading
+from collections import OrderedDict
+
+import torch
+
+from enhancer.enhancer import Enhancer
+
+
+class EnhancerRegistry:
+    """Keeps warm ``Enhancer`` instances keyed by (method, background_enhancement, upscale).
+
+    Enhancers are built on first use and reused afterwards. When the models
+    held by the registry exceed ``memory_budget`` bytes, the least recently
+    used enhancers are dropped; the one just requested is always kept.
+
+    An ``Enhancer`` keeps per-call state (in the upsampler and the face
+    detector), so callers that share the registry across threads should go
+    through ``use``, which runs one call at a time per enhancer.
+    """
+
+    def __init__(self, memory_budget=2 * 1024 ** 3, factory=Enhancer):
+        self.memory_budget = memory_budget
+        self.factory = factory
+
+        self._lock = threading.Lock()
+        self._enhancers = OrderedDict()
+        self._sizes = {}
+        self._locks = {}
+
+    def get(self, method='gfpgan', background_enhancement=True, upscale=2):
+        return self._get((method, background_enhancement, upscale))[0]
+
+    @contextlib.contextmanager
+    def use(self, method='gfpgan', background_enhancement=True, upscale=2):
+        """Hold the enhancer for these settings exclusively while in the ``with`` block."""
+        enhancer, lock = self._get((method, background_enhancement, upscale))
+        with lock:
+            yield enhancer
+
+    def _get(self, key):
+        """The enhancer for ``key`` and the lock of its calls."""
+        method, background_enhancement, upscale = key
+        with self._lock:
+            enhancer = self._enhancers.get(key)
+            if enhancer is not None:
+                self._enhancers.move_to_end(key)
+                return enhancer, self._locks[key]
+
+            enhancer = self.factory(method=method, background_enhancement=background_enhancement, upscale=upscale)
+            self._enhancers[key] = enhancer
+            self._sizes[key] = enhancer.memory_footprint()
+            self._locks[key] = threading.Lock()
+            lock = self._locks[key]
+            self._evict(keep=key)
+            return enhancer, lock
+
+    def memory_usage(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def keys(self):
+        with self._lock:
+            return list(self._enhancers)
+
+    def clear(self):
+        with self._lock:
+            self._enhancers.clear()
+            self._sizes.clear()
+            self._locks.clear()
+        _release_device_memory()
+
+    def _evict(self, keep):
+        evicted = False
+        while sum(self._sizes.values()) > self.memory_budget and len(self._enhancers) > 1:
+            key = next(iter(self._enhancers))
+            if key == keep:
+                break
+            del self._enhancers[key]
+            del self._sizes[key]
+            del self._locks[key]
+            evicted = True
+        if evicted:
+            _release_device_memory()
+
+
+def _release_device_memory():
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
@@ -0,0 +1,149 @@
+import ctypes
+import fcntl
+import gc
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+import torch
+
+# File layout (safetensors-style): 8-byte little-endian header length, a JSON
+# header mapping tensor names to dtype/shape/offset, then the raw tensor data,
+# every tensor aligned to _ALIGN bytes.
+_ALIGN = 64
+
+# numpy has no bfloat16, those tensors are stored as raw 16-bit words
+_DTYPES = {
+    'float32': (np.float32, None),
+    'float16': (np.float16, None),
+    'bfloat16': (np.int16, torch.bfloat16),
+    'float64': (np.float64, None),
+    'int64': (np.int64, None),
+    'int32': (np.int32, None),
+    'uint8': (np.uint8, None),
+    'bool': (np.bool_, None),
+}
+
+
+def share_module(module, weights_dir, name):
+    """Back the parameters and buffers of ``module`` by a memory-mapped file.
+
+    The first process writes the module's current state dict to
+    ``weights_dir``; every process (including the first) then maps that file
+    copy-on-write and points the module's tensors at the mapping. The weights
+    therefore live once in the page cache and are shared by all workers
+    instead of being held privately by each of them. Modules that are not on
+    the CPU are returned unchanged, their host copy is already gone.
+
+    The module must already hold its weights: every worker still loads the
+    checkpoint and builds the model before its tensors are swapped for the
+    mapping, so this saves resident memory, not start-up time.
+    """
+    state_dict = module.state_dict()
+    if any(tensor.device.type != 'cpu' for tensor in state_dict.values()):
+        return module
+
+    os.makedirs(weights_dir, exist_ok=True)
+    path = os.path.join(weights_dir, f'{name}-{_fingerprint(state_dict)}.bin')
+    if not os.path.isfile(path):
+        # several workers start at once, only one of them writes the file
+        with open(f'{path}.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.isfile(path):
+                save_flat(state_dict, path)
+
+    _bind(module, load_flat(path))
+    return module
+
+
+def release_memory():
+    """Hand the memory of the replaced private weights back to the OS.
+
+    glibc keeps freed heap memory for reuse, so without trimming the private
+    copies loaded from the checkpoints would stay resident after sharing.
+    """
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def save_flat(state_dict, path):
+    header = {}
+    offset = 0
+    for key, tensor in state_dict.items():
+        dtype = str(tensor.dtype).replace('torch.', '')
+        if dtype not in _DTYPES:
+            raise ValueError(f'Unsupported dtype {dtype} for {key}.')
+        nbytes = tensor.numel() * tensor.element_size()
+        header[key] = {'dtype': dtype, 'shape': list(tensor.shape), 'offset': offset}
+        offset += (nbytes + _ALIGN - 1) // _ALIGN * _ALIGN
+
+    header_bytes = json.dumps(header).encode()
+    data_start = (8 + len(header_bytes) + _ALIGN - 1) // _ALIGN * _ALIGN
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for key, tensor in state_dict.items():
+            f.seek(data_start + header[key]['offset'])
+            tensor = tensor.detach().contiguous()
+            if tensor.dtype == torch.bfloat16:
+                tensor = tensor.view(torch.int16)
+            f.write(tensor.numpy().tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def load_flat(path):
+    """Map a file written by ``save_flat``; returns a dict of tensors sharing the mapping."""
+    with open(path, 'rb') as f:
+        header_len = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_len))
+    data_start = (8 + header_len + _ALIGN - 1) // _ALIGN * _ALIGN
+
+    # mode 'c' maps the file copy-on-write: pages stay shared until written to
+    mapping = np.memmap(path, dtype=np.uint8, mode='c')
+    tensors = {}
+    for key, info in header.items():
+        np_dtype, torch_dtype = _DTYPES[info['dtype']]
+        count = int(np.prod(info['shape'], dtype=np.int64))
+        start = data_start + info['offset']
+        array = mapping[start:start + count * np.dtype(np_dtype).itemsize].view(np_dtype)
+        tensor = torch.from_numpy(array).view(info['shape'])
+        if torch_dtype is not None:
+            tensor = tensor.view(torch_dtype)
+        tensors[key] = tensor
+    return tensors
+
+
+def _bind(module, tensors):
+    for key, tensor in tensors.items():
+        owner_name, _, attr = key.rpartition('.')
+        owner = module.get_submodule(owner_name) if owner_name else module
+        if attr in owner._parameters and owner._parameters[attr] is not None:
+            owner._parameters[attr].data = tensor
+        elif attr in owner._buffers:
+            owner._buffers[attr] = tensor
+
+
+def _fingerprint(state_dict):
+    """Identity of a state dict: names, shapes, dtypes and all the values, so other weights get another file."""
+    digest = hashlib.blake2b(digest_size=16)
+    for key, tensor in state_dict.items():
+        digest.update(f'{key}{tuple(tensor.shape)}{tensor.dtype}'.encode())
+        digest_tensor(digest, tensor)
+    return digest.hexdigest()
+
+
+def digest_tensor(digest, tensor):
+    """Feed the values of ``tensor`` (of any dtype, on any device) to the hashlib object ``digest``."""
+    tensor = tensor.detach().cpu().contiguous()
+    # numpy has no bfloat16, hash the raw bits
+    if tensor.dtype == torch.bfloat16:
+        tensor = tensor.view(torch.int16)
+    digest.update(tensor.numpy().reshape(-1).view(np.uint8))
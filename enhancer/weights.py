@@ -0,0 +1,99 @@
+import fcntl
+import hashlib
+import os
+import shutil
+
+import requests
+
+
+def fetch_weights(url, path, sha256=None, mirror_dir=None, chunk_size=64 * 1024, timeout=30, retries=3):
+    """Make sure ``path`` holds the file behind ``url`` and return ``path``.
+
+    The file is taken from ``mirror_dir`` when it holds a file of the same
+    name, otherwise it is downloaded. Data is written to ``<path>.part`` and
+    only renamed to ``path`` once it is complete and matches ``sha256`` (when
+    given), so a file at ``path`` is never partial. An interrupted download is
+    resumed with an HTTP Range request, on the next attempt or the next start.
+    Several processes may call this at once; one of them fetches the file.
+    """
+    if _is_valid(path, sha256):
+        return path
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f'{path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if _is_valid(path, sha256):
+            return path
+
+        part_path = f'{path}.part'
+        mirror_path = os.path.join(mirror_dir, os.path.basename(path)) if mirror_dir else None
+        if mirror_path is not None and os.path.isfile(mirror_path):
+            shutil.copyfile(mirror_path, part_path)
+            if _matches(part_path, sha256):
+                os.replace(part_path, path)
+                return path
+            print(f'Checksum mismatch for {mirror_path}, downloading {url} instead.')
+            os.remove(part_path)
+
+        print(f'Downloading {url}...')
+        for attempt in range(retries):
+            try:
+                _download(url, part_path, chunk_size, timeout)
+                break
+            except requests.RequestException as error:
+                if attempt == retries - 1:
+                    raise
+                print(f'Download of {url} interrupted ({error}), resuming.')
+
+        if not _matches(part_path, sha256):
+            os.remove(part_path)
+            raise ValueError(f'Checksum mismatch for {url}.')
+        os.replace(part_path, path)
+    return path
+
+
+def file_sha256(path, chunk_size=1024 ** 2):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_valid(path, sha256):
+    return os.path.isfile(path) and _matches(path, sha256)
+
+
+def _matches(path, sha256):
+    return sha256 is None or file_sha256(path) == sha256.lower()
+
+
+def _download(url, part_path, chunk_size, timeout):
+    """Append the rest of ``url`` to ``part_path``, or start over if the server ignores the Range header."""
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+        if resp.status_code == 416:
+            if resp.headers.get('Content-Range') == f'bytes */{offset}':
+                # the previous attempt got everything but was not renamed
+                return
+            # the partial file is longer than the remote one
+            os.remove(part_path)
+            return _download(url, part_path, chunk_size, timeout)
+        resp.raise_for_status()
+
+        if resp.status_code == 206:
+            mode = 'ab'
+            total = resp.headers.get('Content-Range', '*').rpartition('/')[2]
+        else:
+            mode, offset = 'wb', 0
+            total = resp.headers.get('Content-Length', '*')
+        total = int(total) if total.isdigit() else None
+
+        with open(part_path, mode) as f:
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                offset += len(chunk)
+
+    if total is not None and offset != total:
+        raise requests.ConnectionError(f'Incomplete download of {url}: {offset} of {total} bytes.')
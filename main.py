@@ -1,7 +1,16 @@
 from PIL import Image
+import cv2
 import numpy as np
 from enhancer.enhancer import Enhancer
 import argparse
+import glob
+import itertools
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
 
 
 def main(method, image_path, output_path, background_enhancement, upscale):
@@ -15,20 +24,158 @@ def main(method, image_path, output_path, background_enhancement, upscale):
     final_image.save(output_path)
 
 
+def list_inputs(source):
+    """Images of a directory (recursively), a glob pattern, or a manifest file listing one path per line.
+
+    Returns (input path, output name) pairs; the output name is the path
+    relative to the directory, or for a pattern or manifest to the deepest
+    directory holding all its images, so that images of the same name in
+    different directories keep apart. Whatever the source, only existing
+    files with an image extension are kept.
+    """
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, '**', '*'), recursive=True)
+        return [(path, os.path.relpath(path, source)) for path in sorted(paths) if _is_image(path)]
+    if os.path.isfile(source) and not _is_image(source):
+        with open(source) as f:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    else:
+        paths = sorted(glob.glob(source, recursive=True))
+    paths = [path for path in paths if _is_image(path)]
+    if not paths:
+        return []
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    return [(path, os.path.relpath(os.path.abspath(path), root)) for path in paths]
+
+
+def enhance_folder(enhancer, source, output_dir, batch_size=4, decode_threads=4, encode_threads=2, queue_size=16,
+                   overwrite=False):
+    """Enhance every image of ``source`` (see ``list_inputs``) into ``output_dir``.
+
+    Runs as a three-stage pipeline: images are decoded on ``decode_threads``
+    threads, enhanced ``batch_size`` at a time on the calling thread, and
+    encoded and written on ``encode_threads`` threads. At most ``queue_size``
+    images wait between two stages. Outputs are written to a temporary file
+    and renamed, so an interrupted run can be resumed: images whose output
+    already exists are skipped unless ``overwrite`` is set.
+    """
+    inputs = list_inputs(source)
+    todo = [(path, os.path.join(output_dir, name)) for path, name in inputs]
+    if not overwrite:
+        todo = [(path, output_path) for path, output_path in todo if not os.path.exists(output_path)]
+    counts = {"enhanced": 0, "failed": 0, "skipped": len(inputs) - len(todo)}
+
+    def report_failure(path, error):
+        print(f'Failed to enhance {path}: {error}')
+        counts["failed"] += 1
+
+    def finish_writes(limit):
+        while len(writes) > limit:
+            path, future = writes.popleft()
+            try:
+                future.result()
+                counts["enhanced"] += 1
+            except Exception as error:
+                report_failure(path, error)
+
+    start = time.monotonic()
+    remaining = iter(todo)
+    decoded = deque()
+    writes = deque()
+    with ThreadPoolExecutor(decode_threads, thread_name_prefix='decode') as decoder, \
+            ThreadPoolExecutor(encode_threads, thread_name_prefix='encode') as encoder:
+        while True:
+            # keep up to queue_size images decoding ahead of inference
+            for path, output_path in itertools.islice(remaining, queue_size - len(decoded)):
+                decoded.append((path, output_path, decoder.submit(_decode, path)))
+            if not decoded:
+                break
+
+            batch = [decoded.popleft() for _ in range(min(batch_size, len(decoded)))]
+            images = []
+            for path, output_path, future in batch:
+                try:
+                    images.append((path, output_path, future.result()))
+                except Exception as error:
+                    report_failure(path, error)
+
+            outputs = enhancer.enhance_batch(
+                [image for _, _, image in images], return_exceptions=True, channel_order='bgr'
+            )
+            for (path, output_path, _), output in zip(images, outputs):
+                if isinstance(output, Exception):
+                    report_failure(path, output)
+                    continue
+                finish_writes(queue_size - 1)
+                writes.append((path, encoder.submit(_write, output, output_path)))
+        finish_writes(0)
+
+    elapsed = time.monotonic() - start
+    rate = counts["enhanced"] / elapsed if elapsed > 0 else 0.
+    print(f'Enhanced {counts["enhanced"]} images in {elapsed:.1f}s ({rate:.2f} images/sec), '
+          f'skipped {counts["skipped"]} existing, {counts["failed"]} failed.')
+    return counts
+
+
+def _is_image(path):
+    return os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _decode(path):
+    # straight to BGR, the order the models work in
+    image = cv2.imread(path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise ValueError(f'cannot identify image file {path!r}')
+    return image
+
+
+def _write(image, output_path):
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    # rename into place once written, so a resumed run never sees a partial output
+    root, ext = os.path.splitext(output_path)
+    tmp_path = f'{root}.tmp{ext}'
+    if not cv2.imwrite(tmp_path, image):
+        raise ValueError(f'cannot write image file {output_path!r}')
+    os.replace(tmp_path, output_path)
+
+
 if __name__ == "__main__":
     # Create argument parser
     parser = argparse.ArgumentParser(description="Process method and image.")
     # Add method argument
     parser.add_argument("--method", type=str, required=True, help="Specify the enhance method. (gfpgan, RestoreFormer, codeformer)")
     # Add image path argument
-    parser.add_argument("--image_path", type=str, required=True, help="Specify the image path.")
+    parser.add_argument("--image_path", type=str, help="Specify the image path.")
     # Add output image argument
-    parser.add_argument("--output_path", type=str, required=True, help="Specify the output path.")
+    parser.add_argument("--output_path", type=str, help="Specify the output path.")
+    # Add batch input arguments
+    parser.add_argument("--input", type=str, help="Specify a directory, a glob pattern or a manifest file of images to enhance.")
+    parser.add_argument("--output_dir", type=str, help="Specify the output directory for --input.")
+    parser.add_argument("--batch_size", type=int, default=4, help="Specify the number of images enhanced together.")
+    parser.add_argument("--decode_threads", type=int, default=4, help="Specify the number of decoding threads.")
+    parser.add_argument("--encode_threads", type=int, default=2, help="Specify the number of encoding threads.")
+    parser.add_argument("--queue_size", type=int, default=16, help="Specify the number of images queued between stages.")
+    parser.add_argument("--overwrite", action="store_true", help="Enhance images whose output already exists.")
     # Add background enhancement argument
     parser.add_argument("--background_enhancement", action="store_true", help="Specify the background enhancement option.", default=True)
     # Add enhancement upscale argument
     parser.add_argument("--upscale", type=int, help="Specify the enhancement scale (2, 4).")
     # Parse the arguments
     args = parser.parse_args()
-    # Call the main function with parsed arguments
-    main(args.method, args.image_path, args.output_path, args.background_enhancement, args.upscale)
+    if args.input is not None:
+        if args.output_dir is None:
+            parser.error("--output_dir is required with --input.")
+        enhancer = Enhancer(method=args.method, background_enhancement=args.background_enhancement, upscale=args.upscale)
+        enhance_folder(
+            enhancer, args.input, args.output_dir,
+            batch_size=args.batch_size,
+            decode_threads=args.decode_threads,
+            encode_threads=args.encode_threads,
+            queue_size=args.queue_size,
+            overwrite=args.overwrite
+        )
+    elif args.image_path is not None and args.output_path is not None:
+        # Call the main function with parsed arguments
+        main(args.method, args.image_path, args.output_path, args.background_enhancement, args.upscale)
+    else:
+        parser.error("Specify either --image_path and --output_path, or --input and --output_dir.")
@@ -0,0 +1,91 @@
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.openmetrics import exposition as openmetrics
+
+# Upper bounds in megapixels of the image-size label
+SIZE_BUCKETS = (0.5, 2, 8, 16)
+
+# stages: queue (scheduler), decode and encode (services), detect, align, restore, upsample and paste (Enhancer)
+STAGE_SECONDS = Histogram(
+    'enhance_stage_seconds',
+    'Seconds an image spent in each stage of the enhance pipeline.',
+    ['stage', 'method', 'upscale', 'size'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60),
+)
+
+# reasons: disconnect (the client went away) and deadline; stage: the first stage that was not run
+ABANDONED = Counter(
+    'enhance_abandoned',
+    'Images whose enhancement was abandoned, by reason and the stage it stopped before.',
+    ['reason', 'stage', 'method', 'upscale'],
+)
+ABANDONED_SECONDS = Counter(
+    'enhance_abandoned_seconds',
+    'Seconds spent on images whose enhancement was abandoned, i.e. wasted work.',
+    ['reason', 'method', 'upscale'],
+)
+
+# tiers: see enhancer.enhancer.TIERS, picked by the admission controller from the wait of recent requests
+QUALITY_TIER = Counter(
+    'enhance_quality_tier',
+    'Images enhanced, by the quality tier they were enhanced at.',
+    ['tier', 'method', 'upscale'],
+)
+
+# batch scheduler: images waiting, observed whenever a request is queued or a batch is taken out of the queue,
+# and images per batch handed to the enhancer
+QUEUE_DEPTH = Histogram(
+    'enhance_queue_depth',
+    'Images waiting in the batch scheduler, observed on every enqueue and dispatch.',
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128),
+)
+BATCH_SIZE = Histogram(
+    'enhance_batch_size',
+    'Images per batch run through the enhancer.',
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32),
+)
+
+# Longest trace id kept as exemplar; OpenMetrics allows 128 characters for all exemplar labels
+_MAX_TRACE_ID = 64
+
+
+def size_bucket(image):
+    """Image-size label: the smallest of ``SIZE_BUCKETS`` the image fits in, e.g. '2MP'."""
+    megapixels = image.shape[0] * image.shape[1] / 1e6
+    for limit in SIZE_BUCKETS:
+        if megapixels <= limit:
+            return f'{limit}MP'
+    return f'>{SIZE_BUCKETS[-1]}MP'
+
+
+def observe(timings, method, upscale, size, trace_id=None):
+    """Record the stage timings of one image; ``trace_id`` is attached as exemplar."""
+    exemplar = {'trace_id': trace_id[:_MAX_TRACE_ID]} if trace_id else None
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.labels(stage, method, str(upscale), size).observe(seconds, exemplar)
+
+
+def observe_abandoned(cancelled, timings, method, upscale):
+    """Count an image abandoned with the ``Cancelled`` exception ``cancelled``, after ``timings``."""
+    ABANDONED.labels(cancelled.reason, cancelled.stage, method, str(upscale)).inc()
+    seconds = sum(seconds for stage, seconds in timings.items() if stage != 'queue')
+    ABANDONED_SECONDS.labels(cancelled.reason, method, str(upscale)).inc(seconds)
+
+
+def render(accept=''):
+    """Exposition of all metrics as (body, content type).
+
+    Exemplars (trace ids) are only part of the OpenMetrics format, which is
+    used when the scraper asks for it. With ``PROMETHEUS_MULTIPROC_DIR`` set,
+    the metrics of all uvicorn workers are aggregated.
+    """
+    registry = REGISTRY
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    if 'application/openmetrics-text' in accept:
+        return openmetrics.generate_latest(registry), openmetrics.CONTENT_TYPE_LATEST
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,63 @@
+import threading
+import time
+import traceback
+
+
+class ModelNotReady(Exception):
+    """Raised while the models are still being fetched, loaded or warmed up."""
+
+    def __init__(self, retry_after, status):
+        super().__init__(f'Models are not ready yet ({status}), retry in {retry_after}s.')
+        self.retry_after = retry_after
+        self.status = status
+
+
+class ModelLoader:
+    """Builds the enhancer on a background thread so the server can start answering at once.
+
+    ``factory`` fetches and loads the weights and runs a warm-up inference;
+    until it returns, ``get`` raises ``ModelNotReady`` and ``status`` reports
+    ``"ready": False``. If the factory fails, the error is reported by
+    ``status`` and the loader stays not ready.
+    """
+
+    def __init__(self, factory, retry_after=5):
+        self.factory = factory
+        self.retry_after = retry_after
+
+        self._enhancer = None
+        self._error = None
+        self._started = time.monotonic()
+        self._load_seconds = None
+        self._ready = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, name='model-loader', daemon=True)
+        self._thread.start()
+
+    def get(self):
+        """The enhancer, or ``ModelNotReady`` if it is not loaded yet."""
+        if not self._ready.is_set():
+            raise ModelNotReady(self.retry_after, 'failed' if self._error is not None else 'loading')
+        return self._enhancer
+
+    def wait(self, timeout=None):
+        """Block until the enhancer is ready; returns False on timeout or if loading failed."""
+        self._thread.join(timeout)
+        return self._ready.is_set()
+
+    def status(self):
+        if self._ready.is_set():
+            return {"ready": True, "status": "ready", "load_seconds": self._load_seconds}
+        if self._error is not None:
+            return {"ready": False, "status": "failed", "error": f"{self._error.args}"}
+        return {"ready": False, "status": "loading", "elapsed_seconds": time.monotonic() - self._started}
+
+    def _run(self):
+        try:
+            self._enhancer = self.factory()
+        except Exception as e:
+            print(traceback.format_exc())
+            self._error = e
+            return
+        self._load_seconds = time.monotonic() - self._started
+        self._ready.set()
@@ -0,0 +1,170 @@
+import asyncio
+import queue
+import threading
+import time
+import traceback
+from collections import Counter, namedtuple
+
+import metrics
+
+# one submitted request: its images and, per image, the timings dict, cancel token and quality tier
+_Request = namedtuple('_Request', ['images', 'future', 'loop', 'timings', 'queued_at', 'tokens', 'tiers'])
+
+
+class BatchScheduler:
+    """Groups concurrent enhancement requests into micro-batches.
+
+    Requests are queued from the event loop and picked up by a single worker
+    thread, which waits up to ``max_wait_ms`` for up to ``max_batch_size``
+    images and runs them through ``Enhancer.enhance_batch`` so that all their
+    aligned face crops share the GFPGAN forward passes. The images of one
+    request are never split across batches; a request with more than
+    ``max_batch_size`` images runs as a batch of its own. ``enhancer`` may be
+    set after construction, as long as it is set before the first submit.
+
+    The number of images waiting is observed in the ``enhance_queue_depth``
+    histogram whenever a request is queued or a batch is dispatched, and the
+    size of every batch in ``enhance_batch_size``.
+    """
+
+    def __init__(self, enhancer, max_batch_size=4, max_wait_ms=10, channel_order='rgb'):
+        if max_batch_size < 1:
+            raise ValueError(f'Wrong max batch size {max_batch_size}.')
+        self.enhancer = enhancer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.channel_order = channel_order
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._processed = 0
+        # images queued and not dispatched yet
+        self._queued = 0
+        # request that did not fit in the previous batch, it opens the next one
+        self._pending = None
+
+        self._thread = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+        self._thread.start()
+
+    async def submit(self, image):
+        """Queue an image in ``channel_order`` and wait for its enhanced version."""
+        result = (await self.submit_batch([image]))[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def submit_batch(self, images, timings=None, tokens=None, tiers=None):
+        """Queue images as one unit; returns the enhanced images, or the exception of each failed one.
+
+        ``timings``, one dict per image, receives the seconds spent waiting in
+        the queue and in each stage of the enhancer. ``tokens``, one
+        ``CancelToken`` (or None) per image, are handed to the enhancer; an
+        image cancelled while queued is abandoned before detection. ``tiers``,
+        one quality tier per image, are handed to the enhancer as well.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        timings = timings or [None] * len(images)
+        tokens = tokens or [None] * len(images)
+        tiers = tiers or ['full'] * len(images)
+        with self._lock:
+            self._queued += len(images)
+            metrics.QUEUE_DEPTH.observe(self._queued)
+        self._queue.put(_Request(images, future, loop, timings, time.perf_counter(), tokens, tiers))
+        return await future
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queued,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "processed": self._processed,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+            }
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        if self._pending is not None:
+            first, self._pending = self._pending, None
+        else:
+            first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        size = len(first.images)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            if size + len(item.images) > self.max_batch_size:
+                self._pending = item
+                break
+            batch.append(item)
+            size += len(item.images)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            with self._lock:
+                self._queued -= sum(len(request.images) for request in batch)
+                metrics.QUEUE_DEPTH.observe(self._queued)
+            # drop requests whose client already went away
+            batch = [request for request in batch if not request.future.cancelled()]
+            if not batch:
+                continue
+
+            images = [image for request in batch for image in request.images]
+            timings = [timing for request in batch for timing in request.timings]
+            tokens = [token for request in batch for token in request.tokens]
+            tiers = [tier for request in batch for tier in request.tiers]
+            started = time.perf_counter()
+            for request in batch:
+                for timing in request.timings:
+                    if timing is not None:
+                        timing['queue'] = started - request.queued_at
+            try:
+                outputs = self.enhancer.enhance_batch(
+                    images, return_exceptions=True, channel_order=self.channel_order, timings=timings, tokens=tokens,
+                    tiers=tiers
+                )
+            except Exception as e:
+                print(traceback.format_exc())
+                for request in batch:
+                    request.loop.call_soon_threadsafe(_set_exception, request.future, e)
+            else:
+                start = 0
+                for request in batch:
+                    end = start + len(request.images)
+                    request.loop.call_soon_threadsafe(_set_result, request.future, outputs[start:end])
+                    start = end
+
+            metrics.BATCH_SIZE.observe(len(images))
+            with self._lock:
+                self._batch_sizes[len(images)] += 1
+                self._processed += len(images)
+
+
+def _set_result(future, result):
+    if not future.cancelled():
+        future.set_result(result)
+
+
+def _set_exception(future, exception):
+    if not future.cancelled():
+        future.set_exception(exception)
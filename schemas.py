@@ -1,6 +1,17 @@
 import pydantic as _pydantic
-from typing import List
+from typing import List, Optional
 
 
 class _EnhanceBase(_pydantic.BaseModel):
     encoded_base_img: List[str]
+    # output: jpeg (default), webp or png; quality 1-100 of JPEG and WebP, compression 0-9 of PNG
+    format: Optional[str] = None
+    quality: Optional[int] = None
+    compression: Optional[int] = None
+
+
+class _EnhanceResult(_pydantic.BaseModel):
+    image: Optional[str] = None
+    error: Optional[str] = None
+    # quality tier the image was enhanced at, lower than "full" under load
+    tier: Optional[str] = None
@@ -1,14 +1,33 @@
 import schemas as _schemas
 import os
+import asyncio
+import functools
+import itertools
+from typing import Iterator, List, Optional, Union
 from PIL import Image
 from io import BytesIO
-import uuid
+import cv2
 import numpy as np
+import torch
 import base64
+import time
+import metrics
+import encoding
 from enhancer.enhancer import Enhancer
+from scheduler import BatchScheduler
+from worker_pool import WorkerPool, PoolOverloaded
+from cache import ResultCache
+from model_loader import ModelLoader, ModelNotReady
+from admission import AdmissionController
+from enhancer.cancellation import Cancelled, CancelToken
 
 
-TEMP_PATH = 'temp'
+# Output without a format in the request; PNG is encoded band by band while it is streamed out
+OUTPUT_MIME = 'image/jpeg'
+STREAM_MIME = 'image/png'
+# Progressive JPEGs can be shown at low resolution before they are fully downloaded
+PROGRESSIVE_JPEG = os.getenv('PROGRESSIVE_JPEG') == 'True'
+STREAM_CHUNK_SIZE = 64 * 1024
 ENHANCE_METHOD = os.getenv('METHOD')
 BACKGROUND_ENHANCEMENT = os.getenv('BACKGROUND_ENHANCEMENT')
 if ENHANCE_METHOD is None:
@@ -18,18 +37,411 @@ if BACKGROUND_ENHANCEMENT is None:
     BACKGROUND_ENHANCEMENT = True
 else:
     BACKGROUND_ENHANCEMENT = True if BACKGROUND_ENHANCEMENT == 'True' else False
+UPSCALE = 2
+# CPU inference: torch intra-op threads of the process, int8 quantization of the background upsampler
+CPU_THREADS = int(os.getenv('CPU_THREADS')) if os.getenv('CPU_THREADS') else None
+CPU_QUANTIZE = os.getenv('CPU_QUANTIZE') == 'True'
+# Directory for memory-mapped weights shared by all uvicorn workers (CPU inference only)
+SHARED_WEIGHTS_DIR = os.getenv('SHARED_WEIGHTS_DIR')
+# Weights: expected SHA256 of the face restoration model and of the CPU background model,
+# local directory to copy weights from
+MODEL_SHA256 = os.getenv('MODEL_SHA256')
+BG_MODEL_SHA256 = os.getenv('BG_MODEL_SHA256')
+WEIGHTS_MIRROR_DIR = os.getenv('WEIGHTS_MIRROR_DIR')
+# Precision of the face restorer and background model (fp32, fp16, bf16) and channels-last background model
+PRECISION = os.getenv('PRECISION')
+CHANNELS_LAST = os.getenv('CHANNELS_LAST') == 'True'
+# Directory of traced and frozen models, compiled on the first start; batch sizes the face restorer is traced for
+COMPILED_MODELS_DIR = os.getenv('COMPILED_MODELS_DIR')
+COMPILE_BATCH_SIZES = tuple(int(size) for size in os.getenv('COMPILE_BATCH_SIZES', '1').split(','))
+# Face detection: longest side of the detection proxy, number of images whose detections are kept,
+# and whether background tiles hidden by restored faces skip the upsampler
+DETECT_SIZE = int(os.getenv('DETECT_SIZE')) if os.getenv('DETECT_SIZE') else None
+DETECTION_CACHE_SIZE = int(os.getenv('DETECTION_CACHE_SIZE', 0))
+SKIP_COVERED_TILES = os.getenv('SKIP_COVERED_TILES') == 'True'
+# Image run through the enhancer before the service reports ready
+WARMUP_IMAGE = os.getenv('WARMUP_IMAGE', os.path.join('samples', 'obama.jpg'))
 
-enhancer = Enhancer(method=ENHANCE_METHOD, background_enhancement=BACKGROUND_ENHANCEMENT, upscale=2)
+# Micro-batching: up to MAX_BATCH_SIZE requests arriving within MAX_BATCH_WAIT_MS share one forward pass
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 4))
+MAX_BATCH_WAIT_MS = float(os.getenv('MAX_BATCH_WAIT_MS', 10))
 
+# Backpressure: ENHANCE_CONCURRENCY requests are processed at once, ENHANCE_QUEUE_SIZE more may wait,
+# the rest are rejected and told to come back after RETRY_AFTER seconds
+ENHANCE_CONCURRENCY = int(os.getenv('ENHANCE_CONCURRENCY', MAX_BATCH_SIZE))
+ENHANCE_QUEUE_SIZE = int(os.getenv('ENHANCE_QUEUE_SIZE', 16))
+ENHANCE_THREADS = int(os.getenv('ENHANCE_THREADS', 2))
+RETRY_AFTER = int(os.getenv('RETRY_AFTER', 5))
 
-async def enhance(enhanceBase: _schemas._EnhanceBase) -> Image:
-    init_image = np.array(Image.open(BytesIO(base64.b64decode(enhanceBase.encoded_base_img[0]))))
-    restored_image = enhancer.enhance(init_image)
+# Requests are abandoned after REQUEST_TIMEOUT seconds (none when 0); clients may ask for less.
+# Whether the client is still there is checked every DISCONNECT_POLL_SECONDS.
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', 300)) or None
+DISCONNECT_POLL_SECONDS = float(os.getenv('DISCONNECT_POLL_SECONDS', 0.5))
 
-    final_image = Image.fromarray(restored_image)
-    buffered = BytesIO()
-    final_image.save(buffered, format="JPEG")
-    encoded_img = base64.b64encode(buffered.getvalue())
-    
-    return encoded_img
-        
\ No newline at end of file
+# Quality tiers under load: each of QUALITY_TIER_WAITS (seconds, comma separated, ascending) that the average
+# wait of recent requests reaches steps new requests down one cheaper tier; none when empty
+QUALITY_TIER_WAITS = tuple(float(seconds) for seconds in os.getenv('QUALITY_TIER_WAITS', '').split(',') if seconds)
+# without new requests the average halves every QUALITY_TIER_HALF_LIFE seconds
+QUALITY_TIER_HALF_LIFE = float(os.getenv('QUALITY_TIER_HALF_LIFE', 10))
+
+# Result cache: in-memory LRU of CACHE_MAX_BYTES, plus an on-disk tier when CACHE_DIR is set
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 256 * 1024 ** 2))
+CACHE_DIR = os.getenv('CACHE_DIR')
+CACHE_DISK_MAX_BYTES = int(os.getenv('CACHE_DISK_MAX_BYTES', 2 * 1024 ** 3))
+CACHE_TTL = int(os.getenv('CACHE_TTL', 24 * 3600))
+
+
+
+def _load_enhancer() -> Enhancer:
+    # set once for the process, every model built afterwards shares these threads
+    if CPU_THREADS is not None:
+        torch.set_num_threads(CPU_THREADS)
+    enhancer = Enhancer(
+        method=ENHANCE_METHOD,
+        background_enhancement=BACKGROUND_ENHANCEMENT,
+        upscale=UPSCALE,
+        shared_weights_dir=SHARED_WEIGHTS_DIR,
+        cpu_quantize=CPU_QUANTIZE,
+        model_sha256=MODEL_SHA256,
+        weights_mirror_dir=WEIGHTS_MIRROR_DIR,
+        bg_model_sha256=BG_MODEL_SHA256,
+        detect_size=DETECT_SIZE,
+        detection_cache_size=DETECTION_CACHE_SIZE,
+        skip_covered_tiles=SKIP_COVERED_TILES,
+        precision=PRECISION,
+        channels_last=CHANNELS_LAST,
+        compile_dir=COMPILED_MODELS_DIR,
+        compile_batch_sizes=COMPILE_BATCH_SIZES,
+        quality_tiers=bool(QUALITY_TIER_WAITS)
+    )
+    warmup_image = None
+    if os.path.isfile(WARMUP_IMAGE):
+        with open(WARMUP_IMAGE, 'rb') as f:
+            warmup_image = _decode(f.read())
+    enhancer.warm_up(warmup_image, channel_order='bgr')
+    admission.tiers = enhancer.tiers
+    scheduler.enhancer = enhancer
+    return enhancer
+
+
+# the enhancer is set by _load_enhancer once it is ready
+# images stay BGR from decoding to encoding
+scheduler = BatchScheduler(None, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS, channel_order='bgr')
+pool = WorkerPool(
+    concurrency=ENHANCE_CONCURRENCY, max_queue=ENHANCE_QUEUE_SIZE, threads=ENHANCE_THREADS, retry_after=RETRY_AFTER
+)
+cache = ResultCache(max_bytes=CACHE_MAX_BYTES, disk_dir=CACHE_DIR, disk_max_bytes=CACHE_DISK_MAX_BYTES, ttl=CACHE_TTL)
+# the tiers are set by _load_enhancer, to those the enhancer has
+admission = AdmissionController(QUALITY_TIER_WAITS, half_life=QUALITY_TIER_HALF_LIFE)
+
+
+class _Job:
+    """One image of a request on its way through cache lookup, enhancement and encoding."""
+
+    def __init__(self, key, image=None, result=None):
+        self.key = key
+        self.image = image
+        self.result = result
+        # quality tier the image was enhanced at; degraded results are not cached
+        self.tier = 'full'
+        # seconds per pipeline stage and the image-size label, for the stage metrics
+        self.timings = {}
+        self.size = None
+
+
+def _decode(data: bytes) -> np.ndarray:
+    """Decode straight into a BGR uint8 array; PIL only handles the formats OpenCV cannot read."""
+    flags = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+    if image is None:
+        image = np.array(Image.open(BytesIO(data)).convert('RGB'))
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=image)
+    return image
+
+
+def output_format(accept: str = '', format: Optional[str] = None, quality: Optional[int] = None,
+                  compression: Optional[int] = None) -> tuple:
+    """The (mime type, level) a request asks for, see ``encoding.negotiate``; ValueError if it is invalid."""
+    return encoding.negotiate(accept, format=format, quality=quality, compression=compression, default=OUTPUT_MIME)
+
+
+DEFAULT_FORMAT = output_format()
+
+
+def _encode(restored_image: np.ndarray, output_format: tuple = DEFAULT_FORMAT) -> bytes:
+    """Encode a BGR image as (mime type, level)."""
+    mime, level = output_format
+    return encoding.encode(restored_image, mime, level, progressive=PROGRESSIVE_JPEG)
+
+
+def _cache_params(output_format: tuple = DEFAULT_FORMAT) -> tuple:
+    """Everything besides the input pixels that changes the encoded output."""
+    return (ENHANCE_METHOD, BACKGROUND_ENHANCEMENT, UPSCALE, loader.get().version, output_format, PROGRESSIVE_JPEG)
+
+
+def _lookup(data: Union[bytes, str], output_format: tuple = DEFAULT_FORMAT,
+            token: Optional[CancelToken] = None) -> _Job:
+    """Answer from the cache by input bytes, else decode and try again by pixels. Strings are base64."""
+    if token is not None:
+        token.check('decode')
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    params = _cache_params(output_format)
+    raw_key = cache.key(data, *params)
+    result = cache.lookup(raw_key)
+    if result is not None:
+        return _Job(None, result=result)
+
+    start = time.perf_counter()
+    image = _decode(data)
+    decoded = time.perf_counter()
+    key = cache.key(image, *params)
+    cache.alias(raw_key, key)
+    job = _Job(key, image=image, result=cache.get(key))
+    job.timings['decode'] = decoded - start
+    job.size = metrics.size_bucket(image)
+    return job
+
+
+def _finish(job: _Job, output_format: tuple = DEFAULT_FORMAT, token: Optional[CancelToken] = None) -> bytes:
+    if job.result is None:
+        if isinstance(job.image, Exception):
+            raise job.image
+        if token is not None:
+            token.check('encode')
+        start = time.perf_counter()
+        job.result = _encode(job.image, output_format)
+        job.timings['encode'] = time.perf_counter() - start
+        if job.tier == 'full':
+            cache.put(job.key, job.result)
+    return job.result
+
+
+async def _run_each(fn, items):
+    """Run ``fn`` on the pool for every item concurrently, passing exceptions through in place."""
+    async def run(item):
+        if isinstance(item, Exception):
+            return item
+        return await pool.run(fn, item)
+
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+
+async def _process(payloads: List[Union[bytes, str]], trace_id: Optional[str] = None,
+                   output_format: tuple = DEFAULT_FORMAT, encode: bool = True,
+                   token: Optional[CancelToken] = None, keep_slot: bool = False) -> list:
+    """Enhance encoded images as one batch and return their jobs, encoded as ``output_format``.
+
+    Cached images skip decoding, enhancement and encoding. Failed images get
+    their exception in place of the job. Raises ``ModelNotReady`` until the
+    models are loaded and warmed up. The time spent per stage is recorded in
+    the stage metrics, with ``trace_id`` attached. Without ``encode`` the
+    results are left for the caller to encode.
+
+    The quality tier of the request is picked by the admission controller
+    once it has a processing slot. Its wait is reported back to it however
+    the request ends; a request the pool rejects counts as waiting the
+    ``Retry-After`` it is answered with. Images enhanced at a
+    lower tier than 'full' are not cached, so the cache only ever answers at
+    full quality; ``job.tier`` says what an image got.
+
+    Once ``token`` is cancelled (the client went away or the deadline passed)
+    the remaining work is abandoned at the next checkpoint, counted in the
+    abandoned-work metrics, and ``Cancelled`` is raised.
+    """
+    loader.get()
+    arrived = time.perf_counter()
+    try:
+        await pool.acquire()
+    except PoolOverloaded as error:
+        # its client is told to wait this long
+        admission.observe(error.retry_after)
+        raise
+    except asyncio.CancelledError:
+        admission.observe(time.perf_counter() - arrived)
+        raise
+    tier = admission.tier()
+    # seconds until processing started, once known
+    waited = None
+    kept = False
+    try:
+        try:
+            wait = time.perf_counter() - arrived
+            jobs = await _run_each(functools.partial(_lookup, output_format=output_format, token=token), payloads)
+
+            pending = [job for job in jobs if isinstance(job, _Job) and job.result is None]
+            if pending:
+                restored = await scheduler.submit_batch(
+                    [job.image for job in pending], timings=[job.timings for job in pending],
+                    tokens=[token] * len(pending), tiers=[tier] * len(pending)
+                )
+                wait += pending[0].timings.get('queue', 0.)
+                for job, image in zip(pending, restored):
+                    job.image = image
+                    job.tier = tier
+                metrics.QUALITY_TIER.labels(tier, ENHANCE_METHOD, str(UPSCALE)).inc(len(pending))
+            waited = wait
+
+            if encode:
+                results = await _run_each(functools.partial(_finish, output_format=output_format, token=token), jobs)
+            else:
+                results = jobs
+        except asyncio.CancelledError:
+            # stop the work already handed to the scheduler
+            if token is not None:
+                token.cancel('disconnect')
+            raise
+
+        for job, result in zip(jobs, results):
+            if isinstance(job, _Job) and job.timings:
+                metrics.observe(job.timings, ENHANCE_METHOD, UPSCALE, job.size, trace_id=trace_id)
+            if isinstance(result, _Job):
+                result = result.image
+            if isinstance(result, Cancelled):
+                metrics.observe_abandoned(result, getattr(job, 'timings', {}), ENHANCE_METHOD, UPSCALE)
+        if token is not None and token.cancelled:
+            raise Cancelled(token.reason, next(
+                (result.stage for result in results if isinstance(result, Cancelled)), 'encode'
+            ))
+        kept = keep_slot
+        return [result if isinstance(result, Exception) else job for job, result in zip(jobs, results)]
+    finally:
+        # requests abandoned or failing before they were processed have waited until now
+        admission.observe(time.perf_counter() - arrived if waited is None else waited)
+        if not kept:
+            pool.release()
+
+
+async def enhance(enhanceBase: _schemas._EnhanceBase, trace_id: Optional[str] = None,
+                  output_format: tuple = DEFAULT_FORMAT,
+                  token: Optional[CancelToken] = None) -> List[_schemas._EnhanceResult]:
+    jobs = await _process(
+        enhanceBase.encoded_base_img, trace_id=trace_id, output_format=output_format, token=token
+    )
+    return [
+        _schemas._EnhanceResult(error=f"{job.args}") if isinstance(job, Exception)
+        else _schemas._EnhanceResult(image=base64.b64encode(job.result).decode(), tier=job.tier)
+        for job in jobs
+    ]
+
+
+async def enhance_bytes(data: bytes, trace_id: Optional[str] = None, output_format: tuple = DEFAULT_FORMAT,
+                        token: Optional[CancelToken] = None) -> bytes:
+    """Enhance a raw encoded image and return the enhanced image encoded as ``output_format``."""
+    job = (await _process([data], trace_id=trace_id, output_format=output_format, token=token))[0]
+    if isinstance(job, Exception):
+        raise job
+    return job.result
+
+
+async def enhance_stream(data: bytes, trace_id: Optional[str] = None, output_format: tuple = DEFAULT_FORMAT,
+                         token: Optional[CancelToken] = None) -> tuple:
+    """Enhance a raw encoded image and return its encoding as ``output_format`` in chunks, and its quality tier.
+
+    A PNG is encoded band by band as the chunks are consumed, so the first
+    bytes can be sent right after enhancement and no complete encoding of a
+    large output is built before sending. JPEG and WebP are encoded in one
+    go, their encoders only write once they have seen every row.
+    """
+    streamed = output_format[0] == STREAM_MIME
+    job = (await _process(
+        [data], trace_id=trace_id, output_format=output_format, encode=not streamed, token=token, keep_slot=streamed
+    ))[0]
+    if not streamed:
+        if isinstance(job, Exception):
+            raise job
+        return iter_chunks(job.result), job.tier
+
+    # the slot is held until the PNG is encoded, the encoding counts against the pool's concurrency
+    release = pool.releaser()
+    try:
+        if isinstance(job, Exception):
+            raise job
+        if isinstance(job.image, Exception):
+            raise job.image
+        if job.result is not None:
+            release()
+            return iter_chunks(job.result), job.tier
+        chunks = _stream_png(job, output_format[1], trace_id, release=release)
+        # started here, so that the slot is released when the iterator is dropped, even unconsumed
+        first = await pool.run(next, chunks)
+    except BaseException:
+        release()
+        raise
+    return itertools.chain([first], chunks), job.tier
+
+
+def _stream_png(job: _Job, level: int, trace_id: Optional[str] = None, release=None) -> Iterator[bytes]:
+    """Encode ``job`` as PNG while it is sent, then call ``release`` (also when abandoned half way).
+
+    A full-quality result is cached once it was sent completely. Its chunks
+    are only kept while they fit in the memory tier of the cache; a larger
+    result is sent without being cached, so streaming never holds the whole
+    encoding.
+    """
+    chunks = [] if job.tier == 'full' else None
+    size = 0
+    seconds = 0.
+    png = encoding.iter_png(job.image, level=level, channel_order='bgr')
+    try:
+        while True:
+            start = time.perf_counter()
+            chunk = next(png, None)
+            seconds += time.perf_counter() - start
+            if chunk is None:
+                break
+            if chunks is not None:
+                size += len(chunk)
+                if size > cache.max_bytes:
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+        if chunks is not None:
+            cache.put(job.key, b''.join(chunks))
+        metrics.observe({'encode': seconds}, ENHANCE_METHOD, UPSCALE, job.size, trace_id=trace_id)
+    finally:
+        if release is not None:
+            release()
+
+
+def request_token(timeout: Optional[str] = None) -> CancelToken:
+    """Cancellation token of a new request, due after REQUEST_TIMEOUT or the shorter ``timeout`` the client asked for.
+
+    Raises ValueError if ``timeout`` (seconds, from the request) is not a positive number.
+    """
+    seconds = REQUEST_TIMEOUT
+    if timeout is not None:
+        try:
+            requested = float(timeout)
+        except ValueError:
+            requested = None
+        if requested is None or not requested > 0:
+            raise ValueError(f'Wrong timeout {timeout}.')
+        seconds = requested if seconds is None else min(seconds, requested)
+    return CancelToken.with_timeout(seconds)
+
+
+def stats() -> dict:
+    return {
+        "scheduler": scheduler.stats(), "pool": pool.stats(), "cache": cache.stats(), "admission": admission.stats()
+    }
+
+
+def render_metrics(accept: str = '') -> tuple:
+    """Prometheus exposition of the stage metrics as (body, content type)."""
+    return metrics.render(accept)
+
+
+def readiness() -> dict:
+    return loader.status()
+
+
+def iter_chunks(data: bytes, chunk_size: int = STREAM_CHUNK_SIZE):
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+
+# started last, the loading thread uses the helpers above
+loader = ModelLoader(_load_enhancer, retry_after=RETRY_AFTER)
@@ -7,7 +7,16 @@ from PIL import Image
 
 # Ensure enhancer package is accessible
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from enhancer.enhancer import Enhancer
+from enhancer.registry import EnhancerRegistry
+
+# Budget for the models kept warm between clicks, in MB
+MODEL_MEMORY_BUDGET_MB = int(os.getenv('MODEL_MEMORY_BUDGET_MB', 2048))
+
+
+@st.cache_resource
+def get_registry():
+    # one registry per server process, shared by all sessions and reruns
+    return EnhancerRegistry(memory_budget=MODEL_MEMORY_BUDGET_MB * 1024 ** 2)
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -92,12 +101,13 @@ st.markdown("</div>", unsafe_allow_html=True)
 if pressed:
     with st.spinner("Processing image..."):
         try:
-            enhancer = Enhancer(
+            # the enhancer is shared by all sessions, one of them uses it at a time
+            with get_registry().use(
                 method=method,
                 background_enhancement=bg_enhance,
                 upscale=upscale
-            )
-            enhanced_np = enhancer.enhance(np.array(original))
+            ) as enhancer:
+                enhanced_np = enhancer.enhance(np.array(original))
             enhanced = Image.fromarray(enhanced_np)
         except Exception as err:
             st.error(f"Enhancement failed: {err}")
@@ -0,0 +1,50 @@
+import types
+
+import pytest
+
+import model_loader
+from admission import AdmissionController
+from cache import ResultCache
+from scheduler import BatchScheduler
+
+
+@pytest.fixture
+def services(monkeypatch):
+    # importing the services starts loading the models, which the tests do not need
+    monkeypatch.setattr(model_loader.ModelLoader, '_run', lambda self: None)
+    import services
+    return services
+
+
+class _Enhancer:
+    """Flips every image upside down; an image 13 rows high fails, as a model running out of memory would."""
+    version = 'fake'
+
+    def __init__(self):
+        self.batches = []
+
+    def enhance_batch(self, images, return_exceptions=False, channel_order='rgb', timings=None, tokens=None,
+                      tiers=None):
+        self.batches.append(len(images))
+        outputs = []
+        for image in images:
+            if image.shape[0] == 13:
+                if not return_exceptions:
+                    raise RuntimeError('out of memory')
+                outputs.append(RuntimeError('out of memory'))
+            else:
+                outputs.append(image[::-1].copy())
+        return outputs
+
+
+@pytest.fixture
+def fake_enhancer(services, monkeypatch):
+    """The services, ready, with a fake enhancer behind the scheduler and an empty cache."""
+    enhancer = _Enhancer()
+    scheduler = BatchScheduler(enhancer, max_batch_size=4, max_wait_ms=1, channel_order='bgr')
+    monkeypatch.setattr(services, 'scheduler', scheduler)
+    monkeypatch.setattr(services, 'loader', types.SimpleNamespace(get=lambda: enhancer))
+    monkeypatch.setattr(services, 'cache', ResultCache(max_bytes=10 ** 7))
+    monkeypatch.setattr(services, 'admission', AdmissionController(()))
+    yield enhancer
+    scheduler.close()
@@ -0,0 +1,58 @@
+import pytest
+
+import admission as admission_module
+from admission import AdmissionController
+
+TIERS = ('full', 'light_background', 'no_background', 'faces_only')
+
+
+def test_steps_down_and_back_up():
+    admission = AdmissionController((1, 2, 3), TIERS, smoothing=1)
+    assert admission.tier() == 'full'
+    admission.observe(2.5)
+    assert admission.tier() == 'no_background'
+    admission.observe(10)
+    assert admission.tier() == 'faces_only'
+    admission.observe(0)
+    assert admission.tier() == 'full'
+    assert admission.stats()['admitted'] == {'full': 2, 'no_background': 1, 'faces_only': 1}
+
+
+def test_stays_on_last_tier():
+    admission = AdmissionController((1, 2, 3), ('full', 'faces_only'), smoothing=1)
+    admission.observe(1.5)
+    assert admission.tier() == 'faces_only'
+    admission.observe(5)
+    assert admission.tier() == 'faces_only'
+
+
+def test_smoothing():
+    admission = AdmissionController((1,), TIERS, smoothing=0.5)
+    admission.observe(1.5)
+    assert admission.tier() == 'full'
+    admission.observe(1.5)
+    assert admission.tier() == 'light_background'
+
+
+def test_decays_while_idle(monkeypatch):
+    now = [100.]
+    monkeypatch.setattr(admission_module.time, 'monotonic', lambda: now[0])
+    admission = AdmissionController((1, 2, 3), TIERS, smoothing=1, half_life=10)
+    admission.observe(10)
+    assert admission.tier() == 'faces_only'
+    now[0] += 20
+    assert admission.stats()['wait'] == pytest.approx(2.5)
+    assert admission.tier() == 'no_background'
+    now[0] += 30
+    assert admission.tier() == 'full'
+
+
+def test_without_thresholds():
+    admission = AdmissionController()
+    admission.observe(100)
+    assert admission.tier() == 'full'
+
+
+def test_wrong_thresholds():
+    with pytest.raises(ValueError):
+        AdmissionController((2, 1), TIERS)
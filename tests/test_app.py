@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+import pytest
+
+from worker_pool import WorkerPool
+
+
+@pytest.fixture
+def client(services, fake_enhancer, monkeypatch):
+    testclient = pytest.importorskip('fastapi.testclient')
+    import app
+    monkeypatch.setattr(services, 'pool', WorkerPool(concurrency=2, max_queue=4, threads=2))
+    # one event loop for all requests of a test, the pool's semaphore is bound to it
+    with testclient.TestClient(app.app) as client:
+        yield client
+    services.pool.close()
+
+
+def _image(h=20, w=30):
+    return np.random.default_rng(0).integers(0, 256, (h, w, 3), dtype=np.uint8)
+
+
+def _png(image):
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def _decode(response):
+    return cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR)
+
+
+def test_raw_body(client):
+    image = _image()
+    response = client.post('/api/v2/enhance', params={'format': 'png'}, content=_png(image))
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'image/png'
+    assert response.headers['x-quality-tier'] == 'full'
+    assert np.array_equal(_decode(response), image[::-1])
+
+    # JPEG without a format
+    response = client.post('/api/v2/enhance', content=_png(image), headers={'Content-Type': 'image/png'})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'image/jpeg'
+    assert _decode(response).shape == image.shape
+
+
+def test_multipart(client):
+    image = _image()
+    response = client.post(
+        '/api/v2/enhance', headers={'Accept': 'image/png'},
+        data={'name': 'photo'}, files={'image': ('photo.png', _png(image), 'image/png')}
+    )
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'image/png'
+    assert np.array_equal(_decode(response), image[::-1])
+
+
+@pytest.mark.parametrize('request_kwargs, detail', [
+    ({'content': b''}, 'Empty request body.'),
+    ({'content': b'not an image'}, 'Cannot identify image file.'),
+    ({'data': {'name': 'photo'}, 'files': {'image': ('photo.png', b'', 'image/png')}}, 'Empty request body.'),
+    ({'data': {'name': 'photo'}, 'files': {'image': ('photo.png', b'\x89PNG\r\n', 'image/png')}},
+     'Cannot identify image file.'),
+    ({'content': b'--x\r\nContent-Disposition: form-data; name="name"\r\n\r\nphoto\r\n--x--\r\n',
+      'headers': {'Content-Type': 'multipart/form-data; boundary=x'}}, 'No file in multipart body.'),
+    # malformed multipart, rejected by Starlette
+    ({'content': b'name=photo', 'headers': {'Content-Type': 'multipart/form-data; boundary=x'}}, None),
+    ({'content': b'image', 'params': {'format': 'gif'}}, None),
+    ({'content': b'image', 'params': {'format': 'jpeg', 'quality': 101}}, None),
+    ({'content': b'image', 'headers': {'X-Request-Timeout': '-1'}}, None),
+])
+def test_bad_requests(client, fake_enhancer, request_kwargs, detail):
+    response = client.post('/api/v2/enhance', **request_kwargs)
+    assert response.status_code == 400
+    if detail is not None:
+        assert response.json()['detail'] == detail
+    # none of them reached the enhancer
+    assert fake_enhancer.batches == []
@@ -0,0 +1,84 @@
+import os
+import time
+
+import numpy as np
+
+from cache import ResultCache
+
+
+def test_memory_lru_evicts_by_bytes():
+    cache = ResultCache(max_bytes=10)
+    cache.put('a', b'xxxx')
+    cache.put('b', b'xxxx')
+    # 'a' is now the most recently used, 'b' goes first
+    assert cache.get('a') == b'xxxx'
+    cache.put('c', b'xxxx')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'xxxx' and cache.get('c') == b'xxxx'
+    # larger than the whole tier, never kept
+    cache.put('d', b'x' * 11)
+    assert cache.get('d') is None
+
+    stats = cache.stats()
+    assert (stats["items"], stats["bytes"], stats["evictions"]) == (2, 8, 1)
+    assert (stats["hits"], stats["misses"]) == (3, 2)
+
+
+def test_disk_tier_evicts_oldest(tmp_path):
+    cache = ResultCache(max_bytes=4, disk_dir=str(tmp_path), disk_max_bytes=10)
+    now = time.time()
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, b'xxxx')
+        os.utime(tmp_path / key, (now - 10 + i, now - 10 + i))
+
+    assert sorted(os.listdir(tmp_path)) == ['b', 'c']
+    assert cache.stats()["disk_bytes"] == 8
+    assert cache.stats()["disk_evictions"] == 1
+    # 'b' is only on disk, it is read back into memory
+    assert cache.get('b') == b'xxxx'
+    assert cache.stats()["disk_hits"] == 1
+
+    # the disk tier survives a restart
+    assert ResultCache(disk_dir=str(tmp_path)).get('c') == b'xxxx'
+
+
+def test_concurrent_disk_writes_count_once(tmp_path, monkeypatch):
+    cache = ResultCache(max_bytes=0, disk_dir=str(tmp_path))
+    other_worker = ResultCache(max_bytes=0, disk_dir=str(tmp_path))
+    # both writers get past the existence check before either has created the entry
+    monkeypatch.setattr(os.path, 'exists', lambda path: False)
+    cache.put('a', b'xxxx')
+    other_worker.put('a', b'yyyy')
+    cache.put('a', b'xxxx')
+
+    assert os.listdir(tmp_path) == ['a']
+    assert (tmp_path / 'a').read_bytes() == b'xxxx'
+    assert cache.stats()["disk_bytes"] == 4
+    assert other_worker.stats()["disk_bytes"] == 0
+
+
+def test_disk_entries_expire(tmp_path):
+    cache = ResultCache(max_bytes=0, disk_dir=str(tmp_path), ttl=60)
+    cache.put('a', b'xxxx')
+    assert cache.get('a') == b'xxxx'
+    old = time.time() - 61
+    os.utime(tmp_path / 'a', (old, old))
+    assert cache.get('a') is None
+    assert not (tmp_path / 'a').exists()
+    assert cache.stats()["disk_bytes"] == 0
+
+
+def test_alias_of_evicted_result_counts_one_miss():
+    cache = ResultCache(max_bytes=4)
+    image = np.zeros((2, 2, 3), dtype=np.uint8)
+    raw_key, key = cache.key(b'encoded', 'jpeg'), cache.key(image, 'jpeg')
+    assert cache.lookup(raw_key) is None
+    cache.alias(raw_key, key)
+    cache.put(key, b'xxxx')
+    assert cache.lookup(raw_key) == b'xxxx'
+
+    cache.put('other', b'xxxx')
+    # what the service does: by the input bytes, then by the decoded pixels
+    assert cache.lookup(raw_key) is None
+    assert cache.get(key) is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
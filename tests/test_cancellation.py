@@ -0,0 +1,52 @@
+import time
+
+import numpy as np
+import pytest
+
+from enhancer.cancellation import Cancelled, CancelToken
+from enhancer.tiling import upsample_tiled
+
+
+class _Upsampler:
+    def __init__(self, token=None, cancel_after=None):
+        self.calls = 0
+        self.token = token
+        self.cancel_after = cancel_after
+
+    def enhance(self, img, outscale=2):
+        self.calls += 1
+        if self.calls == self.cancel_after:
+            self.token.cancel('disconnect')
+        return np.repeat(np.repeat(img, outscale, axis=0), outscale, axis=1), 'RGB'
+
+
+def test_token_deadline():
+    token = CancelToken.with_timeout(0.05)
+    token.check('detect')
+    time.sleep(0.06)
+    with pytest.raises(Cancelled) as error:
+        token.check('restore')
+    assert (error.value.reason, error.value.stage) == ('deadline', 'restore')
+
+
+def test_first_reason_wins():
+    token = CancelToken()
+    assert not token.cancelled
+    token.cancel('disconnect')
+    token.cancel('deadline')
+    assert token.cancelled and token.reason == 'disconnect'
+
+
+def test_tiles_stop_once_cancelled():
+    token = CancelToken()
+    upsampler = _Upsampler(token, cancel_after=2)
+    img = np.zeros((40, 40, 3), dtype=np.uint8)
+    with pytest.raises(Cancelled):
+        upsample_tiled(upsampler, img, 2, tile=10, check=lambda: token.check('upsample'))
+    assert upsampler.calls == 2
+
+
+def test_tiles_without_check():
+    img = np.arange(40 * 30 * 3, dtype=np.uint8).reshape(40, 30, 3)
+    output = upsample_tiled(_Upsampler(), img, 2, tile=16)
+    assert np.array_equal(output, np.repeat(np.repeat(img, 2, axis=0), 2, axis=1))
@@ -0,0 +1,60 @@
+"""Parity: the traced and frozen models must match eager mode, and a second start must reuse the cached graphs.
+
+Needs the model weights under libs/ (run from the repository root after the
+weights have been downloaded once); skipped otherwise.
+"""
+import glob
+import os
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+WEIGHTS = os.path.join('libs', 'gfpgan', 'weights', 'GFPGANv1.4.pth')
+SAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), os.pardir, 'samples', '*.jpg')))
+
+pytestmark = pytest.mark.skipif(not os.path.isfile(WEIGHTS), reason='needs the GFPGAN weights')
+
+
+def _outputs(enhancer):
+    images = [cv2.imread(path) for path in SAMPLES]
+    crops = []
+    for image in images:
+        h, w = image.shape[:2]
+        size = min(h, w)
+        crop = image[(h - size) // 2:(h + size) // 2, (w - size) // 2:(w + size) // 2]
+        crops.append(cv2.resize(crop, (512, 512), interpolation=cv2.INTER_AREA))
+    # the generator draws noise, draw the same for both modes
+    torch.manual_seed(0)
+    faces = enhancer.restore_faces(crops, batch_size=2)
+    backgrounds = [
+        enhancer.bg_upsampler.enhance(cv2.resize(image, (160, 120), interpolation=cv2.INTER_AREA), outscale=2)[0]
+        for image in images
+    ]
+    return faces + backgrounds
+
+
+@pytest.fixture(scope='module')
+def compile_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp('compiled'))
+
+
+def test_matches_eager(compile_dir):
+    from enhancer.enhancer import Enhancer
+
+    eager = _outputs(Enhancer(background_enhancement=True, upscale=2))
+    compiled = _outputs(Enhancer(background_enhancement=True, upscale=2, compile_dir=compile_dir,
+                                 compile_batch_sizes=(1, 2)))
+    for expected, actual in zip(eager, compiled):
+        assert np.abs(actual.astype(int) - expected).max() <= 2
+
+
+def test_reuses_cache(compile_dir):
+    from enhancer.enhancer import Enhancer
+
+    cached = {path: os.path.getmtime(path) for path in glob.glob(os.path.join(compile_dir, '*.pt'))}
+    assert cached
+    enhancer = Enhancer(background_enhancement=True, upscale=2, compile_dir=compile_dir, compile_batch_sizes=(1, 2))
+    assert {path: os.path.getmtime(path) for path in glob.glob(os.path.join(compile_dir, '*.pt'))} == cached
+    assert enhancer.version.endswith('/compiled')
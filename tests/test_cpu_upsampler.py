@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+from basicsr.archs.srvgg_arch import SRVGGNetCompact
+
+from enhancer.cpu_upsampler import CPUUpsampler
+
+# 34 convolutions of 3x3: a tile padded by as much sees the same context as the whole image
+RECEPTIVE_RADIUS = 34
+
+
+@pytest.fixture(scope='module')
+def model_path(tmp_path_factory):
+    """A randomly initialised realesr-general-x4v3 checkpoint."""
+    torch.manual_seed(0)
+    model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu')
+    path = tmp_path_factory.mktemp('weights') / 'realesr-general-x4v3.pth'
+    torch.save({'params_ema': model.state_dict()}, path)
+    return str(path)
+
+
+def _image(h=50, w=70):
+    """A smooth gradient with some texture."""
+    ys, xs = np.mgrid[0:h, 0:w]
+    image = np.stack([xs * 3, ys * 4, (xs + ys) * 2], axis=-1) % 256
+    return (image + np.random.default_rng(0).integers(0, 30, (h, w, 3))).clip(0, 255).astype(np.uint8)
+
+
+def test_tiles_match_whole_image(model_path):
+    image = _image()
+    whole, mode = CPUUpsampler(model_path, tile=1000, tile_pad=RECEPTIVE_RADIUS).enhance(image)
+    assert mode == 'RGB' and whole.shape == (200, 280, 3) and whole.dtype == np.uint8
+    # uneven tiles, several batches of them
+    tiled, _ = CPUUpsampler(model_path, tile=16, tile_pad=RECEPTIVE_RADIUS, tile_batch=3).enhance(image)
+    assert np.abs(tiled.astype(int) - whole).max() <= 1
+
+
+@pytest.mark.parametrize('outscale', [1, 1.5, 2, 4])
+def test_outscale(model_path, outscale):
+    image = _image()
+    upsampler = CPUUpsampler(model_path, tile=32, tile_pad=RECEPTIVE_RADIUS)
+    output, _ = upsampler.enhance(image, outscale=outscale)
+    assert output.shape == (round(50 * outscale), round(70 * outscale), 3)
+    if outscale == 2:
+        # the model's x4 output, area-downscaled; that is clamped to [0, 255] before downscaling instead of after,
+        # which only matters next to saturated pixels
+        expected = cv2.resize(upsampler.enhance(image)[0], (140, 100), interpolation=cv2.INTER_AREA)
+        difference = np.abs(output.astype(int) - expected)
+        assert (difference > 1).mean() < 0.01
+
+
+def test_quantized(model_path):
+    image = _image()
+    reference, _ = CPUUpsampler(model_path, tile=32).enhance(image)
+    upsampler = CPUUpsampler(model_path, tile=32, quantize=True)
+    assert upsampler.name == 'SRVGGNetCompact_x4_int8'
+
+    # the first image calibrates in float32, the next ones run in int8
+    calibrated, _ = upsampler.enhance(image)
+    assert np.array_equal(calibrated, reference)
+    assert upsampler._quantized is not None
+    quantized, _ = upsampler.enhance(image)
+    assert quantized.shape == reference.shape
+    # no float convolution left
+    assert not any(type(module) is torch.nn.Conv2d for module in upsampler._quantized.modules())
+    assert np.abs(quantized.astype(int) - reference).mean() < 4
@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+import pytest
+
+from encoding import encode, iter_png, negotiate
+
+
+@pytest.mark.parametrize('shape,rows', [((37, 51, 3), 8), ((64, 64, 3), 64), ((1, 300, 3), 16), ((130, 2, 3), 64)])
+def test_png_round_trip(shape, rows):
+    image = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    data = b''.join(iter_png(image, rows=rows))
+    assert np.array_equal(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED), image)
+
+
+def test_png_channel_order():
+    image = np.random.default_rng(1).integers(0, 256, (20, 30, 3), dtype=np.uint8)
+    data = b''.join(iter_png(image, channel_order='rgb'))
+    decoded = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    assert np.array_equal(decoded, image[..., ::-1])
+
+
+def test_png_header_comes_first():
+    image = np.zeros((256, 256, 3), dtype=np.uint8)
+    first = next(iter_png(image))
+    assert first.startswith(b'\x89PNG\r\n\x1a\n')
+    assert len(first) == 8 + 25
+
+
+@pytest.mark.parametrize('accept,format,expected', [
+    ('', None, 'image/jpeg'),
+    ('*/*', None, 'image/jpeg'),
+    ('image/webp,image/png;q=0.9,*/*;q=0.8', None, 'image/webp'),
+    ('image/webp;q=0.5, image/png', None, 'image/png'),
+    ('image/avif, image/png;q=0.1', None, 'image/png'),
+    ('image/webp', 'jpeg', 'image/jpeg'),
+    ('', 'PNG', 'image/png'),
+])
+def test_negotiate_format(accept, format, expected):
+    assert negotiate(accept, format=format)[0] == expected
+
+
+def test_negotiate_levels():
+    assert negotiate() == ('image/jpeg', 75)
+    assert negotiate(format='webp', quality=60, compression=9) == ('image/webp', 60)
+    assert negotiate(format='png', quality=60, compression=9) == ('image/png', 9)
+    with pytest.raises(ValueError):
+        negotiate(format='gif')
+    with pytest.raises(ValueError):
+        negotiate(quality=0)
+    with pytest.raises(ValueError):
+        negotiate(format='png', compression=10)
+
+
+@pytest.mark.parametrize('mime', ['image/jpeg', 'image/webp', 'image/png'])
+def test_encode(mime):
+    image = np.full((40, 60, 3), (10, 120, 240), dtype=np.uint8)
+    decoded = cv2.imdecode(np.frombuffer(encode(image, mime), np.uint8), cv2.IMREAD_COLOR)
+    assert np.abs(decoded.astype(int) - image).max() <= 4
@@ -0,0 +1,128 @@
+import types
+
+import numpy as np
+import pytest
+import torch
+from facexlib.utils import face_restoration_helper
+
+from enhancer.enhancer import Enhancer
+
+
+class _Detector:
+    """Stands in for RetinaFace: a "face" around every pixel whose first channel is 255, scored by its second.
+
+    Both entry points return what facexlib's do, computed image by image, so
+    the batched results equal the single ones unless the images are changed
+    (e.g. padded) on the way.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def detect_faces(self, image, conf_threshold=0.8):
+        self.batches.append([image.shape])
+        return self._detect(np.asarray(image, dtype=np.float32), conf_threshold)
+
+    def batched_detect_faces(self, frames, conf_threshold=0.8):
+        self.batches.append([tuple(frame.shape) for frame in frames])
+        bboxes, landmarks = [], []
+        for frame in frames.numpy():
+            detections = self._detect(frame, conf_threshold)
+            if len(detections) == 0:
+                # as facexlib returns them
+                bboxes.append(np.array([], dtype=np.float32))
+                landmarks.append(np.array([], dtype=np.float32))
+            else:
+                bboxes.append(detections[:, :5])
+                landmarks.append(detections[:, 5:])
+        return bboxes, landmarks
+
+    @staticmethod
+    def _detect(image, conf_threshold):
+        detections = []
+        for y, x in zip(*np.nonzero(image[:, :, 0] == 255)):
+            score = image[y, x, 1] / 255
+            if score > conf_threshold:
+                eyes_mouth = [x - 8, y - 4, x + 8, y - 4, x, y + 2, x - 6, y + 8, x + 6, y + 8]
+                detections.append([x - 16, y - 16, x + 16, y + 16, score] + eyes_mouth)
+        return np.array(detections, dtype=np.float32).reshape(-1, 15)
+
+
+class _Upsampler:
+    """Upsamples by repeating pixels; fails on images 70 pixels wide."""
+
+    def enhance(self, img, outscale=2):
+        if img.shape[1] == 70:
+            raise RuntimeError('out of memory')
+        return np.repeat(np.repeat(img, outscale, axis=0), outscale, axis=1), 'BGR'
+
+
+@pytest.fixture
+def enhancer(monkeypatch):
+    detector = _Detector()
+    monkeypatch.setattr(face_restoration_helper, 'init_detection_model', lambda *args, **kwargs: detector)
+    monkeypatch.setattr(face_restoration_helper, 'init_parsing_model', lambda *args, **kwargs: None)
+    helper = face_restoration_helper.FaceRestoreHelper(2, face_size=512, use_parse=False, device=torch.device('cpu'))
+
+    enhancer = Enhancer.__new__(Enhancer)
+    enhancer.restorer = types.SimpleNamespace(
+        face_helper=helper, upscale=2, device=torch.device('cpu'),
+        # restores every face to its own crop
+        gfpgan=lambda batch, return_rgb=False, weight=0.5: (batch,)
+    )
+    enhancer.model_name, enhancer.face_dtype = 'fake', torch.float32
+    enhancer.bg_upsampler, enhancer.light_upsampler = _Upsampler(), None
+    enhancer.skip_covered_tiles = False
+    enhancer.detect_size, enhancer.detection_cache_size = None, 0
+    return enhancer
+
+
+def _image(h, w, faces=(), seed=0):
+    """Noise with a marked "face" at every (x, y, score) of ``faces``."""
+    image = np.random.default_rng(seed).integers(0, 200, (h, w, 3), dtype=np.uint8)
+    for x, y, score in faces:
+        image[y, x, :2] = 255, round(score * 255)
+    return image
+
+
+def test_detect_faces_batched_as_single(enhancer):
+    images = [
+        _image(96, 128, [(40, 30, 0.99), (90, 60, 1.)], seed=0),
+        _image(80, 112, [(50, 40, 0.99)], seed=1),
+        _image(96, 128, seed=2),
+        _image(96, 128, [(30, 50, 0.98), (100, 40, 0.5)], seed=3),
+    ]
+    detector = enhancer.restorer.face_helper.face_det
+    batched = enhancer.detect_faces(images, batch_size=2)
+    # only images of the same size share a forward pass, none of them is padded
+    assert sorted(detector.batches) == sorted([[(96, 128, 3)] * 2, [(96, 128, 3)], [(80, 112, 3)]])
+
+    detector.batches.clear()
+    single = [enhancer.detect_faces([image])[0] for image in images]
+    assert [len(detections) for detections in single] == [2, 1, 0, 1]
+    for expected, detections in zip(single, batched):
+        assert detections.shape == expected.shape == (len(expected), 15)
+        np.testing.assert_array_equal(detections, expected)
+
+
+def test_enhance_batch_isolates_failures(enhancer):
+    images = [
+        _image(60, 80, [(40, 30, 0.99)], seed=0),
+        None,
+        _image(60, 70, [(30, 30, 0.99)], seed=1),
+        _image(50, 60, seed=2),
+    ]
+    timings = [{} for _ in images]
+    outputs = enhancer.enhance_batch(images, return_exceptions=True, channel_order='bgr', timings=timings)
+
+    # unreadable, and failing in the upsampler
+    assert isinstance(outputs[1], Exception)
+    assert isinstance(outputs[2], RuntimeError)
+    for output, image in zip([outputs[0], outputs[3]], [images[0], images[3]]):
+        assert output.shape == (image.shape[0] * 2, image.shape[1] * 2, 3)
+    # the image without faces is the upsampled background
+    np.testing.assert_array_equal(outputs[3], np.repeat(np.repeat(images[3], 2, axis=0), 2, axis=1))
+    assert 'restore' in timings[0] and 'paste' in timings[0] and 'restore' not in timings[3]
+
+    with pytest.raises(RuntimeError):
+        enhancer.enhance_batch(images[2:], channel_order='bgr')
@@ -0,0 +1,75 @@
+import cv2
+import numpy as np
+
+from main import enhance_folder, list_inputs
+
+
+class _Enhancer:
+    """Doubles the size of every image; fails the images whose top left pixel is 255."""
+
+    def __init__(self):
+        self.batches = []
+
+    def enhance_batch(self, images, return_exceptions=False, channel_order='rgb'):
+        self.batches.append(len(images))
+        return [ValueError('no face') if image[0, 0, 0] == 255 else cv2.resize(image, None, fx=2, fy=2)
+                for image in images]
+
+
+def _image(path, value=0):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cv2.imwrite(str(path), np.full((8, 8, 3), value, dtype=np.uint8))
+    return str(path)
+
+
+def test_list_inputs_keeps_paths_apart(tmp_path):
+    a, b = _image(tmp_path / 'a' / 'x.png'), _image(tmp_path / 'b' / 'x.png')
+    nested = _image(tmp_path / 'b' / 'c' / 'y.png')
+    (tmp_path / 'notes.txt').write_text('not an image')
+
+    assert list_inputs(str(tmp_path)) == [(a, 'a/x.png'), (nested, 'b/c/y.png'), (b, 'b/x.png')]
+    assert list_inputs(str(tmp_path / '*' / 'x.png')) == [(a, 'a/x.png'), (b, 'b/x.png')]
+    assert list_inputs(str(tmp_path / 'b' / '**' / '*.png')) == [(nested, 'c/y.png'), (b, 'x.png')]
+
+    manifest = tmp_path / 'manifest.txt'
+    manifest.write_text(f'# images\n{b}\n\n{a}\n')
+    assert list_inputs(str(manifest)) == [(b, 'b/x.png'), (a, 'a/x.png')]
+    assert list_inputs(str(tmp_path / 'missing' / '*.png')) == []
+
+
+def test_list_inputs_only_images(tmp_path):
+    a = _image(tmp_path / 'a' / 'x.png')
+    (tmp_path / 'a' / 'notes.txt').write_text('not an image')
+    (tmp_path / 'b' / 'c.png').mkdir(parents=True)
+    (tmp_path / 'd').mkdir()
+    d = _image(tmp_path / 'd' / 'y.png')
+
+    # a directory matching the pattern does not move the common root either
+    assert list_inputs(str(tmp_path / 'a' / '*')) == [(a, 'x.png')]
+    assert list_inputs(str(tmp_path / '*' / '*.png')) == [(a, 'a/x.png'), (d, 'd/y.png')]
+
+    manifest = tmp_path / 'manifest.txt'
+    manifest.write_text(f'{a}\n{tmp_path / "a" / "notes.txt"}\n{tmp_path / "b" / "c.png"}\n{tmp_path / "gone.png"}\n')
+    assert list_inputs(str(manifest)) == [(a, 'x.png')]
+
+
+def test_enhance_folder_resumes_and_reports_failures(tmp_path):
+    source, output = tmp_path / 'in', tmp_path / 'out'
+    for name in ['a/x.png', 'b/x.png', 'c.png']:
+        _image(source / name)
+    _image(source / 'failing.png', 255)
+    (source / 'broken.png').write_bytes(b'not a png')
+
+    enhancer = _Enhancer()
+    counts = enhance_folder(enhancer, str(source), str(output), batch_size=2, decode_threads=2, encode_threads=1)
+    assert counts == {"enhanced": 3, "failed": 2, "skipped": 0}
+    for name in ['a/x.png', 'b/x.png', 'c.png']:
+        assert cv2.imread(str(output / name)).shape == (16, 16, 3)
+    assert not (output / 'failing.png').exists() and not list(output.rglob('*.tmp*'))
+
+    # a second run only retries the failed images
+    (output / 'c.png').unlink()
+    counts = enhance_folder(_Enhancer(), str(source), str(output), batch_size=2)
+    assert counts == {"enhanced": 1, "failed": 2, "skipped": 2}
+    counts = enhance_folder(_Enhancer(), str(source), str(output), overwrite=True)
+    assert counts == {"enhanced": 3, "failed": 2, "skipped": 0}
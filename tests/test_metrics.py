@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+
+import metrics
+
+
+@pytest.mark.parametrize('shape, label', [
+    ((1, 1), '0.5MP'),
+    ((500, 1000), '0.5MP'),
+    ((500, 1001), '2MP'),
+    ((1000, 2000), '2MP'),
+    ((2000, 4000), '8MP'),
+    ((4000, 4000), '16MP'),
+    ((4000, 4001), '>16MP'),
+])
+def test_size_bucket(shape, label):
+    assert metrics.size_bucket(np.empty(shape + (3,), dtype=np.uint8)) == label
+
+
+def _stage(stage, method, sample='count'):
+    labels = {'stage': stage, 'method': method, 'upscale': '2', 'size': '2MP'}
+    return REGISTRY.get_sample_value(f'enhance_stage_seconds_{sample}', labels) or 0.
+
+
+def test_observe_labels():
+    assert metrics.STAGE_SECONDS._labelnames == ('stage', 'method', 'upscale', 'size')
+    before = _stage('decode', 'test-observe'), _stage('encode', 'test-observe')
+    metrics.observe({'decode': 0.25, 'encode': 0.5}, 'test-observe', 2, '2MP')
+    metrics.observe({'decode': 0.25}, 'test-observe', 2, '2MP')
+
+    assert _stage('decode', 'test-observe') == before[0] + 2
+    assert _stage('encode', 'test-observe') == before[1] + 1
+    assert _stage('decode', 'test-observe', 'sum') == pytest.approx(0.5)
+    # upscale is a label string, a stage never observed has no series
+    assert _stage('restore', 'test-observe') == 0.
+
+
+def test_metrics_endpoint(services):
+    testclient = pytest.importorskip('fastapi.testclient')
+    import app
+    client = testclient.TestClient(app.app)
+    metrics.observe({'queue': 0.01}, 'test-endpoint', 2, '2MP', trace_id='t' * 100)
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    # the text format of the installed client, whichever version that is
+    assert response.headers['content-type'].startswith(CONTENT_TYPE_LATEST.split('; charset')[0])
+    assert response.headers['content-type'].startswith('text/plain')
+    families = {family.name: family for family in text_string_to_metric_families(response.text)}
+    assert families['enhance_stage_seconds'].type == 'histogram'
+    labels = {'stage': 'queue', 'method': 'test-endpoint', 'upscale': '2', 'size': '2MP'}
+    buckets = [sample for sample in families['enhance_stage_seconds'].samples
+               if sample.name == 'enhance_stage_seconds_bucket'
+               and {name: sample.labels[name] for name in labels} == labels]
+    assert buckets and buckets[-1].labels['le'] == '+Inf' and buckets[-1].value == 1
+    for name in ('enhance_abandoned', 'enhance_abandoned_seconds', 'enhance_quality_tier'):
+        assert families[name].type == 'counter'
+
+    # exemplars only in OpenMetrics, with the trace id cut to fit
+    response = client.get('/metrics', headers={'Accept': 'application/openmetrics-text; version=1.0.0'})
+    assert response.headers['content-type'].startswith('application/openmetrics-text')
+    assert response.text.endswith('# EOF\n')
+    assert f'trace_id="{"t" * 64}"' in response.text
+    assert 't' * 65 not in response.text
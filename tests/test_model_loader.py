@@ -0,0 +1,36 @@
+import threading
+
+import pytest
+
+from model_loader import ModelLoader, ModelNotReady
+
+
+def test_ready_after_factory_returns():
+    release = threading.Event()
+    enhancer = object()
+
+    def factory():
+        release.wait()
+        return enhancer
+
+    loader = ModelLoader(factory, retry_after=3)
+    assert loader.status()["ready"] is False
+    with pytest.raises(ModelNotReady) as info:
+        loader.get()
+    assert info.value.retry_after == 3
+
+    release.set()
+    assert loader.wait(timeout=5)
+    assert loader.get() is enhancer
+    assert loader.status()["status"] == "ready"
+
+
+def test_failed_factory_stays_not_ready():
+    def factory():
+        raise OSError('no weights')
+
+    loader = ModelLoader(factory)
+    assert not loader.wait(timeout=5)
+    assert loader.status()["status"] == "failed"
+    with pytest.raises(ModelNotReady):
+        loader.get()
@@ -0,0 +1,61 @@
+"""Accuracy guard: reduced precision and channels-last must stay close to fp32 on the bundled samples.
+
+Needs the model weights under libs/ (run from the repository root after the
+weights have been downloaded once); skipped otherwise.
+"""
+import glob
+import os
+
+import cv2
+import numpy as np
+import pytest
+from basicsr.metrics import calculate_psnr
+
+WEIGHTS = os.path.join('libs', 'gfpgan', 'weights', 'GFPGANv1.4.pth')
+SAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), os.pardir, 'samples', '*.jpg')))
+
+# minimum PSNR (dB) against fp32 of the restored faces and of the upsampled backgrounds
+POLICIES = {
+    ('fp32', True): 50,
+    ('fp16', False): 35,
+    ('bf16', False): 30,
+    ('bf16', True): 30,
+}
+
+pytestmark = pytest.mark.skipif(not os.path.isfile(WEIGHTS), reason='needs the GFPGAN weights')
+
+
+def _outputs(precision, channels_last):
+    from enhancer.enhancer import Enhancer
+
+    enhancer = Enhancer(background_enhancement=True, upscale=2, precision=precision, channels_last=channels_last)
+    if precision is not None and enhancer.precision != precision:
+        pytest.skip(f'{precision} is not supported here')
+
+    images = [cv2.imread(path) for path in SAMPLES]
+    # the centre of every sample as a stand-in for an aligned face, and a small background
+    crops = []
+    for image in images:
+        h, w = image.shape[:2]
+        size = min(h, w)
+        crop = image[(h - size) // 2:(h + size) // 2, (w - size) // 2:(w + size) // 2]
+        crops.append(cv2.resize(crop, (512, 512), interpolation=cv2.INTER_AREA))
+    faces = enhancer.restore_faces(crops)
+    backgrounds = [
+        enhancer.bg_upsampler.enhance(cv2.resize(image, (160, 120), interpolation=cv2.INTER_AREA), outscale=2)[0]
+        for image in images
+    ]
+    return faces, backgrounds
+
+
+@pytest.fixture(scope='module')
+def reference():
+    return _outputs('fp32', False)
+
+
+@pytest.mark.parametrize('precision,channels_last', list(POLICIES))
+def test_psnr_against_fp32(reference, precision, channels_last):
+    faces, backgrounds = _outputs(precision, channels_last)
+    min_psnr = POLICIES[(precision, channels_last)]
+    for expected, actual in zip(reference[0] + reference[1], faces + backgrounds):
+        assert calculate_psnr(actual.astype(np.float64), expected.astype(np.float64), crop_border=0) >= min_psnr
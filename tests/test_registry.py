@@ -0,0 +1,58 @@
+import threading
+import time
+
+from enhancer.registry import EnhancerRegistry
+
+
+class _Enhancer:
+    """Records how many calls overlap, as a call of the real enhancer must not."""
+
+    def __init__(self, method='gfpgan', background_enhancement=True, upscale=2):
+        self.key = (method, background_enhancement, upscale)
+        self.active = 0
+        self.max_active = 0
+
+    def memory_footprint(self):
+        return 10
+
+    def enhance(self, image):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        self.active -= 1
+        return image
+
+
+def _use_from_threads(registry, settings):
+    def run(upscale):
+        with registry.use(upscale=upscale) as enhancer:
+            enhancer.enhance(None)
+
+    threads = [threading.Thread(target=run, args=(upscale, )) for upscale in settings]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_one_call_at_a_time_per_enhancer():
+    registry = EnhancerRegistry(factory=_Enhancer)
+    _use_from_threads(registry, [2] * 4)
+    assert registry.get(upscale=2).max_active == 1
+
+
+def test_enhancers_of_other_settings_are_not_held():
+    registry = EnhancerRegistry(factory=_Enhancer)
+    with registry.use(upscale=2) as enhancer:
+        with registry.use(upscale=4) as other:
+            assert other is not enhancer and other.key == ('gfpgan', True, 4)
+
+
+def test_least_recently_used_dropped_over_budget():
+    registry = EnhancerRegistry(memory_budget=20, factory=_Enhancer)
+    first = registry.get(upscale=1)
+    registry.get(upscale=2)
+    assert registry.get(upscale=1) is first
+    registry.get(upscale=4)
+    assert registry.keys() == [('gfpgan', True, 1), ('gfpgan', True, 4)]
+    assert registry.memory_usage() == 20
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+import pytest
+from prometheus_client import REGISTRY
+
+from scheduler import BatchScheduler
+
+
+class _Enhancer:
+    """Doubles every image; the first batch waits for ``release`` so that requests pile up behind it."""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail = fail
+
+    def enhance_batch(self, images, return_exceptions=False, channel_order='rgb', timings=None, tokens=None,
+                      tiers=None):
+        self.batches.append(list(images))
+        self.started.set()
+        self.release.wait(timeout=5)
+        if self.fail:
+            raise RuntimeError('out of memory')
+        return [image * 2 for image in images]
+
+
+async def _submit_behind_first(scheduler, enhancer, requests):
+    """Submit the first request, then the others while the worker is busy with it."""
+    first = asyncio.ensure_future(scheduler.submit_batch(requests[0]))
+    while not enhancer.started.is_set():
+        await asyncio.sleep(0.005)
+    others = [asyncio.ensure_future(scheduler.submit_batch(images)) for images in requests[1:]]
+    await asyncio.sleep(0.01)
+    enhancer.release.set()
+    return await asyncio.gather(first, *others, return_exceptions=True)
+
+
+def test_requests_grouped_without_splitting():
+    enhancer = _Enhancer()
+    scheduler = BatchScheduler(enhancer, max_batch_size=4, max_wait_ms=50)
+    requests = [[1], [2, 3], [4], [5, 6, 7], [8, 9, 10, 11, 12]]
+    try:
+        results = asyncio.run(_submit_behind_first(scheduler, enhancer, requests))
+    finally:
+        scheduler.close()
+
+    assert results == [[image * 2 for image in images] for images in requests]
+    # [5, 6, 7] does not fit after [2, 3] + [4] and opens the next batch; the
+    # request larger than the batch size runs on its own
+    assert enhancer.batches == [[1], [2, 3, 4], [5, 6, 7], [8, 9, 10, 11, 12]]
+    assert scheduler.stats()["batch_size_histogram"] == {1: 1, 3: 2, 5: 1}
+    assert scheduler.stats()["processed"] == 12
+
+
+def _histogram(name):
+    return REGISTRY.get_sample_value(f'{name}_count'), REGISTRY.get_sample_value(f'{name}_sum')
+
+
+def test_queue_depth_and_batch_size_histograms():
+    enhancer = _Enhancer()
+    scheduler = BatchScheduler(enhancer, max_batch_size=4, max_wait_ms=50)
+    depth, size = _histogram('enhance_queue_depth'), _histogram('enhance_batch_size')
+    try:
+        asyncio.run(_submit_behind_first(scheduler, enhancer, [[1], [2, 3], [4], [5, 6, 7], [8, 9, 10, 11, 12]]))
+    finally:
+        scheduler.close()
+
+    # images waiting after each of the 5 enqueues (1; 2, 3, 6, 11 behind the first batch)
+    # and after each of the 4 dispatches (0, 8, 5, 0)
+    count, total = _histogram('enhance_queue_depth')
+    assert (count - depth[0], total - depth[1]) == (9, 36)
+    count, total = _histogram('enhance_batch_size')
+    assert (count - size[0], total - size[1]) == (4, 12)
+    assert scheduler.stats()["queue_depth"] == 0
+
+
+def test_failed_batch_fails_all_its_requests():
+    enhancer = _Enhancer(fail=True)
+    scheduler = BatchScheduler(enhancer, max_batch_size=4, max_wait_ms=50)
+    try:
+        results = asyncio.run(_submit_behind_first(scheduler, enhancer, [[1], [2], [3]]))
+    finally:
+        scheduler.close()
+
+    assert [type(result) for result in results] == [RuntimeError] * 3
+    assert enhancer.batches == [[1], [2, 3]]
+
+
+def test_wrong_batch_size():
+    with pytest.raises(ValueError):
+        BatchScheduler(_Enhancer(), max_batch_size=0)
@@ -0,0 +1,83 @@
+import asyncio
+import base64
+from io import BytesIO
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+import schemas
+from worker_pool import WorkerPool
+
+
+def _png(image):
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def _image(h, w, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (h, w, 3), dtype=np.uint8)
+
+
+def _run(services, coroutine):
+    async def scenario():
+        # the semaphore belongs to the event loop of the test
+        services.pool = WorkerPool(concurrency=2, max_queue=4, threads=2)
+        try:
+            return await coroutine()
+        finally:
+            services.pool.close()
+
+    pool = services.pool
+    try:
+        return asyncio.run(scenario())
+    finally:
+        services.pool = pool
+
+
+def test_bad_images_do_not_fail_the_others(services, fake_enhancer):
+    images = [_image(20, 30, 0), _image(13, 30, 1), _image(25, 20, 2)]
+    payloads = [_png(images[0]), b'not an image', _png(images[1]), _png(images[2])]
+
+    jobs = _run(services, lambda: services._process(payloads, output_format=('image/png', 1)))
+    # the images that decoded went through one batch
+    assert fake_enhancer.batches == [3]
+    assert isinstance(jobs[1], Exception)
+    assert isinstance(jobs[2], RuntimeError)
+    for job, image in zip([jobs[0], jobs[3]], [images[0], images[2]]):
+        assert job.tier == 'full'
+        decoded = cv2.imdecode(np.frombuffer(job.result, np.uint8), cv2.IMREAD_COLOR)
+        assert np.array_equal(decoded, image[::-1])
+
+    # the same request again is answered from the cache, and the failures are not cached
+    jobs = _run(services, lambda: services._process(payloads, output_format=('image/png', 1)))
+    assert fake_enhancer.batches == [3, 1]
+    assert isinstance(jobs[1], Exception) and isinstance(jobs[2], RuntimeError)
+
+
+def test_enhance_reports_errors_per_image(services, fake_enhancer):
+    images = [_image(20, 30, 0), _image(13, 30, 1)]
+    request = schemas._EnhanceBase(encoded_base_img=[base64.b64encode(_png(image)).decode() for image in images])
+    results = _run(services, lambda: services.enhance(request))
+    assert results[0].image is not None and results[0].error is None and results[0].tier == 'full'
+    assert results[1].image is None and 'out of memory' in results[1].error
+
+
+@pytest.mark.parametrize('source', ['PNG', 'TGA'])
+@pytest.mark.parametrize('output_format', [('image/png', 1), ('image/jpeg', 95), ('image/webp', 95)])
+def test_channel_order_round_trip(services, source, output_format):
+    """Decoded to BGR (by OpenCV, or PIL for TGA) and encoded from BGR: the colours come out as they went in."""
+    # red to blue from left to right, so that swapped channels are far off even after lossy coding
+    ramp = np.linspace(0, 255, 32)
+    rgb = np.stack(np.broadcast_arrays(ramp[::-1], 128, ramp), axis=-1)[None].repeat(24, axis=0).astype(np.uint8)
+    data = BytesIO()
+    Image.fromarray(rgb).save(data, format=source)
+    bgr = services._decode(data.getvalue())
+    assert np.array_equal(bgr, rgb[..., ::-1])
+
+    encoded = services._encode(bgr, output_format)
+    decoded = np.array(Image.open(BytesIO(encoded)).convert('RGB')).astype(int)
+    if output_format[0] == 'image/png':
+        assert np.array_equal(decoded, rgb)
+    else:
+        assert np.abs(decoded - rgb).max() <= 8
@@ -0,0 +1,60 @@
+import copy
+import hashlib
+import os
+
+import torch
+
+from enhancer.shared_weights import digest_tensor, share_module
+
+
+def _model(dtype=torch.float32):
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Conv2d(3, 8, 3), torch.nn.BatchNorm2d(8), torch.nn.Conv2d(8, 3, 1))
+    model[1].running_mean.uniform_()
+    return model.to(dtype).eval()
+
+
+def test_shared_module_round_trips(tmp_path):
+    for dtype in [torch.float32, torch.bfloat16]:
+        model = _model(dtype)
+        original = copy.deepcopy(model)
+        shared = share_module(model, str(tmp_path), f'model-{dtype}')
+
+        for (key, tensor), expected in zip(shared.state_dict().items(), original.state_dict().values()):
+            assert tensor.dtype == expected.dtype and torch.equal(tensor, expected), key
+        x = torch.rand(1, 3, 16, 16, dtype=dtype)
+        with torch.no_grad():
+            assert torch.equal(shared(x), original(x))
+
+        # a second worker binds to the file the first one wrote
+        again = share_module(_model(dtype), str(tmp_path), f'model-{dtype}')
+        assert torch.equal(again[0].weight, original[0].weight)
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.bin')]) == 2
+
+
+def test_weights_differing_in_the_middle_get_their_own_file(tmp_path):
+    model, other = _model(), _model()
+    with torch.no_grad():
+        other[0].weight.view(-1)[100] += 1
+    share_module(model, str(tmp_path), 'model')
+    share_module(other, str(tmp_path), 'model')
+
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.bin')]) == 2
+    assert not torch.equal(model[0].weight, other[0].weight)
+
+
+def _digest(tensor):
+    digest = hashlib.blake2b(digest_size=16)
+    digest_tensor(digest, tensor)
+    return digest.hexdigest()
+
+
+def test_digest_tensor():
+    tensor = torch.randn(4, 6)
+    # the raw bits, whatever the dtype and memory layout
+    assert _digest(tensor.t()) == _digest(tensor.t().contiguous())
+    assert _digest(tensor.bfloat16()) == _digest(tensor.bfloat16().view(torch.int16))
+    assert _digest(tensor.bfloat16()) != _digest(tensor.half())
+    changed = tensor.bfloat16()
+    changed[3, 5] = changed[3, 5] * 2
+    assert _digest(changed) != _digest(tensor.bfloat16())
@@ -0,0 +1,133 @@
+import types
+
+import cv2
+import numpy as np
+import pytest
+from facexlib.utils.face_restoration_helper import FaceRestoreHelper
+
+from enhancer.enhancer import Enhancer, _detection_proxy, _from_proxy
+from enhancer.tiling import covered_by_faces, face_layers, paste_faces
+
+# (scale, rotation, x, y) of the synthetic faces in input-image coordinates, apart from each other
+FACES = [(0.25, 0.3, 60, 40), (0.2, -0.5, 250, 150)]
+
+
+def _smooth(rng, shape):
+    """A blurred gradient: image-like content, unlike per-pixel noise, on which sub-pixel warp shifts stay small."""
+    h, w = shape
+    ys, xs = np.mgrid[0:h, 0:w]
+    img = np.stack([xs / w, ys / h, (xs + ys) / (w + h)], axis=-1) * 200 + 20
+    img += cv2.GaussianBlur(rng.normal(0, 40, (h, w, 3)), (0, 0), max(h, w) / 32)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def _helper(upscale, seed=0):
+    """What the face helper holds once the faces are restored, without the models."""
+    rng = np.random.default_rng(seed)
+    matrices = []
+    for scale, angle, x, y in FACES:
+        rotation = scale * np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        matrices.append(np.hstack([rotation, [[x], [y]]]) * upscale)
+    return types.SimpleNamespace(
+        input_img=_smooth(rng, (300, 400)),
+        upscale_factor=upscale,
+        use_parse=False,
+        face_size=(512, 512),
+        restored_faces=[_smooth(rng, (512, 512)) for _ in FACES],
+        inverse_affine_matrices=matrices,
+    )
+
+
+@pytest.mark.parametrize('upscale', [1, 2])
+def test_paste_faces_matches_facexlib(upscale):
+    helper = _helper(upscale)
+    background = cv2.resize(helper.input_img, None, fx=upscale, fy=upscale)
+    # facexlib shifts the matrices in place
+    reference = types.SimpleNamespace(**vars(helper))
+    reference.inverse_affine_matrices = [matrix.copy() for matrix in helper.inverse_affine_matrices]
+    expected = FaceRestoreHelper.paste_faces_to_input_image(reference, upsample_img=background.copy())
+
+    output = paste_faces(helper, background.copy())
+    difference = np.abs(output.astype(int) - expected)
+    # only OpenCV's sub-pixel rounding of the shifted warp differs (checked on opencv-python 4.5.5)
+    assert difference.max() <= 1
+    assert (difference > 0).mean() < 1e-3
+
+
+def test_tiles_skipped_only_when_covered():
+    helper = _helper(2)
+    layers = list(face_layers(helper))
+    h, w = helper.input_img.shape[:2]
+    opaque = np.zeros((h * 2, w * 2), dtype=bool)
+    for x0, y0, x1, y1, _, soft_mask in layers:
+        opaque[y0:y1, x0:x1] |= soft_mask[:, :, 0] >= 0.999
+
+    covered = covered_by_faces(layers, 2)
+    skipped = 0
+    for y in range(0, h, 8):
+        for x in range(0, w, 8):
+            if covered(y, x, min(y + 8, h), min(x + 8, w)):
+                assert opaque[y * 2:(y + 8) * 2, x * 2:(x + 8) * 2].all()
+                skipped += 1
+    assert skipped > 0
+    # around the centre of the first face, and a tile reaching past it
+    cx, cy = helper.inverse_affine_matrices[0] @ [256, 256, 1] / 2
+    assert covered(int(cy) - 4, int(cx) - 4, int(cy) + 4, int(cx) + 4)
+    assert not covered(int(cy) - 4, int(cx) - 4, int(cy) + 80, int(cx) + 80)
+    assert not covered(0, 0, h, w)
+
+
+class _TiledUpsampler:
+    """Like RealESRGANer with ``tile=40``: no skip support, runs larger inputs in several pieces."""
+    tile_size, tile_pad = 40, 4
+
+    def __init__(self):
+        self.shapes = []
+
+    def enhance(self, img, outscale=2):
+        self.shapes.append(img.shape[:2])
+        return np.repeat(np.repeat(img, outscale, axis=0), outscale, axis=1), 'BGR'
+
+
+def test_covered_tiles_skipped_without_upsampler_support():
+    helper = _helper(2)
+    helper.add_restored_face = lambda face: None
+    helper.get_inverse_affine = lambda save_path: None
+    enhancer = Enhancer.__new__(Enhancer)
+    enhancer.restorer = types.SimpleNamespace(upscale=2)
+    enhancer.bg_upsampler, enhancer.light_upsampler = _TiledUpsampler(), None
+    enhancer.skip_covered_tiles = True
+
+    output = enhancer.paste_back(helper, [], channel_order='bgr')
+    assert output.shape == (600, 800, 3)
+    shapes = enhancer.bg_upsampler.shapes
+    # every tile fits the upsampler's own tile, and the ones inside the faces were left out
+    assert all(h <= 40 and w <= 40 for h, w in shapes)
+    assert len(shapes) < (300 // 32 + 1) * (400 // 32 + 1)
+
+
+def test_detections_on_proxy_map_back():
+    img = np.zeros((2400, 3600, 3), dtype=np.uint8)
+    points = np.array([[1000.5, 700.5], [1400.5, 720.5], [1200.5, 900.5], [1050.5, 1100.5], [1350.5, 1110.5]])
+    for x, y in points:
+        cv2.circle(img, (int(x), int(y)), 6, (255, 255, 255), -1)
+
+    proxy, scale = _detection_proxy(img, 1024)
+    assert max(proxy.shape[:2]) == 1024
+    # a detection on the proxy: box, score and landmarks at the marks' centroids
+    gray = proxy[:, :, 0].astype(np.float64)
+    found = []
+    for x, y in points:
+        cx, cy = int(x * scale[0]), int(y * scale[1])
+        window = gray[cy - 5:cy + 6, cx - 5:cx + 6]
+        ys, xs = np.mgrid[cy - 5:cy + 6, cx - 5:cx + 6]
+        # pixel centres are at +0.5
+        found.append([(window * xs).sum() / window.sum() + 0.5, (window * ys).sum() / window.sum() + 0.5])
+    found = np.array(found)
+    box = [found[:, 0].min(), found[:, 1].min(), found[:, 0].max(), found[:, 1].max(), 0.99]
+    bboxes = np.array([box + found.reshape(-1).tolist()], dtype=np.float32)
+
+    mapped = _from_proxy(bboxes, scale)[0]
+    assert mapped[4] == pytest.approx(0.99)
+    np.testing.assert_allclose(mapped[5:].reshape(5, 2), points, atol=2)
+    assert _from_proxy(bboxes, None) is bboxes
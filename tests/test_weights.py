@@ -0,0 +1,130 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from enhancer.weights import fetch_weights
+
+PAYLOAD = os.urandom(300_000)
+SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves PAYLOAD with Range support; the first ``cut_after`` bytes of a full response end the connection."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('Range'))
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            if start >= len(PAYLOAD):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(PAYLOAD)}')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}')
+        else:
+            self.send_response(200)
+        body = PAYLOAD[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if server.cut_after is not None:
+            body, server.cut_after = body[:server.cut_after], None
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.requests = []
+    server.cut_after = None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/model.pth'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download(server, tmp_path):
+    path = tmp_path / 'model.pth'
+    assert fetch_weights(server.url, str(path), sha256=SHA256) == str(path)
+    assert path.read_bytes() == PAYLOAD
+    assert not os.path.exists(f'{path}.part')
+
+    # a valid file is not fetched again
+    fetch_weights(server.url, str(path), sha256=SHA256)
+    assert len(server.requests) == 1
+
+
+def test_resume_after_interruption(server, tmp_path):
+    path = tmp_path / 'model.pth'
+    server.cut_after = 100_000
+    fetch_weights(server.url, str(path), sha256=SHA256)
+    assert path.read_bytes() == PAYLOAD
+    # the second request resumes from what the first one had written
+    assert server.requests[0] is None
+    assert server.requests[1].startswith('bytes=')
+    assert 0 < int(server.requests[1][6:-1]) <= 100_000
+
+
+def test_resume_partial_file_from_previous_run(server, tmp_path):
+    path = tmp_path / 'model.pth'
+    (tmp_path / 'model.pth.part').write_bytes(PAYLOAD[:5000])
+    fetch_weights(server.url, str(path), sha256=SHA256)
+    assert path.read_bytes() == PAYLOAD
+    assert server.requests == ['bytes=5000-']
+
+
+def test_interrupted_download_leaves_no_file(server, tmp_path):
+    path = tmp_path / 'model.pth'
+    server.cut_after = 100_000
+    with pytest.raises(requests.RequestException):
+        fetch_weights(server.url, str(path), sha256=SHA256, retries=1)
+    assert not path.exists()
+    part = (tmp_path / 'model.pth.part').read_bytes()
+    assert 0 < len(part) <= 100_000
+    assert PAYLOAD.startswith(part)
+
+
+def test_checksum_mismatch(server, tmp_path):
+    path = tmp_path / 'model.pth'
+    with pytest.raises(ValueError):
+        fetch_weights(server.url, str(path), sha256='0' * 64)
+    assert not path.exists()
+    assert not (tmp_path / 'model.pth.part').exists()
+
+
+def test_corrupt_file_is_replaced(server, tmp_path):
+    path = tmp_path / 'model.pth'
+    path.write_bytes(PAYLOAD[:1000])
+    fetch_weights(server.url, str(path), sha256=SHA256)
+    assert path.read_bytes() == PAYLOAD
+
+
+def test_mirror(server, tmp_path):
+    mirror = tmp_path / 'mirror'
+    mirror.mkdir()
+    (mirror / 'model.pth').write_bytes(PAYLOAD)
+    path = tmp_path / 'weights' / 'model.pth'
+    fetch_weights(server.url, str(path), sha256=SHA256, mirror_dir=str(mirror))
+    assert path.read_bytes() == PAYLOAD
+    assert server.requests == []
+
+
+def test_corrupt_mirror_falls_back_to_download(server, tmp_path):
+    mirror = tmp_path / 'mirror'
+    mirror.mkdir()
+    (mirror / 'model.pth').write_bytes(b'corrupt')
+    path = tmp_path / 'model.pth'
+    fetch_weights(server.url, str(path), sha256=SHA256, mirror_dir=str(mirror))
+    assert path.read_bytes() == PAYLOAD
+    assert len(server.requests) == 1
@@ -0,0 +1,89 @@
+import asyncio
+
+import cv2
+import numpy as np
+import pytest
+
+from cache import ResultCache
+from worker_pool import PoolOverloaded, WorkerPool
+
+
+def test_overloaded_once_queue_is_full():
+    async def scenario():
+        pool = WorkerPool(concurrency=1, max_queue=1, threads=1, retry_after=7)
+        release = asyncio.Event()
+
+        async def hold():
+            async with pool.slot():
+                await release.wait()
+
+        holder = asyncio.ensure_future(hold())
+        waiter = asyncio.ensure_future(hold())
+        await asyncio.sleep(0.01)
+        assert pool.stats()["in_flight"] == 1 and pool.stats()["queued"] == 1
+
+        with pytest.raises(PoolOverloaded) as error:
+            async with pool.slot():
+                pass
+        assert error.value.retry_after == 7
+
+        release.set()
+        await asyncio.gather(holder, waiter)
+        assert pool.stats()["in_flight"] == 0 and pool.stats()["queued"] == 0
+        # a slot is free again
+        async with pool.slot():
+            pass
+        pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_overloaded_is_503_with_retry_after(services, monkeypatch):
+    testclient = pytest.importorskip('fastapi.testclient')
+    import app
+    client = testclient.TestClient(app.app)
+
+    async def overloaded(*args, **kwargs):
+        raise PoolOverloaded(7)
+
+    monkeypatch.setattr(services, 'enhance', overloaded)
+    monkeypatch.setattr(services, 'enhance_stream', overloaded)
+
+    response = client.post('/api/v2/enhance', content=b'image')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '7'
+
+    response = client.post('/api/enhance/', json=['aW1hZ2U='])
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '7'
+
+
+@pytest.mark.parametrize('max_bytes, cached', [(10 ** 7, True), (1000, False)])
+def test_streamed_png_holds_its_slot_until_sent(services, monkeypatch, max_bytes, cached):
+    monkeypatch.setattr(services, 'cache', ResultCache(max_bytes=max_bytes))
+    image = np.random.default_rng(0).integers(0, 256, (256, 256, 3), dtype=np.uint8)
+
+    async def scenario():
+        pool = WorkerPool(concurrency=1, max_queue=0)
+        await pool.acquire()
+        chunks = services._stream_png(services._Job('key', image=image), 1, release=pool.releaser())
+        data = b''.join(await pool.run(list, chunks))
+        # released from the encoding thread, through the event loop
+        await asyncio.sleep(0.01)
+        assert pool.stats()["in_flight"] == 0
+
+        # a stream dropped half way gives its slot back as well
+        await pool.acquire()
+        chunks = services._stream_png(services._Job('other', image=image), 1, release=pool.releaser())
+        next(chunks)
+        del chunks
+        await asyncio.sleep(0.01)
+        assert pool.stats()["in_flight"] == 0
+        pool.close()
+        return data
+
+    data = asyncio.run(scenario())
+    assert cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR).shape == image.shape
+    # only results that fit in the memory tier are kept while streaming
+    assert (services.cache.get('key') == data) if cached else services.cache.get('key') is None
+    assert services.cache.get('other') is None
@@ -0,0 +1,97 @@
+import asyncio
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolOverloaded(Exception):
+    """Raised when a request arrives while the pool's waiting queue is full."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Enhancement queue is full, retry after {retry_after}s.')
+        self.retry_after = retry_after
+
+
+class WorkerPool:
+    """Bounded pool for the CPU-bound parts of a request.
+
+    At most ``concurrency`` requests are processed at a time and at most
+    ``max_queue`` more may wait for a slot; anything beyond that is rejected
+    with ``PoolOverloaded`` instead of piling up. Blocking work (decode,
+    encode) is run on a dedicated thread pool so the event loop stays free.
+    Counters are only touched from the event loop thread.
+    """
+
+    def __init__(self, concurrency=4, max_queue=16, threads=2, retry_after=5):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='enhance')
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._in_flight = 0
+        self._queued = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold one of the ``concurrency`` processing slots for the duration of a request."""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self):
+        """Take a processing slot, waiting for one if needed; ``release`` gives it back."""
+        if self._semaphore.locked() and self._queued >= self.max_queue:
+            raise PoolOverloaded(self.retry_after)
+
+        self._queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._queued -= 1
+        self._in_flight += 1
+
+    def release(self):
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    def releaser(self):
+        """A function that gives back a slot the caller holds, from any thread and only on its first call.
+
+        For work that outlives the request handler, e.g. a response encoded
+        while it is streamed from Starlette's threads.
+        """
+        loop = asyncio.get_running_loop()
+        lock = threading.Lock()
+        held = [True]
+
+        def release():
+            with lock:
+                if not held[0]:
+                    return
+                held[0] = False
+            try:
+                loop.call_soon_threadsafe(self.release)
+            except RuntimeError:
+                # the event loop is closed already, the server is shutting down
+                pass
+
+        return release
+
+    async def run(self, fn, *args):
+        """Run a blocking function on the pool's threads."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def stats(self):
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)